@@ -26,13 +26,18 @@
 #include <vtkNew.h>
 #include <vtkObjectFactory.h>
 #include <vtkPolyLine.h>
+#include <vtkPointData.h>
+#include <vtkCellData.h>
+#include <vtkIdList.h>
+#include <vtkCleanPolyData.h>
 
 // STD includes
 #include <cassert>
+#include <map>
+#include <unordered_map>
 
 #include <vtkvmtkPolyDataCenterlineGroupsClipper.h>
 #include <vtkvmtkCenterlineBranchExtractor.h>
-#include <vtkvmtkPolyDataBranchUtilities.h>
 #include <vtkvmtkPolyDataBifurcationProfiles.h>
 
 // This class is based on vmtkbranchclipper.py and on vmtkbifurcationprofiles.py.
@@ -140,6 +145,7 @@ void vtkSlicerBranchClipperLogic::Execute()
   {
     this->Output->DeepCopy(clipper->GetClippedOutput());
   }
+  this->BuildBranchIndex();
   
   // Always compute the bifurcation profiles, it's fast enough.
   vtkNew<vtkvmtkPolyDataBifurcationProfiles> profiler;
@@ -165,34 +171,183 @@ void vtkSlicerBranchClipperLogic::Execute()
   }
 }
 
+//---------------------------------------------------------------------------
+void vtkSlicerBranchClipperLogic::BuildBranchIndex()
+{
+  this->BranchGroupIds.clear();
+  this->BranchCellOffsets.clear();
+  this->BranchCellIds.clear();
+  
+  vtkDataArray * groupIdsArray = this->Output->GetPointData()->GetArray(this->GroupIdsArrayName.c_str());
+  if (!groupIdsArray)
+  {
+    vtkErrorMacro("Group ids array not found in the output surface: " << this->GroupIdsArrayName);
+    return;
+  }
+  this->Output->BuildCells();
+  
+  /*
+   * As in vtkvmtkPolyDataBranchUtilities::ExtractGroup, a cell belongs to a
+   * group only if all its points have the group id; boundary cells whose
+   * points disagree are in no branch.
+   * Every group id of the points is a branch, as in GetGroupsIdList, even if
+   * it has no cell.
+   */
+  std::map<vtkIdType, std::vector<vtkIdType>> groups;
+  for (vtkIdType pointId = 0; pointId < this->Output->GetNumberOfPoints(); pointId++)
+  {
+    groups[static_cast<vtkIdType>(groupIdsArray->GetTuple1(pointId))];
+  }
+  vtkNew<vtkIdList> cellPointIds;
+  for (vtkIdType cellId = 0; cellId < this->Output->GetNumberOfCells(); cellId++)
+  {
+    this->Output->GetCellPoints(cellId, cellPointIds);
+    if (cellPointIds->GetNumberOfIds() == 0)
+    {
+      continue;
+    }
+    const vtkIdType groupId = static_cast<vtkIdType>(groupIdsArray->GetTuple1(cellPointIds->GetId(0)));
+    bool isInGroup = true;
+    for (vtkIdType j = 1; j < cellPointIds->GetNumberOfIds(); j++)
+    {
+      if (static_cast<vtkIdType>(groupIdsArray->GetTuple1(cellPointIds->GetId(j))) != groupId)
+      {
+        isInGroup = false;
+        break;
+      }
+    }
+    if (isInGroup)
+    {
+      groups[groupId].push_back(cellId);
+    }
+  }
+  
+  this->BranchGroupIds.reserve(groups.size());
+  this->BranchCellOffsets.reserve(groups.size() + 1);
+  this->BranchCellIds.reserve(this->Output->GetNumberOfCells());
+  this->BranchCellOffsets.push_back(0);
+  for (const auto& group : groups)
+  {
+    this->BranchGroupIds.push_back(group.first);
+    this->BranchCellIds.insert(this->BranchCellIds.end(), group.second.begin(), group.second.end());
+    this->BranchCellOffsets.push_back(this->BranchCellIds.size());
+  }
+}
+
 //---------------------------------------------------------------------------
 vtkIdType vtkSlicerBranchClipperLogic::GetNumberOfBranches()
 {
-  vtkNew<vtkvmtkPolyDataBranchUtilities> groupCounter;
-  vtkSmartPointer<vtkIdList> groupIds = vtkSmartPointer<vtkIdList>::New();
-  groupCounter->GetGroupsIdList(this->Output, this->GroupIdsArrayName.c_str(), groupIds);
-  return groupIds->GetNumberOfIds();
+  return this->BranchGroupIds.size();
 }
 
 //---------------------------------------------------------------------------
+vtkIdType vtkSlicerBranchClipperLogic::GetBranchGroupId(const vtkIdType index)
+{
+  if (index < 0 || index >= this->GetNumberOfBranches())
+  {
+    vtkErrorMacro("Branch index out of range: " << index);
+    return -1;
+  }
+  return this->BranchGroupIds[index];
+}
+
+//---------------------------------------------------------------------------
+namespace
+{
 /*
- * Don't provide the result of ExtractGroup as a return value.
- * Crash is guaranteed.
- * Let the caller provide a polydata.
+ * Copy a range of cells of 'input' with their point and cell data.
+ * Only the points used by these cells are copied, the output is compact.
+ * The input must have its cells built.
  */
-void vtkSlicerBranchClipperLogic::GetBranch(const vtkIdType index, vtkPolyData * surface)
+void ExtractBranchCells(vtkPolyData * input, const vtkIdType * cellIds, vtkIdType numberOfCells,
+                        vtkPolyData * output)
 {
-  vtkNew<vtkvmtkPolyDataBranchUtilities> groupCounter;
-  vtkSmartPointer<vtkIdList> groupIds = vtkSmartPointer<vtkIdList>::New();
-  groupCounter->GetGroupsIdList(this->Output, this->GroupIdsArrayName.c_str(), groupIds);
+  vtkPointData * inputPointData = input->GetPointData();
+  vtkCellData * inputCellData = input->GetCellData();
   
-  // ExtractGroup modifies its input.
-  vtkNew<vtkPolyData> input;
-  input->DeepCopy(this->Output);
+  output->Initialize();
+  vtkNew<vtkPoints> points;
+  points->SetDataType(input->GetPoints()->GetDataType());
+  output->SetPoints(points);
+  output->AllocateEstimate(numberOfCells, 3);
+  output->GetPointData()->CopyAllocate(inputPointData);
+  output->GetCellData()->CopyAllocate(inputCellData, numberOfCells);
   
-  vtkSmartPointer<vtkvmtkPolyDataBranchUtilities> splitter = vtkSmartPointer<vtkvmtkPolyDataBranchUtilities>::New();
-  splitter->ExtractGroup(input, this->GroupIdsArrayName.c_str(),
-                         groupIds->GetId(index), true, surface);
+  std::unordered_map<vtkIdType, vtkIdType> pointMap;
+  vtkNew<vtkIdList> cellPointIds;
+  vtkNew<vtkIdList> outputCellPointIds;
+  for (vtkIdType i = 0; i < numberOfCells; i++)
+  {
+    const vtkIdType cellId = cellIds[i];
+    input->GetCellPoints(cellId, cellPointIds);
+    outputCellPointIds->SetNumberOfIds(cellPointIds->GetNumberOfIds());
+    for (vtkIdType j = 0; j < cellPointIds->GetNumberOfIds(); j++)
+    {
+      const vtkIdType pointId = cellPointIds->GetId(j);
+      auto found = pointMap.find(pointId);
+      vtkIdType outputPointId = -1;
+      if (found == pointMap.end())
+      {
+        outputPointId = points->InsertNextPoint(input->GetPoint(pointId));
+        output->GetPointData()->CopyData(inputPointData, pointId, outputPointId);
+        pointMap[pointId] = outputPointId;
+      }
+      else
+      {
+        outputPointId = found->second;
+      }
+      outputCellPointIds->SetId(j, outputPointId);
+    }
+    const vtkIdType outputCellId = output->InsertNextCell(input->GetCellType(cellId), outputCellPointIds);
+    output->GetCellData()->CopyData(inputCellData, cellId, outputCellId);
+  }
+  output->Squeeze();
+}
+}
+
+//---------------------------------------------------------------------------
+/*
+ * Let the caller provide a polydata.
+ * The branch cells are read from the index, the output is not modified.
+ */
+void vtkSlicerBranchClipperLogic::GetBranch(const vtkIdType index, vtkPolyData * surface)
+{
+  if (!surface)
+  {
+    vtkErrorMacro("Target branch polydata is NULL");
+    return;
+  }
+  if (index < 0 || index >= this->GetNumberOfBranches())
+  {
+    vtkErrorMacro("Branch index out of range: " << index);
+    return;
+  }
+  const vtkIdType offset = this->BranchCellOffsets[index];
+  vtkNew<vtkPolyData> branchCells;
+  ExtractBranchCells(this->Output, this->BranchCellIds.data() + offset,
+                     this->BranchCellOffsets[index + 1] - offset, branchCells);
+  // Merge coincident points, as ExtractGroup did.
+  vtkNew<vtkCleanPolyData> cleaner;
+  cleaner->SetInputData(branchCells);
+  cleaner->Update();
+  surface->DeepCopy(cleaner->GetOutput());
+}
+
+//---------------------------------------------------------------------------
+void vtkSlicerBranchClipperLogic::GetBranches(vtkPolyDataCollection * branches)
+{
+  if (!branches)
+  {
+    vtkErrorMacro("Target branch collection is NULL");
+    return;
+  }
+  branches->RemoveAllItems();
+  for (vtkIdType i = 0; i < this->GetNumberOfBranches(); i++)
+  {
+    vtkSmartPointer<vtkPolyData> branch = vtkSmartPointer<vtkPolyData>::New();
+    this->GetBranch(i, branch);
+    branches->AddItem(branch);
+  }
 }
 
 //---------------------------------------------------------------------------
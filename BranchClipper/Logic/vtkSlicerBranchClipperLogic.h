@@ -31,6 +31,7 @@
 
 // STD includes
 #include <cstdlib>
+#include <vector>
 
 #include "vtkSlicerBranchClipperModuleLogicExport.h"
 
@@ -82,8 +83,15 @@ public:
   vtkGetObjectMacro(Output, vtkPolyData);
   vtkGetObjectMacro(OutputCenterlines, vtkPolyData);
   
+  /*
+   * The branches are indexed once at the end of Execute().
+   * Branch surfaces are extracted from the index, the output is not copied.
+   */
   vtkIdType GetNumberOfBranches();
+  vtkIdType GetBranchGroupId(const vtkIdType index);
   void GetBranch(const vtkIdType index, vtkPolyData * surface);
+  // All branches in a single pass over the output, ordered as GetBranch().
+  void GetBranches(vtkPolyDataCollection * branches);
 
   void Execute();
   
@@ -129,6 +137,12 @@ protected:
   vtkSmartPointer<vtkPolyData> Output = nullptr;
   vtkSmartPointer<vtkPolyData> OutputCenterlines = nullptr;
   
+  // Group ids in ascending order, and the output cell ids of each group.
+  void BuildBranchIndex();
+  std::vector<vtkIdType> BranchGroupIds;
+  std::vector<vtkIdType> BranchCellOffsets;
+  std::vector<vtkIdType> BranchCellIds;
+  
   // For bifurcation profiles.
   bool CreatePolyDataFromCell(vtkIdType cellId, vtkPolyData * profiledOutput, vtkPolyData * cellPolyData);
   
@@ -358,9 +358,12 @@ class ClipVesselLogic(ScriptedLoadableModuleLogic):
         return surfaceNode.GetPolyData()
     elif surfaceNode.IsA("vtkMRMLSegmentationNode"):
         # Segmentation node
+        # The closed surface is shared with other modules: return a copy, the caller may modify it.
+        from CrossSectionAnalysisLib.ClosedSurfaceCache import getClosedSurfaceCache
         polyData = vtk.vtkPolyData()
-        surfaceNode.CreateClosedSurfaceRepresentation()
-        surfaceNode.GetClosedSurfaceRepresentation(segmentId, polyData)
+        closedSurfacePolyData = getClosedSurfaceCache().getClosedSurfacePolyData(surfaceNode, segmentId)
+        if closedSurfacePolyData:
+            polyData.DeepCopy(closedSurfacePolyData)
         return polyData
     else:
         logging.error("Surface can only be loaded from model or segmentation node")
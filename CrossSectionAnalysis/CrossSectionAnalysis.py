@@ -6,8 +6,10 @@ from slicer.i18n import tr as _
 from slicer.i18n import translate
 
 import numpy as np
+from collections import OrderedDict
 from slicer.ScriptedLoadableModule import *
 from slicer.util import VTKObservationMixin
+from CrossSectionAnalysisLib.ClosedSurfaceCache import ClosedSurfaceCache, getClosedSurfaceCache
 
 """
   CrossSectionAnalysis: renamed from CenterlineMetrics, and merged with former deprecated CrossSectionAnalysis module.
@@ -58,6 +60,8 @@ class CrossSectionAnalysisWidget(ScriptedLoadableModuleWidget, VTKObservationMix
     self.maximumInscribedSphereColor = [0.2, 1.0, 0.4]
     self._parameterNode = None
     self._updatingGUIFromParameterNode = False
+    # (widget, enabled) of the widgets disabled while the logic is processing.
+    self._widgetsEnabledBeforeProcessing = []
     self._wallCrossSectionTypeMenu = qt.QMenu()
     self._wallCrossSectionTypeAction = None
 
@@ -331,7 +335,8 @@ class CrossSectionAnalysisWidget(ScriptedLoadableModuleWidget, VTKObservationMix
     The module GUI is updated to show the current state of the parameter node.
     """
 
-    if self._parameterNode is None or self._updatingGUIFromParameterNode:
+    # The inputs of the logic must not change while it is processing; the GUI is updated afterwards.
+    if self._parameterNode is None or self._updatingGUIFromParameterNode or self.logic.processing:
       return
 
     # Make sure GUI changes do not call updateParameterNodeFromGUI (it could cause infinite loop)
@@ -447,7 +452,30 @@ class CrossSectionAnalysisWidget(ScriptedLoadableModuleWidget, VTKObservationMix
     # Update/create the plot chart node in logic. There is no widget tracking the chart node.
     self.updatePlotChartNode(self._parameterNode)
 
+  def setProcessingWidgetsEnabled(self, enabled):
+    """
+    The events are processed while the cross-sections are computed, to abort with the Apply button.
+    The other input and browse widgets are disabled meanwhile, then restored to their previous state.
+    """
+    if not enabled:
+      widgets = [self.ui.parameterSetSelector, self.ui.parameterSetUpdateUIToolButton,
+                 self.ui.inputCenterlineSelector, self.ui.tubeDecimateToolButton, self.ui.segmentSelector,
+                 self.ui.outputTableSelector, self.ui.toggleTableLayoutButton,
+                 self.ui.outputPlotSeriesSelector, self.ui.togglePlotLayoutButton, self.ui.outputPlotSeriesTypeComboBox,
+                 self.ui.optionsCollapsibleGroupBox, self.ui.browseCollapsibleButton]
+      self._widgetsEnabledBeforeProcessing = [(widget, widget.enabled) for widget in widgets]
+      for widget in widgets:
+        widget.enabled = False
+    else:
+      for widget, wasEnabled in self._widgetsEnabledBeforeProcessing:
+        widget.enabled = wasEnabled
+      self._widgetsEnabledBeforeProcessing = []
+
   def onApply(self, replay = False):
+    # The button aborts a running computation.
+    if self.logic.processing:
+      self.logic.requestAbort()
+      return
     with slicer.util.tryWithErrorDisplay(_("Failed to compute results."), waitCursor=True):
       if not self.logic.isInputCenterlineValid():
         raise ValueError(_("Input is invalid."))
@@ -456,7 +484,15 @@ class CrossSectionAnalysisWidget(ScriptedLoadableModuleWidget, VTKObservationMix
         self.previousLayoutId = slicer.app.layoutManager().layout
         self.clearMetrics()
         self.createOutputNodes()
-        self.logic.run()
+        self.ui.applyButton.text = _("Abort")
+        self.setProcessingWidgetsEnabled(False)
+        try:
+          self.logic.run()
+        finally:
+          self.setProcessingWidgetsEnabled(True)
+          self.ui.applyButton.text = _("Apply")
+          # The parameter node may have been modified by a script meanwhile.
+          self.updateGUIFromParameterNode()
         self.onGoToOriginPoint()
 
       tableHasData = (self.logic.outputTableNode and self.logic.outputTableNode.GetNumberOfRows())
@@ -508,7 +544,8 @@ class CrossSectionAnalysisWidget(ScriptedLoadableModuleWidget, VTKObservationMix
 
     # Update table, to show distances relative to new origin.
     if self.logic.outputTableNode:
-        self.logic.updateOutputTable(self.logic.inputCenterlineNode, self.logic.outputTableNode)
+        if not self.logic.updateOutputTableColumns(self.logic.outputTableNode):
+          self.logic.updateOutputTable(self.logic.inputCenterlineNode, self.logic.outputTableNode)
         # Update plot view. Else X-axis always starts at 0, truncating the graph.
         firstPlotWidget = slicer.app.layoutManager().plotWidget(0)
         # The plot widget may be None if no plot has ever been shown.
@@ -680,7 +717,7 @@ class CrossSectionAnalysisWidget(ScriptedLoadableModuleWidget, VTKObservationMix
     self.setCurrentPointIndex(self.ui.moveToPointSliderWidget.value)
 
   def setCurrentPointIndex(self, value):
-    if not self.logic.isInputCenterlineValid():
+    if self.logic.processing or not self.logic.isInputCenterlineValid():
       return
     pointIndex = int(value)
 
@@ -1088,6 +1125,63 @@ class CrossSectionAnalysisWidget(ScriptedLoadableModuleWidget, VTKObservationMix
       # Set model color
       sphereModelDisplayNode.SetColor(self.maximumInscribedSphereColor)
 
+#
+# CrossSectionPolyDataCache
+#
+
+class CrossSectionPolyDataCache:
+  """Least recently used cross-section polydata, keyed by point index, within a memory budget."""
+  def __init__(self, maximumSizeBytes):
+    self.maximumSizeBytes = maximumSizeBytes
+    self.polyDatas = OrderedDict() # point index -> (polydata, size in bytes)
+    self.sizeBytes = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def __contains__(self, pointIndex):
+    return pointIndex in self.polyDatas
+
+  def __len__(self):
+    return len(self.polyDatas)
+
+  def get(self, pointIndex):
+    """Return the cached polydata or None, and count a hit or a miss."""
+    cached = self.polyDatas.get(pointIndex)
+    if cached is None:
+      self.misses += 1
+      return None
+    self.hits += 1
+    self.polyDatas.move_to_end(pointIndex)
+    return cached[0]
+
+  def put(self, pointIndex, polyData):
+    if pointIndex in self.polyDatas:
+      self.sizeBytes -= self.polyDatas.pop(pointIndex)[1]
+    size = polyData.GetActualMemorySize() * 1024 # kibibytes
+    self.polyDatas[pointIndex] = (polyData, size)
+    self.sizeBytes += size
+    self._evict()
+
+  def setMaximumSize(self, maximumSizeBytes):
+    self.maximumSizeBytes = maximumSizeBytes
+    self._evict()
+
+  def clear(self):
+    self.polyDatas.clear()
+    self.sizeBytes = 0
+
+  def getStatistics(self):
+    return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+            "count": len(self.polyDatas), "sizeBytes": self.sizeBytes}
+
+  def _evict(self):
+    # Keep the most recent item even if it is larger than the budget.
+    while self.sizeBytes > self.maximumSizeBytes and len(self.polyDatas) > 1:
+      _pointIndex, (_polyData, size) = self.polyDatas.popitem(last = False)
+      self.sizeBytes -= size
+      self.evictions += 1
+
 #
 # CrossSectionAnalysisLogic
 #
@@ -1115,16 +1209,36 @@ class CrossSectionAnalysisLogic(ScriptedLoadableModuleLogic):
     self.coordinateSystemColumnRAS = True  # LPS or RAS
     self.lumenSurfaceNode = None
     self.currentSegmentID = ""
-    self.lumenCrossSectionPolyDataCache = {}
-    self.wallCrossSectionPolyDataCache = {}
+    self.crossSectionCacheSizeMB = 256
+    self.lumenCrossSectionPolyDataCache = CrossSectionPolyDataCache(self.crossSectionCacheSizeMB * 1024 * 1024)
+    self.wallCrossSectionPolyDataCache = CrossSectionPolyDataCache(self.crossSectionCacheSizeMB * 1024 * 1024)
+    # Compute the next cross-sections in the scrub direction when the application is idle.
+    # They are computed on the main thread, one per event loop iteration: the slider may
+    # stall for the time of one cross-section if it is moved meanwhile. Keep the count small.
+    self.prefetchCrossSections = False
+    self.crossSectionPrefetchCount = 2
+    self.lastLumenCrossSectionPointIndex = None
+    self.lastWallCrossSectionPointIndex = None
+    # Incremented when the caches are reset: pending prefetches are dropped.
+    self.crossSectionCacheGeneration = 0
     self.wallSubtractLumenCrossSection = False
     self.decimatedWallPolyDataCache = None
+    # (geometry key, parallel transport frame polydata) of the input centerline.
+    self.centerlineFramePolyDataCache = None
     self.decimateTube = False
     self.showLumenCrossSection = False
     self.showWallCrossSection = False
     self.showMaximumInscribedSphere = False
     self.relativeOriginPointIndex = 0
     self.outputPlotSeriesType = MIS_DIAMETER
+    # Inputs that the output table columns were last computed with, see OUTPUT_TABLE_COLUMN_INPUTS.
+    self.outputTableInputs = None
+    # updateOutputTable is running, and may be aborted with requestAbort().
+    self.processing = False
+    self.abortRequested = False
+    # Geometric results of the last full table update: world points and cumulative distances.
+    self.outputTablePoints = None
+    self.outputTableCumulativeDistances = None
     # Slice browsing
     self.axialSliceNode = None
     self.longitudinalSliceNode = None
@@ -1170,8 +1284,9 @@ class CrossSectionAnalysisLogic(ScriptedLoadableModuleLogic):
       parameterNode.SetParameter(ROLE_INPUT_KERNEL_SIZE, str(1.1))
 
   def resetPolyDataCaches(self, all = True):
-    self.lumenCrossSectionPolyDataCache = {}
-    self.wallCrossSectionPolyDataCache = {}
+    self.lumenCrossSectionPolyDataCache.clear()
+    self.wallCrossSectionPolyDataCache.clear()
+    self.crossSectionCacheGeneration += 1
     if (all):
       self.decimatedWallPolyDataCache = None
 
@@ -1179,6 +1294,7 @@ class CrossSectionAnalysisLogic(ScriptedLoadableModuleLogic):
     if self.inputCenterlineNode == centerlineNode:
       return
     self.inputCenterlineNode = centerlineNode
+    self.centerlineFramePolyDataCache = None
     self.resetPolyDataCaches()
     self.relativeOriginPointIndex = 0
 
@@ -1193,6 +1309,7 @@ class CrossSectionAnalysisLogic(ScriptedLoadableModuleLogic):
     if self.outputTableNode == tableNode:
       return
     self.outputTableNode = tableNode
+    self.outputTableInputs = None
 
   def setOutputPlotSeriesNode(self, plotSeriesNode):
     if self.outputPlotSeriesNode == plotSeriesNode:
@@ -1288,16 +1405,26 @@ class CrossSectionAnalysisLogic(ScriptedLoadableModuleLogic):
         return self.inputCenterlineNode.GetCurvePointsWorld().GetNumberOfPoints()
 
   def run(self):
-    self.resetPolyDataCaches()
     if not self.isInputCenterlineValid():
         msg = _("Input is invalid.")
         slicer.util.showStatusMessage(msg, 3000)
         raise ValueError(msg)
 
     logging.info(_("Processing started"))
-    if self.outputTableNode:
+    if self.outputTableNode and self.updateOutputTableColumns(self.outputTableNode):
+      logging.info(_("Only the distance and coordinate columns have been updated."))
+    elif self.outputTableNode:
+      self.resetPolyDataCaches()
       self.emptyOutputTableNode()
-      self.updateOutputTable(self.inputCenterlineNode, self.outputTableNode)
+      self.processing = True
+      try:
+        completed = self.updateOutputTable(self.inputCenterlineNode, self.outputTableNode)
+      finally:
+        self.processing = False
+      if not completed:
+        return
+    else:
+      self.resetPolyDataCaches()
     if self.outputPlotSeriesNode:
       self.updatePlot(self.outputPlotSeriesNode, self.outputTableNode)
     logging.info(_("Processing completed"))
@@ -1307,6 +1434,7 @@ class CrossSectionAnalysisLogic(ScriptedLoadableModuleLogic):
     while self.outputTableNode.GetTable().GetNumberOfColumns():
         self.outputTableNode.GetTable().RemoveColumn(0)
     self.outputTableNode.GetTable().Modified()
+    self.outputTableInputs = None
 
   def getLumenExtractionMode(self):
     import vtkSlicerCrossSectionAnalysisModuleLogicPython as vtkSlicerCrossSectionAnalysisModuleLogic
@@ -1347,9 +1475,117 @@ class CrossSectionAnalysisLogic(ScriptedLoadableModuleLogic):
     outputTable.AddColumn(columnArray)
     return columnArray
 
+  def getOutputTableInputs(self):
+    """The inputs that each group of output table columns depends on.
+    """
+    lumenKey = None
+    if self.lumenSurfaceNode:
+      if self.lumenSurfaceNode.IsTypeOf("vtkMRMLSegmentationNode"):
+        lumenKey = (self.lumenSurfaceNode.GetID(), self.currentSegmentID,
+                    ClosedSurfaceCache.getSurfaceKey(self.lumenSurfaceNode, self.currentSegmentID) if self.currentSegmentID else None)
+      else:
+        polyData = self.lumenSurfaceNode.GetPolyData()
+        lumenKey = (self.lumenSurfaceNode.GetID(), polyData.GetMTime() if polyData else 0)
+      lumenKey += (self._getTransformToWorldKey(self.lumenSurfaceNode),)
+    return {
+      OUTPUT_TABLE_GEOMETRY : (self._getCenterlineGeometryKey(), lumenKey, self.decimateTube, self.getLumenExtractionMode()),
+      OUTPUT_TABLE_ORIGIN : self.relativeOriginPointIndex,
+      OUTPUT_TABLE_COORDINATES : (self.coordinateSystemColumnRAS, self.coordinateSystemColumnSingle)
+      }
+
+  def updateOutputTableColumns(self, outputTable):
+    """Rewrite only the columns whose inputs have changed since the last full update.
+    Returns False if the cross-sections must be computed again with updateOutputTable.
+    """
+    if (not self.isInputCenterlineValid()) or (self.outputTableInputs is None) or (outputTable is not self.outputTableNode):
+      return False
+    if (outputTable.GetTable().GetNumberOfRows() != len(self.outputTablePoints)) or (not outputTable.GetTable().GetColumnByName(DISTANCE_ARRAY_NAME)):
+      return False
+    inputs = self.getOutputTableInputs()
+    if inputs[OUTPUT_TABLE_GEOMETRY] != self.outputTableInputs[OUTPUT_TABLE_GEOMETRY]:
+      return False
+    if inputs[OUTPUT_TABLE_ORIGIN] != self.outputTableInputs[OUTPUT_TABLE_ORIGIN]:
+      self.updateDistanceColumn(outputTable)
+    if inputs[OUTPUT_TABLE_COORDINATES] != self.outputTableInputs[OUTPUT_TABLE_COORDINATES]:
+      for arrayName in OUTPUT_TABLE_COLUMN_INPUTS[OUTPUT_TABLE_COORDINATES]:
+        outputTable.GetTable().RemoveColumnByName(arrayName)
+      self.updateCoordinateColumns(outputTable, self.outputTablePoints)
+    self.outputTableInputs = inputs
+    outputTable.GetTable().Modified()
+    return True
+
+  def updateDistanceColumn(self, outputTable):
+    from vtk.util.numpy_support import vtk_to_numpy
+    distanceArray = self.getArrayFromTable(outputTable, DISTANCE_ARRAY_NAME)
+    relativeOriginPointIndex = min(int(self.relativeOriginPointIndex), len(self.outputTableCumulativeDistances) - 1)
+    vtk_to_numpy(distanceArray)[:] = self.outputTableCumulativeDistances - self.outputTableCumulativeDistances[relativeOriginPointIndex]
+    distanceArray.Modified()
+
+  def getCoordinateArraysFromTable(self, outputTable):
+    if self.coordinateSystemColumnSingle:
+        coordinatesArray = self.getArrayFromTable(outputTable, "RAS" if self.coordinateSystemColumnRAS else "LPS")
+        coordinatesArray.SetNumberOfComponents(3)
+        coordinatesArray.SetComponentName(0, "R" if self.coordinateSystemColumnRAS else "L")
+        coordinatesArray.SetComponentName(1, "A" if self.coordinateSystemColumnRAS else "P")
+        coordinatesArray.SetComponentName(2, "S")
+        # Add a custom attribute to the table. We may easily know how the coordinates are stored.
+        outputTable.SetAttribute("columnSingle", "y")
+    else:
+      coordinatesArray = [
+        self.getArrayFromTable(outputTable, "R" if self.coordinateSystemColumnRAS else "L"),
+        self.getArrayFromTable(outputTable, "A" if self.coordinateSystemColumnRAS else "P"),
+        self.getArrayFromTable(outputTable, "S")
+        ]
+      outputTable.SetAttribute("columnSingle", "n")
+    # Custom attribute for quick access to coordinates type.
+    outputTable.SetAttribute("type", "RAS" if self.coordinateSystemColumnRAS else "LPS")
+    return coordinatesArray
+
+  def updateCoordinateColumns(self, outputTable, points):
+    from vtk.util.numpy_support import vtk_to_numpy
+    coordinatesArray = self.getCoordinateArraysFromTable(outputTable)
+    # Convert point coordinates
+    coordinateValues = points if self.coordinateSystemColumnRAS else points * [-1.0, -1.0, 1.0]
+    if self.coordinateSystemColumnSingle:
+      # A column added to a filled table gets its tuple count before its number of components.
+      coordinatesArray.SetNumberOfTuples(len(points))
+      vtk_to_numpy(coordinatesArray)[:] = coordinateValues
+      coordinatesArray.Modified()
+    else:
+      for component in range(3):
+        vtk_to_numpy(coordinatesArray[component])[:] = coordinateValues[:, component]
+        coordinatesArray[component].Modified()
+
+  def requestAbort(self):
+    """Stop the cross-section computation of updateOutputTable at the next progress event.
+    """
+    self.abortRequested = True
+
+  def _onCrossSectionComputeProgress(self, caller, event):
+    # Called from the main thread; the status message processes the pending events, e.g. a click to abort.
+    self.showStatusMessage((_("Computing cross-sections:"), str(round(caller.GetProgress() * 100)), "%"))
+    if self.abortRequested:
+      caller.AbortExecuteOn()
+
+  def _discardOutputTable(self, outputTable):
+    while outputTable.GetTable().GetNumberOfColumns():
+      outputTable.GetTable().RemoveColumn(0)
+    outputTable.GetTable().SetNumberOfRows(0)
+    outputTable.GetTable().Modified()
+    self.outputTableInputs = None
+    message = _("Processing aborted.")
+    logging.info(message)
+    slicer.util.showStatusMessage(message, 5000)
+    return False
+
   def updateOutputTable(self, inputCenterline, outputTable):
+    """Returns False if the computation has been aborted with requestAbort().
+    """
     import time
     startTime = time.time()
+    self.abortRequested = False
+    self.outputTableInputs = None
+    outputTableInputs = self.getOutputTableInputs()
     # Create arrays of data
     distanceArray = self.getArrayFromTable(outputTable, DISTANCE_ARRAY_NAME)
     if (not inputCenterline.IsTypeOf("vtkMRMLMarkupsShapeNode")):
@@ -1376,30 +1612,21 @@ class CrossSectionAnalysisLogic(ScriptedLoadableModuleLogic):
         ceDiameterArray = self.getArrayFromTable(outputTable, CE_DIAMETER_ARRAY_NAME)
         crossSectionAreaArray = self.getArrayFromTable(outputTable, LUMEN_CROSS_SECTION_AREA_ARRAY_NAME)
 
-    if self.coordinateSystemColumnSingle:
-        coordinatesArray = self.getArrayFromTable(outputTable, "RAS" if self.coordinateSystemColumnRAS else "LPS")
-        coordinatesArray.SetNumberOfComponents(3)
-        coordinatesArray.SetComponentName(0, "R" if self.coordinateSystemColumnRAS else "L")
-        coordinatesArray.SetComponentName(1, "A" if self.coordinateSystemColumnRAS else "P")
-        coordinatesArray.SetComponentName(2, "S")
-        # Add a custom attribute to the table. We may easily know how the coordinates are stored.
-        outputTable.SetAttribute("columnSingle", "y")
-    else:
-      coordinatesArray = [
-        self.getArrayFromTable(outputTable, "R" if self.coordinateSystemColumnRAS else "L"),
-        self.getArrayFromTable(outputTable, "A" if self.coordinateSystemColumnRAS else "P"),
-        self.getArrayFromTable(outputTable, "S")
-        ]
-      outputTable.SetAttribute("columnSingle", "n")
-    # Custom attribute for quick access to coordinates type.
-    outputTable.SetAttribute("type", "RAS" if self.coordinateSystemColumnRAS else "LPS")
+    self.getCoordinateArraysFromTable(outputTable)
 
+    from vtk.util.numpy_support import vtk_to_numpy
     if (inputCenterline.IsTypeOf("vtkMRMLModelNode")):
-        pointsLocal = slicer.util.arrayFromModelPoints(inputCenterline)
-        points = np.zeros(pointsLocal.shape)
+        modelPoints = inputCenterline.GetPolyData().GetPoints()
+        if inputCenterline.GetParentTransformNode():
+          # Transform all points at once instead of calling TransformPointToWorld per point.
+          modelTransformToWorld = vtk.vtkGeneralTransform()
+          slicer.vtkMRMLTransformNode.GetTransformBetweenNodes(inputCenterline.GetParentTransformNode(), None, modelTransformToWorld)
+          worldPoints = vtk.vtkPoints()
+          worldPoints.SetDataTypeToDouble()
+          modelTransformToWorld.TransformPoints(modelPoints, worldPoints)
+          modelPoints = worldPoints
+        points = np.array(vtk_to_numpy(modelPoints.GetData()), dtype = np.float64)
         numberOfPoints = len(points)
-        for pointIndex in range(len(pointsLocal)):
-          inputCenterline.TransformPointToWorld(pointsLocal[pointIndex], points[pointIndex])
         if inputCenterline.HasPointScalarName("Radius"):
           radii = slicer.util.arrayFromModelPointData(inputCenterline, 'Radius')
         else:
@@ -1413,14 +1640,8 @@ class CrossSectionAnalysisLogic(ScriptedLoadableModuleLogic):
           else:
             numberOfPoints = trimmedSpline.GetNumberOfPoints()
             trimmedSplineAvailable = True
-          points = np.zeros([numberOfPoints, 3])
-          for p in range(numberOfPoints):
-            point = np.zeros(3)
-            if not trimmedSplineAvailable:
-              inputCenterline.GetSplineWorld().GetPoint(p, point)
-            else:
-              trimmedSpline.GetPoint(p, point)
-            points[p] = point
+          splinePoints = trimmedSpline.GetPoints() if trimmedSplineAvailable else inputCenterline.GetSplineWorld().GetPoints()
+          points = np.array(vtk_to_numpy(splinePoints.GetData()), dtype = np.float64)
         else: # VMTK curve centerline or arbitrary curve centerline
           points = slicer.util.arrayFromMarkupsCurvePoints(inputCenterline, world=True)
           controlPointFloatIndices = inputCenterline.GetCurveWorld().GetPointData().GetArray('PedigreeIDs')
@@ -1430,16 +1651,9 @@ class CrossSectionAnalysisLogic(ScriptedLoadableModuleLogic):
         radiusMeasurement = inputCenterline.GetMeasurement("Radius")
         controlPointRadiusValues = vtk.vtkDoubleArray()
         if radiusMeasurement: # VMTK curve centerline
-            controlPointRadiusValues = inputCenterline.GetMeasurement('Radius').GetControlPointValues()
-            for pointIndex in range(numberOfPoints-1):
-                controlPointFloatIndex = controlPointFloatIndices.GetValue(pointIndex)
-                controlPointIndexA = int(controlPointFloatIndex)
-                controlPointIndexB = controlPointIndexA + 1
-                radiusA = controlPointRadiusValues.GetValue(controlPointIndexA)
-                radiusB = controlPointRadiusValues.GetValue(controlPointIndexB)
-                radius = radiusA * (controlPointFloatIndex - controlPointIndexA) + radiusB * (controlPointIndexB - controlPointFloatIndex)
-                radii[pointIndex] = radius
-            radii[numberOfPoints-1] = controlPointRadiusValues.GetValue(controlPointRadiusValues.GetNumberOfValues()-1)
+            controlPointRadiusValues = vtk_to_numpy(inputCenterline.GetMeasurement('Radius').GetControlPointValues())
+            radii = self.interpolateControlPointRadii(controlPointRadiusValues,
+                                                      vtk_to_numpy(controlPointFloatIndices)[:numberOfPoints - 1])
         else:
           radii = np.zeros(0)
 
@@ -1449,22 +1663,16 @@ class CrossSectionAnalysisLogic(ScriptedLoadableModuleLogic):
     Fill in cross-section areas in C++ threads.
     """
     lumenHasEmptySections = False
+    tubeHasEmptySections = False
     import vtkSlicerCrossSectionAnalysisModuleLogicPython as vtkSlicerCrossSectionAnalysisModuleLogic
     crossSectionCompute = vtkSlicerCrossSectionAnalysisModuleLogic.vtkCrossSectionCompute()
     # If numberOfThreads > number of cores, excessive threads would be in infinite loop.
     numberOfThreads = os.cpu_count() if (numberOfPoints >= os.cpu_count()) else numberOfPoints
     crossSectionCompute.SetNumberOfThreads(numberOfThreads)
-    if self.isInputCenterlineValid():
-        if inputCenterline.IsTypeOf("vtkMRMLModelNode"):
-            crossSectionCompute.SetInputCenterlinePolyData(inputCenterline.GetPolyData())
-        elif inputCenterline.IsTypeOf("vtkMRMLMarkupsShapeNode"):
-            trimmedSpline = vtk.vtkPolyData()
-            if not inputCenterline.GetTrimmedSplineWorld(trimmedSpline):
-              crossSectionCompute.SetInputCenterlinePolyData(inputCenterline.GetSplineWorld())
-            else:
-              crossSectionCompute.SetInputCenterlinePolyData(trimmedSpline)
-        else:
-            crossSectionCompute.SetInputCenterlinePolyData(inputCenterline.GetCurveWorld())
+    # The frame of the centerline is computed once and shared with slice browsing.
+    centerlineFramePolyData = self.getCenterlineFramePolyData()
+    if centerlineFramePolyData:
+        crossSectionCompute.SetInputCenterlineFramePolyData(centerlineFramePolyData)
     if self.lumenSurfaceNode:
         lumenSurface = vtk.vtkPolyData()
         self.getLumenClosedSurfacePolyData(lumenSurface)
@@ -1473,12 +1681,29 @@ class CrossSectionAnalysisLogic(ScriptedLoadableModuleLogic):
         emptySectionIds = vtk.vtkIdList()
         # If there is a Tube and a lumen (model or segment) clipped in the module, use AllRegions, else ClosestPoint.
         extractionMode = self.getLumenExtractionMode()
-        if (not crossSectionCompute.UpdateTable(crossSectionAreaArray, ceDiameterArray, emptySectionIds, extractionMode)):
+        crossSectionCompute.AddObserver(vtk.vtkCommand.ProgressEvent, self._onCrossSectionComputeProgress)
+        if inputCenterline.IsTypeOf("vtkMRMLMarkupsShapeNode"):
+          # Cut the wall and the lumen at the same planes in one pass; the stenosis columns are filled too.
+          wallSurface = vtk.vtkPolyData()
+          self.getWallClosedSurfacePolyData(wallSurface, self.decimateTube)
+          crossSectionCompute.SetInputWallSurfacePolyData(wallSurface)
+          wallEmptySectionIds = vtk.vtkIdList()
+          completed = crossSectionCompute.UpdateWallAndLumenTable(crossSectionAreaArray, ceDiameterArray,
+                                                                  wallCrossSectionAreaArray, wallDiameterArray,
+                                                                  diameterStenosisArray, surfaceAreaStenosisArray, None,
+                                                                  emptySectionIds, wallEmptySectionIds, extractionMode)
+        else:
+          completed = crossSectionCompute.UpdateTable(crossSectionAreaArray, ceDiameterArray, emptySectionIds, extractionMode)
+        if (not completed):
+          if crossSectionCompute.GetAbortExecute():
+            return self._discardOutputTable(outputTable)
           raise RuntimeError("Failed to compute cross-sections.")
         surfaceName = self.lumenSurfaceNode.GetName()
         if self.lumenSurfaceNode.IsTypeOf("vtkMRMLSegmentationNode") and self.currentSegmentID:
           surfaceName = surfaceName + " - " + self.lumenSurfaceNode.GetSegmentation().GetSegment(self.currentSegmentID).GetName()
-        lumenHasEmptySections = self._informAboutEmptySections(emptySectionIds, surfaceName)
+        lumenHasEmptySections = self._informAboutEmptySections(emptySectionIds, surfaceName, crossSectionCompute.GetReport())
+        if inputCenterline.IsTypeOf("vtkMRMLMarkupsShapeNode"):
+          tubeHasEmptySections = self._informAboutEmptySections(wallEmptySectionIds, inputCenterline.GetName(), crossSectionCompute.GetWallReport())
 
     """
     We may also use the TubeRadius scalar array of the spline. This may prevent
@@ -1486,59 +1711,38 @@ class CrossSectionAnalysisLogic(ScriptedLoadableModuleLogic):
     We elect to slice the wall so as to use the same method of slicing the lumen.
     Good ? Bad ?
     """
-    tubeHasEmptySections = False
-    if inputCenterline.IsTypeOf("vtkMRMLMarkupsShapeNode"):
+    if inputCenterline.IsTypeOf("vtkMRMLMarkupsShapeNode") and (not self.lumenSurfaceNode):
       wallCrossSectionCompute = vtkSlicerCrossSectionAnalysisModuleLogic.vtkCrossSectionCompute()
       wallCrossSectionCompute.SetNumberOfThreads(numberOfThreads)
       wallSurface = vtk.vtkPolyData()
       self.getWallClosedSurfacePolyData(wallSurface, self.decimateTube)
       wallCrossSectionCompute.SetInputSurfacePolyData(wallSurface)
-      trimmedSpline = vtk.vtkPolyData()
-      if not inputCenterline.GetTrimmedSplineWorld(trimmedSpline):
-        wallCrossSectionCompute.SetInputCenterlinePolyData(inputCenterline.GetSplineWorld())
-      else:
-        wallCrossSectionCompute.SetInputCenterlinePolyData(trimmedSpline)
+      wallCrossSectionCompute.SetInputCenterlineFramePolyData(self.getCenterlineFramePolyData())
       self.showStatusMessage((_("Waiting for background jobs..."), ))
       wallEmptySectionIds = vtk.vtkIdList()
+      wallCrossSectionCompute.AddObserver(vtk.vtkCommand.ProgressEvent, self._onCrossSectionComputeProgress)
       if (not wallCrossSectionCompute.UpdateTable(wallCrossSectionAreaArray, wallDiameterArray, wallEmptySectionIds)):
+        if wallCrossSectionCompute.GetAbortExecute():
+          return self._discardOutputTable(outputTable)
         raise RuntimeError("Failed to compute cross-sections.")
-      tubeHasEmptySections = self._informAboutEmptySections(wallEmptySectionIds, inputCenterline.GetName())
+      tubeHasEmptySections = self._informAboutEmptySections(wallEmptySectionIds, inputCenterline.GetName(), wallCrossSectionCompute.GetReport())
 
     cumArray = vtk.vtkDoubleArray()
     self.cumulateDistances(points, cumArray)
+    # Keep the geometric results: the distance and coordinate columns can then be rewritten alone.
+    self.outputTablePoints = points
+    self.outputTableCumulativeDistances = np.array(vtk_to_numpy(cumArray))
     relArray = vtk.vtkDoubleArray()
     self.updateCumulativeDistancesToRelativeOrigin(cumArray, relArray)
 
-    for i in range(numberOfPoints):
-      if (((i + 1) % 25) == 0):
-          self.showStatusMessage((_("Updating table:"), str(i + 1), "/", str(numberOfPoints)))
-      # Distance from relative origin
-      distanceArray.SetValue(i, relArray.GetValue(i))
-      # Radii
-      if radii.size and misDiameterArray:
-            misDiameterArray.SetValue(i, radii[i] * 2)
-      # Diameter and surface area stenosis
-      if (inputCenterline.IsTypeOf("vtkMRMLMarkupsShapeNode")) and self.lumenSurfaceNode:
-        # The resolution of the Tube may be too low and can be increased.
-        diameterStenosis = -1.0
-        surfaceAreaStenosis = -1.0
-        if (wallDiameterArray.GetValue(i)) and (wallCrossSectionAreaArray.GetValue(i)):
-          diameterStenosis = ((wallDiameterArray.GetValue(i) - ceDiameterArray.GetValue(i)) / wallDiameterArray.GetValue(i)) * 100
-          surfaceAreaStenosis = ((wallCrossSectionAreaArray.GetValue(i) - crossSectionAreaArray.GetValue(i)) / wallCrossSectionAreaArray.GetValue(i)) * 100
-        # vtkCrossSectionCompute has already provided the indices; don't flood the console.
-        surfaceAreaStenosisArray.SetValue(i, surfaceAreaStenosis)
-        diameterStenosisArray.SetValue(i, diameterStenosis)
-      # Convert each point coordinate
-      if self.coordinateSystemColumnRAS:
-        coordinateValues = points[i]
-      else:
-        coordinateValues = [-points[i][0], -points[i][1], points[i][2]]
-      if self.coordinateSystemColumnSingle:
-          coordinatesArray.SetTuple3(i, coordinateValues[0], coordinateValues[1], coordinateValues[2])
-      else:
-          coordinatesArray[0].SetValue(i, coordinateValues[0])
-          coordinatesArray[1].SetValue(i, coordinateValues[1])
-          coordinatesArray[2].SetValue(i, coordinateValues[2])
+    # The table columns are filled through numpy views of the VTK arrays.
+    # Distance from relative origin
+    vtk_to_numpy(distanceArray)[:] = vtk_to_numpy(relArray)
+    # Radii
+    if radii.size and misDiameterArray:
+      vtk_to_numpy(misDiameterArray)[:] = radii * 2
+    # Diameter and surface area stenosis have been computed with the wall and lumen sections.
+    self.updateCoordinateColumns(outputTable, points)
 
     distanceArray.Modified()
     if misDiameterArray:
@@ -1548,10 +1752,12 @@ class CrossSectionAnalysisLogic(ScriptedLoadableModuleLogic):
       wallCrossSectionAreaArray.Modified()
       if self.lumenSurfaceNode:
         surfaceAreaStenosisArray.Modified()
+        diameterStenosisArray.Modified()
     if self.lumenSurfaceNode:
       crossSectionAreaArray.Modified()
       ceDiameterArray.Modified()
     outputTable.GetTable().Modified()
+    self.outputTableInputs = outputTableInputs
 
     stopTime = time.time()
     durationValue = '%.2f' % (stopTime-startTime)
@@ -1559,6 +1765,7 @@ class CrossSectionAnalysisLogic(ScriptedLoadableModuleLogic):
     message = _("Processing completed in {duration} seconds - {countOfPoints} points.{hasEmptySections}").format(duration=durationValue, countOfPoints=numberOfPoints, hasEmptySections=emptySectionMessage)
     logging.info(message)
     slicer.util.showStatusMessage(message, 5000)
+    return True
 
   def updatePlot(self, outputPlotSeries, outputTable):
 
@@ -1651,22 +1858,37 @@ class CrossSectionAnalysisLogic(ScriptedLoadableModuleLogic):
     # Plot series is not visible
     return False
 
+  @staticmethod
+  def interpolateControlPointRadii(controlPointRadiusValues, controlPointFloatIndexValues):
+    """Radii at the curve points, from the radii at the control points and the
+    fractional control point index of each curve point but the last one.
+    The last curve point gets the radius of the last control point.
+    """
+    controlPointIndicesA = controlPointFloatIndexValues.astype(np.int64)
+    # A curve point at the last control point has no next control point.
+    controlPointIndicesB = np.minimum(controlPointIndicesA + 1, len(controlPointRadiusValues) - 1)
+    radii = np.zeros(len(controlPointFloatIndexValues) + 1)
+    radii[:-1] = (controlPointRadiusValues[controlPointIndicesA] * (controlPointFloatIndexValues - controlPointIndicesA)
+                  + controlPointRadiusValues[controlPointIndicesB] * (controlPointIndicesA + 1 - controlPointFloatIndexValues))
+    radii[-1] = controlPointRadiusValues[-1]
+    return radii
+
   def cumulateDistances(self, arrPoints, cumArray):
+    from vtk.util.numpy_support import vtk_to_numpy
     cumArray.SetNumberOfValues(len(arrPoints))
-    previous = arrPoints[0]
-    dist = 0
-    for i, point in enumerate(arrPoints):
-      # https://stackoverflow.com/questions/1401712/how-can-the-euclidean-distance-be-calculated-with-numpy
-      dist += np.linalg.norm(point - previous)
-      cumArray.SetValue(i, dist)
-      previous = point
+    if not len(arrPoints):
+      return
+    cumulativeDistances = vtk_to_numpy(cumArray)
+    cumulativeDistances[0] = 0.0
+    cumulativeDistances[1:] = np.cumsum(np.linalg.norm(np.diff(arrPoints, axis = 0), axis = 1))
+    cumArray.Modified()
 
   def updateCumulativeDistancesToRelativeOrigin(self, cumArray, relArray):
+    from vtk.util.numpy_support import vtk_to_numpy
     distanceAtRelativeOrigin = cumArray.GetValue(self.relativeOriginPointIndex)
-    numberOfValues = cumArray.GetNumberOfValues()
-    relArray.SetNumberOfValues(numberOfValues)
-    for i in range(numberOfValues):
-      relArray.SetValue(i, cumArray.GetValue(i) - distanceAtRelativeOrigin)
+    relArray.SetNumberOfValues(cumArray.GetNumberOfValues())
+    vtk_to_numpy(relArray)[:] = vtk_to_numpy(cumArray) - distanceAtRelativeOrigin
+    relArray.Modified()
 
   def getCurvePointPositionAtIndex(self, value):
     """Get the coordinates of a point of the centerline as RAS. value is index of point.
@@ -1766,23 +1988,67 @@ class CrossSectionAnalysisLogic(ScriptedLoadableModuleLogic):
     splitString = displayString.split()
     return splitString[len(splitString) - 1]
 
+  def _getCenterlineGeometryKey(self):
+    """Changes whenever the geometry of the input centerline may have changed.
+    """
+    centerlineNode = self.inputCenterlineNode
+    if centerlineNode.IsTypeOf("vtkMRMLModelNode"):
+      geometry = centerlineNode.GetPolyData()
+    elif centerlineNode.IsTypeOf("vtkMRMLMarkupsShapeNode"):
+      # Trimming parameters are tracked by the node's modified time.
+      geometry = centerlineNode.GetSplineWorld()
+    else:
+      geometry = centerlineNode.GetCurveWorld()
+    return (centerlineNode.GetID(), centerlineNode.GetMTime(), geometry.GetMTime() if geometry else 0,
+            self._getTransformToWorldKey(centerlineNode))
+
+  @staticmethod
+  def _getTransformToWorldKey(node):
+    """Changes whenever a parent transform of the node is replaced or modified.
+    Editing a transform does not modify the transformed nodes.
+    """
+    key = []
+    transformNode = node.GetParentTransformNode()
+    while transformNode:
+      transformToParent = transformNode.GetTransformToParent()
+      key.append((transformNode.GetID(), transformToParent.GetMTime() if transformToParent else 0))
+      transformNode = transformNode.GetParentTransformNode()
+    return tuple(key)
+
+  def getCenterlineFramePolyData(self):
+    """Get the centerline with its parallel transport frame.
+    It is computed once per geometry of the input centerline, and is shared
+    with vtkCrossSectionCompute.
+    """
+    if not self.isInputCenterlineValid():
+      return None
+    key = self._getCenterlineGeometryKey()
+    if self.centerlineFramePolyDataCache and (self.centerlineFramePolyDataCache[0] == key):
+      return self.centerlineFramePolyDataCache[1]
+
+    if self.inputCenterlineNode.IsTypeOf("vtkMRMLModelNode"):
+      centerlinePolyData = self.inputCenterlineNode.GetPolyData()
+    elif self.inputCenterlineNode.IsTypeOf("vtkMRMLMarkupsShapeNode"):
+      centerlinePolyData = vtk.vtkPolyData()
+      if not self.inputCenterlineNode.GetTrimmedSplineWorld(centerlinePolyData):
+        centerlinePolyData = self.inputCenterlineNode.GetSplineWorld()
+    else:
+      centerlinePolyData = self.inputCenterlineNode.GetCurveWorld()
+    import vtkSlicerCrossSectionAnalysisModuleLogicPython as vtkSlicerCrossSectionAnalysisModuleLogic
+    crossSectionCompute = vtkSlicerCrossSectionAnalysisModuleLogic.vtkCrossSectionCompute()
+    crossSectionCompute.SetInputCenterlinePolyData(centerlinePolyData)
+    centerlineFramePolyData = crossSectionCompute.GetCenterlineFramePolyData()
+    self.centerlineFramePolyDataCache = (key, centerlineFramePolyData)
+    return centerlineFramePolyData
+
   def getCurvePointToWorldTransformAtPointIndex(self, pointIndex):
 
     curvePointToWorld = vtk.vtkMatrix4x4()
     if self.inputCenterlineNode.IsTypeOf("vtkMRMLModelNode") or self.inputCenterlineNode.IsTypeOf("vtkMRMLMarkupsShapeNode"):
       curveCoordinateSystemGenerator = slicer.vtkParallelTransportFrame()
-      if self.inputCenterlineNode.IsTypeOf("vtkMRMLModelNode"):
-        curveCoordinateSystemGenerator.SetInputData(self.inputCenterlineNode.GetPolyData())
-      else:
-        if not self.isInputCenterlineValid():
-          return
-        trimmedSpline = vtk.vtkPolyData()
-        if not self.inputCenterlineNode.GetTrimmedSplineWorld(trimmedSpline):
-          curveCoordinateSystemGenerator.SetInputData(self.inputCenterlineNode.GetSplineWorld())
-        else:
-          curveCoordinateSystemGenerator.SetInputData(trimmedSpline)
-      curveCoordinateSystemGenerator.Update()
-      curvePoly = curveCoordinateSystemGenerator.GetOutput()
+      curvePoly = self.getCenterlineFramePolyData()
+      if curvePoly is None:
+        return
       pointData = curvePoly.GetPointData()
       normals = pointData.GetAbstractArray(curveCoordinateSystemGenerator.GetNormalsArrayName())
       binormals = pointData.GetAbstractArray(curveCoordinateSystemGenerator.GetBinormalsArrayName())
@@ -1807,10 +2073,11 @@ class CrossSectionAnalysisLogic(ScriptedLoadableModuleLogic):
       logging.error(_("Lumen surface node is not set."))
       return
     # Work on the the segment's closed surface
-    _closedSurfacePolyData = vtk.vtkPolyData()
     if self.lumenSurfaceNode.GetClassName() == "vtkMRMLSegmentationNode":
-      self.lumenSurfaceNode.CreateClosedSurfaceRepresentation()
-      self.lumenSurfaceNode.GetClosedSurfaceRepresentation(self.currentSegmentID, closedSurfacePolyData)
+      # The cached surface is shared and is not modified downstream.
+      cachedPolyData = getClosedSurfaceCache().getClosedSurfacePolyData(self.lumenSurfaceNode, self.currentSegmentID)
+      if cachedPolyData:
+        closedSurfacePolyData.ShallowCopy(cachedPolyData)
     else: # Model.
       closedSurfacePolyData.DeepCopy(self.lumenSurfaceNode.GetPolyData())
 
@@ -1950,7 +2217,7 @@ class CrossSectionAnalysisLogic(ScriptedLoadableModuleLogic):
     wallEdgeExtractor.Update()
 
     # Get the rim of the lumen cross-section; create if has not been done yet.
-    lumenCrossSection = self.updateLumenCrossSection(pointIndex)
+    lumenCrossSection = self.getLumenCrossSection(pointIndex)
     lumenEdgeExtractor = vtk.vtkFeatureEdges()
     lumenEdgeExtractor.SetInputData(lumenCrossSection) # It has been processed by vtkContourTriangulator.
     lumenEdgeExtractor.BoundaryEdgesOn()
@@ -1973,18 +2240,26 @@ class CrossSectionAnalysisLogic(ScriptedLoadableModuleLogic):
     return surfaceFill.GetOutput()
 
   # For the lumen.
-  def updateLumenCrossSection(self, pointIndex):
-    """Create an exact-fit model representing the cross-section.
+  def getLumenCrossSection(self, pointIndex):
+    """Return the cross-section of the lumen from the cache, or compute it and store it in the cache.
+    Unlike updateLumenCrossSection(), it does not track the scrub position nor prefetch sections.
     """
-
-    if pointIndex in self.lumenCrossSectionPolyDataCache:
-      # found polydata cached
-      crossSectionPolyData = self.lumenCrossSectionPolyDataCache[pointIndex]
-    else:
+    crossSectionPolyData = self.lumenCrossSectionPolyDataCache.get(pointIndex)
+    if crossSectionPolyData is None:
       # cross-section is not found in the cache, compute it now and store in cache
       crossSectionPolyData = self.computeLumenCrossSectionPolydata(pointIndex)
-      self.lumenCrossSectionPolyDataCache[pointIndex] = crossSectionPolyData
+      self.lumenCrossSectionPolyDataCache.put(pointIndex, crossSectionPolyData)
+    return crossSectionPolyData
+
+  # For the lumen.
+  def updateLumenCrossSection(self, pointIndex):
+    """Create an exact-fit model representing the cross-section.
+    """
 
+    crossSectionPolyData = self.getLumenCrossSection(pointIndex)
+    self.schedulePrefetch(self.lumenCrossSectionPolyDataCache, self.computeLumenCrossSectionPolydata,
+                          self.lastLumenCrossSectionPointIndex, pointIndex)
+    self.lastLumenCrossSectionPointIndex = pointIndex
     return crossSectionPolyData
 
   # For the wall.
@@ -1992,16 +2267,51 @@ class CrossSectionAnalysisLogic(ScriptedLoadableModuleLogic):
     """Create an exact-fit model representing the cross-section of the wall.
     """
 
-    if pointIndex in self.wallCrossSectionPolyDataCache:
-      # found polydata cached
-      crossSectionPolyData = self.wallCrossSectionPolyDataCache[pointIndex]
-    else:
+    crossSectionPolyData = self.wallCrossSectionPolyDataCache.get(pointIndex)
+    if crossSectionPolyData is None:
       # cross-section is not found in the cache, compute it now and store in cache
       crossSectionPolyData = self.computeWallCrossSectionPolydata(pointIndex)
-      self.wallCrossSectionPolyDataCache[pointIndex] = crossSectionPolyData
+      self.wallCrossSectionPolyDataCache.put(pointIndex, crossSectionPolyData)
 
+    self.schedulePrefetch(self.wallCrossSectionPolyDataCache, self.computeWallCrossSectionPolydata,
+                          self.lastWallCrossSectionPointIndex, pointIndex)
+    self.lastWallCrossSectionPointIndex = pointIndex
     return crossSectionPolyData
 
+  def setCrossSectionCacheSize(self, sizeMB):
+    self.crossSectionCacheSizeMB = sizeMB
+    self.lumenCrossSectionPolyDataCache.setMaximumSize(sizeMB * 1024 * 1024)
+    self.wallCrossSectionPolyDataCache.setMaximumSize(sizeMB * 1024 * 1024)
+
+  def getCrossSectionCacheStatistics(self):
+    return {"lumen": self.lumenCrossSectionPolyDataCache.getStatistics(),
+            "wall": self.wallCrossSectionPolyDataCache.getStatistics()}
+
+  def schedulePrefetch(self, cache, compute, lastPointIndex, pointIndex):
+    """Compute the next cross-sections in the scrub direction, one per idle event loop iteration."""
+    if (not self.prefetchCrossSections) or (lastPointIndex is None) or (lastPointIndex == pointIndex):
+      return
+    step = 1 if pointIndex > lastPointIndex else -1
+    numberOfPoints = self.getNumberOfPoints()
+    pointIndices = [pointIndex + step * i for i in range(1, self.crossSectionPrefetchCount + 1)]
+    pointIndices = [index for index in pointIndices if 0 <= index < numberOfPoints and index not in cache]
+    if pointIndices:
+      qt.QTimer.singleShot(0, lambda: self._prefetch(cache, compute, pointIndices, self.crossSectionCacheGeneration))
+
+  def _prefetch(self, cache, compute, pointIndices, generation):
+    if generation != self.crossSectionCacheGeneration or not self.isInputCenterlineValid():
+      return
+    pointIndex = pointIndices[0]
+    if pointIndex not in cache:
+      try:
+        cache.put(pointIndex, compute(pointIndex))
+      except Exception as e:
+        # Not worth a traceback from a timer callback: the section is computed again if it is shown.
+        logging.debug("Cross-section prefetch stopped at point " + str(pointIndex) + ": " + str(e))
+        return
+    if len(pointIndices) > 1:
+      qt.QTimer.singleShot(0, lambda: self._prefetch(cache, compute, pointIndices[1:], generation))
+
   def getCrossSectionArea(self, pointIndex):
     """Get the pre-computed cross-section surface area"""
     if self.outputTableNode is None or self.lumenSurfaceNode is None:
@@ -2136,18 +2446,17 @@ class CrossSectionAnalysisLogic(ScriptedLoadableModuleLogic):
     distanceFromStart = distanceArray.GetValue(int(pointIndex))
     return distanceFromStart - relativeOriginDistance
 
-  def _informAboutEmptySections(self, ids:vtk. vtkIdList, surfaceName):
+  def _informAboutEmptySections(self, ids:vtk. vtkIdList, surfaceName, report = ""):
+    """The ids are sorted, and the report summarizes the failed sections, by vtkCrossSectionCompute.
+    """
+    if report:
+      logging.warning("Some sections could not be created on " + surfaceName + ":\n" + report.rstrip())
     numberOfIds = ids.GetNumberOfIds()
     if numberOfIds == 0:
       return False
     statusMessage = str(numberOfIds) + " " + _("empty sections have been detected; consider improving the input surface {nameOfSurface}." ).format(nameOfSurface=surfaceName)
     consoleMessage = "Empty sections have been created at these point ids of the centerline: "
-    idList = ""
-    sorter = vtk.vtkSortDataArray()
-    sorter.Sort(ids)
-    for i in range(numberOfIds):
-      idList = idList + ", " + str(ids.GetId(i))
-    idList = idList[2 : len(idList)]
+    idList = ", ".join(str(ids.GetId(i)) for i in range(numberOfIds))
     consoleMessage = consoleMessage + idList + "; consider improving the input surface (" + surfaceName +")."
     self.showStatusMessage((statusMessage,))
     logging.warning(consoleMessage)
@@ -2172,11 +2481,96 @@ class CrossSectionAnalysisTest(ScriptedLoadableModuleTest):
   def runTest(self):
     """
     """
+    self.setUp()
+    self.test_CumulativeDistances()
+    self.test_ControlPointRadiusInterpolation()
+    self.test_OutputTableColumnsAfterTransformChange()
 
   def test_CrossSectionAnalysis1(self):
     """
     """
 
+  def test_CumulativeDistances(self):
+    """Array operations against the former per-point loops."""
+    logic = CrossSectionAnalysisLogic()
+    points = np.random.default_rng(1).uniform(-50.0, 50.0, (100, 3))
+    cumArray = vtk.vtkDoubleArray()
+    logic.cumulateDistances(points, cumArray)
+    expectedCumulativeDistances = []
+    distance = 0.0
+    previous = points[0]
+    for point in points:
+      distance += np.linalg.norm(point - previous)
+      expectedCumulativeDistances.append(distance)
+      previous = point
+    for i in range(len(points)):
+      self.assertAlmostEqual(cumArray.GetValue(i), expectedCumulativeDistances[i])
+
+    logic.relativeOriginPointIndex = 37
+    relArray = vtk.vtkDoubleArray()
+    logic.updateCumulativeDistancesToRelativeOrigin(cumArray, relArray)
+    self.assertEqual(relArray.GetNumberOfValues(), len(points))
+    for i in range(len(points)):
+      self.assertAlmostEqual(relArray.GetValue(i), expectedCumulativeDistances[i] - expectedCumulativeDistances[37])
+
+  def test_ControlPointRadiusInterpolation(self):
+    """Array operations against the former per-point loop."""
+    controlPointRadiusValues = np.array([2.0, 2.5, 1.5, 3.0, 2.2])
+    # Curve points between the control points, with the last control point index repeated.
+    controlPointFloatIndexValues = np.concatenate((np.linspace(0.0, 3.95, 80), [4.0]))
+    radii = CrossSectionAnalysisLogic.interpolateControlPointRadii(controlPointRadiusValues, controlPointFloatIndexValues)
+    self.assertEqual(len(radii), len(controlPointFloatIndexValues) + 1)
+    for pointIndex in range(len(controlPointFloatIndexValues)):
+      controlPointFloatIndex = controlPointFloatIndexValues[pointIndex]
+      controlPointIndexA = int(controlPointFloatIndex)
+      # The former loop read past the last control point here.
+      controlPointIndexB = min(controlPointIndexA + 1, len(controlPointRadiusValues) - 1)
+      radiusA = controlPointRadiusValues[controlPointIndexA]
+      radiusB = controlPointRadiusValues[controlPointIndexB]
+      radius = radiusA * (controlPointFloatIndex - controlPointIndexA) + radiusB * (controlPointIndexA + 1 - controlPointFloatIndex)
+      self.assertAlmostEqual(radii[pointIndex], radius)
+    self.assertAlmostEqual(radii[-1], controlPointRadiusValues[-1])
+
+  def test_OutputTableColumnsAfterTransformChange(self):
+    """The columns are not updated in place if the parent transform of the centerline changed."""
+    self.setUp()
+    numberOfPoints = 10
+    lineSource = vtk.vtkLineSource()
+    lineSource.SetPoint1(0.0, 0.0, 0.0)
+    lineSource.SetPoint2(0.0, 0.0, 90.0)
+    lineSource.SetResolution(numberOfPoints - 1)
+    lineSource.Update()
+    centerlineNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLModelNode")
+    centerlineNode.SetAndObservePolyData(lineSource.GetOutput())
+    tableNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLTableNode")
+    distanceArray = vtk.vtkDoubleArray()
+    distanceArray.SetName(DISTANCE_ARRAY_NAME)
+    tableNode.AddColumn(distanceArray)
+    tableNode.GetTable().SetNumberOfRows(numberOfPoints)
+
+    logic = CrossSectionAnalysisLogic()
+    logic.setInputCenterlineNode(centerlineNode)
+    logic.setOutputTableNode(tableNode)
+    # State left by a full update.
+    def setFullUpdateState():
+      logic.outputTablePoints = slicer.util.arrayFromModelPoints(centerlineNode).copy()
+      logic.outputTableCumulativeDistances = np.arange(numberOfPoints) * 10.0
+      logic.outputTableInputs = logic.getOutputTableInputs()
+    setFullUpdateState()
+    self.assertTrue(logic.updateOutputTableColumns(tableNode))
+
+    transformNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLinearTransformNode")
+    centerlineNode.SetAndObserveTransformNodeID(transformNode.GetID())
+    self.assertFalse(logic.updateOutputTableColumns(tableNode))
+    setFullUpdateState()
+    self.assertTrue(logic.updateOutputTableColumns(tableNode))
+
+    # The centerline node is not modified by an edit of its transform.
+    transformMatrix = vtk.vtkMatrix4x4()
+    transformMatrix.SetElement(0, 3, 5.0)
+    transformNode.SetMatrixTransformToParent(transformMatrix)
+    self.assertFalse(logic.updateOutputTableColumns(tableNode))
+
 DISTANCE_ARRAY_NAME = _("Distance")
 MIS_DIAMETER_ARRAY_NAME = _("Diameter (MIS)")
 CE_DIAMETER_ARRAY_NAME = _("Diameter (CE)")
@@ -2188,6 +2582,17 @@ DIAMETER_STENOSIS_ARRAY_NAME = _("Stenosis by diameter (CE)")
 
 TAG_NAME_CLIPPED = "ClippedInTube"
 
+# Groups of output table columns, by the inputs they depend on.
+OUTPUT_TABLE_GEOMETRY = "Geometry"
+OUTPUT_TABLE_ORIGIN = "Origin"
+OUTPUT_TABLE_COORDINATES = "Coordinates"
+OUTPUT_TABLE_COLUMN_INPUTS = {
+  OUTPUT_TABLE_GEOMETRY : [MIS_DIAMETER_ARRAY_NAME, CE_DIAMETER_ARRAY_NAME, LUMEN_CROSS_SECTION_AREA_ARRAY_NAME, WALL_DIAMETER_ARRAY_NAME,
+                           WALL_CROSS_SECTION_AREA_ARRAY_NAME, SURFACE_AREA_STENOSIS_ARRAY_NAME, DIAMETER_STENOSIS_ARRAY_NAME],
+  OUTPUT_TABLE_ORIGIN : [DISTANCE_ARRAY_NAME],
+  OUTPUT_TABLE_COORDINATES : ["RAS", "LPS", "R", "A", "S", "L", "P"]
+  }
+
 MIS_DIAMETER = "MIS_DIAMETER"
 CE_DIAMETER = "CE_DIAMETER"
 LUMEN_CROSS_SECTION_AREA = "LUMEN_CROSS_SECTION_AREA"
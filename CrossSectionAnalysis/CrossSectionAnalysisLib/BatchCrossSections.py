@@ -0,0 +1,338 @@
+"""
+Cross-section tables of many cases, from surface and centerline files.
+Nothing here uses the scene, Qt or the application: the sections are computed
+by vtkCrossSectionCompute, and the cases are processed in worker processes.
+
+Run it with the Python interpreter of Slicer, with the extension in the paths:
+
+  PythonSlicer -m CrossSectionAnalysisLib.BatchCrossSections manifest.csv --workers 8
+
+The manifest is a CSV file with a header and these columns; relative paths are
+relative to the manifest:
+  surface     lumen surface, .vtp or .vtk
+  centerline  centerline polydata, .vtp or .vtk; a 'Radius' point array gives the MIS diameter
+  output      table file: .csv, .parquet (needs pyarrow) or .npz
+  wall        optional wall surface, e.g. a saved Tube; adds the wall and stenosis columns
+  name        optional name of the case in the log
+  space       optional coordinate system of the files of the case, RAS or LPS
+
+Without a space column, the coordinate system written by Slicer in each file is
+used: 'SPACE=...' in the header of .vtk files, a 'SPACE' field data array in .vtp
+files. Files without it are LPS, as Slicer assumes. The points are converted to
+RAS before the sections are computed; the coordinate columns of the tables are
+RAS, or LPS with --lps.
+"""
+import argparse
+import csv
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+import vtk
+
+__all__ = ["readPolyData", "getFileCoordinateSystem", "computeCrossSectionTable", "writeCrossSectionTable",
+           "readManifest", "processCase", "processCases", "main"]
+
+# Same names as the columns of the module, untranslated.
+DISTANCE_ARRAY_NAME = "Distance"
+MIS_DIAMETER_ARRAY_NAME = "Diameter (MIS)"
+CE_DIAMETER_ARRAY_NAME = "Diameter (CE)"
+LUMEN_CROSS_SECTION_AREA_ARRAY_NAME = "Lumen cross-section area"
+WALL_DIAMETER_ARRAY_NAME = "Wall diameter"
+WALL_CROSS_SECTION_AREA_ARRAY_NAME = "Wall cross-section area"
+SURFACE_AREA_STENOSIS_ARRAY_NAME = "Stenosis by surface area"
+DIAMETER_STENOSIS_ARRAY_NAME = "Stenosis by diameter (CE)"
+
+EXTRACTION_MODES = {"closest" : "ClosestPoint", "all" : "AllRegions", "largest" : "LargestRegion"}
+COORDINATE_SYSTEMS = ("RAS", "LPS")
+# Slicer reads files without coordinate system information as LPS.
+DEFAULT_FILE_COORDINATE_SYSTEM = "LPS"
+
+
+def readPolyData(path, coordinateSystem = None):
+  """Read a polydata from a VTK XML (.vtp) or legacy (.vtk) file, converted to RAS.
+  :param coordinateSystem: 'RAS' or 'LPS', the coordinate system of the file;
+    if None, it is read from the file by getFileCoordinateSystem().
+  """
+  extension = os.path.splitext(path)[1].lower()
+  if extension == ".vtp":
+    reader = vtk.vtkXMLPolyDataReader()
+  elif extension == ".vtk":
+    reader = vtk.vtkPolyDataReader()
+  else:
+    raise ValueError("Unsupported polydata file type: " + path)
+  if not os.path.isfile(path):
+    raise ValueError("File not found: " + path)
+  reader.SetFileName(path)
+  reader.Update()
+  polyData = reader.GetOutput()
+  if polyData is None or polyData.GetNumberOfPoints() == 0:
+    raise ValueError("Empty polydata: " + path)
+  if coordinateSystem is None:
+    coordinateSystem = getFileCoordinateSystem(reader, polyData)
+  coordinateSystem = coordinateSystem.upper()
+  if coordinateSystem not in COORDINATE_SYSTEMS:
+    raise ValueError(f"Unknown coordinate system '{coordinateSystem}': " + path)
+  if coordinateSystem == "LPS":
+    # The transform filter also flips normal and vector arrays.
+    lpsToRas = vtk.vtkTransform()
+    lpsToRas.Scale(-1.0, -1.0, 1.0)
+    transformFilter = vtk.vtkTransformPolyDataFilter()
+    transformFilter.SetTransform(lpsToRas)
+    transformFilter.SetInputData(polyData)
+    transformFilter.Update()
+    polyData = transformFilter.GetOutput()
+  return polyData
+
+
+def getFileCoordinateSystem(reader, polyData):
+  """Return the coordinate system written by Slicer in a file, 'RAS' or 'LPS'.
+  It is 'SPACE=...' in the header of legacy files, and a 'SPACE' string array
+  in the field data of XML files. Files without it are LPS.
+  """
+  if isinstance(reader, vtk.vtkPolyDataReader):
+    description = (reader.GetHeader() or "").upper()
+  else:
+    spaceArray = polyData.GetFieldData().GetAbstractArray("SPACE")
+    description = ("SPACE=" + spaceArray.GetVariantValue(0).ToString().upper()
+                   if spaceArray and spaceArray.GetNumberOfValues() > 0 else "")
+  for coordinateSystem in COORDINATE_SYSTEMS:
+    if "SPACE=" + coordinateSystem in description:
+      return coordinateSystem
+  return DEFAULT_FILE_COORDINATE_SYSTEM
+
+
+def computeCrossSectionTable(surfacePolyData, centerlinePolyData, wallPolyData = None,
+                             numberOfThreads = 1, extractionMode = "closest", coordinateSystemRAS = True):
+  """Compute the columns of the cross-section table. The inputs are in RAS.
+  :param coordinateSystemRAS: coordinate columns in RAS if True, in LPS otherwise
+  :return: ordered dict of column name -> numpy array, and the list of empty section point ids
+  """
+  import vtkSlicerCrossSectionAnalysisModuleLogicPython as vtkSlicerCrossSectionAnalysisModuleLogic
+  from collections import OrderedDict
+  from vtk.util.numpy_support import vtk_to_numpy
+
+  points = np.array(vtk_to_numpy(centerlinePolyData.GetPoints().GetData()), dtype = np.float64)
+  numberOfPoints = len(points)
+  if numberOfPoints < 2:
+    raise ValueError("The centerline has less than 2 points.")
+
+  crossSectionCompute = vtkSlicerCrossSectionAnalysisModuleLogic.vtkCrossSectionCompute()
+  # If numberOfThreads > number of points, excessive threads would have nothing to do.
+  crossSectionCompute.SetNumberOfThreads(max(1, min(numberOfThreads, numberOfPoints)))
+  crossSectionCompute.SetInputCenterlinePolyData(centerlinePolyData)
+  crossSectionCompute.SetInputSurfacePolyData(surfacePolyData)
+  mode = getattr(crossSectionCompute, EXTRACTION_MODES[extractionMode])
+
+  def newColumn():
+    array = vtk.vtkDoubleArray()
+    array.SetNumberOfValues(numberOfPoints)
+    array.Fill(0.0)
+    return array
+
+  areaArray = newColumn()
+  diameterArray = newColumn()
+  emptySectionIds = vtk.vtkIdList()
+  if wallPolyData is not None:
+    wallAreaArray = newColumn()
+    wallDiameterArray = newColumn()
+    diameterStenosisArray = newColumn()
+    surfaceAreaStenosisArray = newColumn()
+    crossSectionCompute.SetInputWallSurfacePolyData(wallPolyData)
+    completed = crossSectionCompute.UpdateWallAndLumenTable(areaArray, diameterArray, wallAreaArray, wallDiameterArray,
+                                                            diameterStenosisArray, surfaceAreaStenosisArray, None,
+                                                            emptySectionIds, None, mode)
+  else:
+    completed = crossSectionCompute.UpdateTable(areaArray, diameterArray, emptySectionIds, mode)
+  if not completed:
+    raise RuntimeError("Failed to compute cross-sections.")
+  if crossSectionCompute.GetReport():
+    logging.warning("Some sections could not be created:\n" + crossSectionCompute.GetReport().rstrip())
+
+  columns = OrderedDict()
+  distances = np.zeros(numberOfPoints)
+  distances[1:] = np.cumsum(np.linalg.norm(np.diff(points, axis = 0), axis = 1))
+  columns[DISTANCE_ARRAY_NAME] = distances
+  radiusArray = centerlinePolyData.GetPointData().GetArray("Radius")
+  if radiusArray:
+    columns[MIS_DIAMETER_ARRAY_NAME] = np.array(vtk_to_numpy(radiusArray), dtype = np.float64) * 2
+  columns[CE_DIAMETER_ARRAY_NAME] = np.array(vtk_to_numpy(diameterArray))
+  columns[LUMEN_CROSS_SECTION_AREA_ARRAY_NAME] = np.array(vtk_to_numpy(areaArray))
+  if wallPolyData is not None:
+    columns[WALL_DIAMETER_ARRAY_NAME] = np.array(vtk_to_numpy(wallDiameterArray))
+    columns[WALL_CROSS_SECTION_AREA_ARRAY_NAME] = np.array(vtk_to_numpy(wallAreaArray))
+    columns[DIAMETER_STENOSIS_ARRAY_NAME] = np.array(vtk_to_numpy(diameterStenosisArray))
+    columns[SURFACE_AREA_STENOSIS_ARRAY_NAME] = np.array(vtk_to_numpy(surfaceAreaStenosisArray))
+  coordinates = points if coordinateSystemRAS else points * [-1.0, -1.0, 1.0]
+  for component, name in enumerate(("R", "A", "S") if coordinateSystemRAS else ("L", "P", "S")):
+    columns[name] = coordinates[:, component]
+  return columns, [emptySectionIds.GetId(i) for i in range(emptySectionIds.GetNumberOfIds())]
+
+
+def writeCrossSectionTable(columns, path):
+  """Write the columns to a .csv, .parquet or .npz file, according to the extension."""
+  extension = os.path.splitext(path)[1].lower()
+  directory = os.path.dirname(path)
+  if directory:
+    os.makedirs(directory, exist_ok = True)
+  if extension == ".csv":
+    names = list(columns.keys())
+    with open(path, "w", newline = "") as csvFile:
+      writer = csv.writer(csvFile)
+      writer.writerow(names)
+      writer.writerows(np.column_stack([columns[name] for name in names]).tolist())
+  elif extension == ".parquet":
+    try:
+      import pyarrow
+      import pyarrow.parquet
+    except ImportError:
+      raise ValueError("Writing Parquet files requires the pyarrow package.")
+    table = pyarrow.table({name : values for name, values in columns.items()})
+    pyarrow.parquet.write_table(table, path)
+  elif extension == ".npz":
+    # Column names are not valid keyword names, pass them in a dict.
+    np.savez(path, **{name : values for name, values in columns.items()})
+  else:
+    raise ValueError("Unsupported table file type: " + path)
+
+
+def readManifest(path):
+  """Read the cases of a manifest CSV file, with absolute paths."""
+  baseDirectory = os.path.dirname(os.path.abspath(path))
+  def resolve(filePath):
+    return filePath if os.path.isabs(filePath) else os.path.join(baseDirectory, filePath)
+  cases = []
+  with open(path, newline = "") as manifestFile:
+    for rowIndex, row in enumerate(csv.DictReader(manifestFile)):
+      row = {key.strip() : (value.strip() if value else "") for key, value in row.items() if key}
+      for required in ("surface", "centerline", "output"):
+        if not row.get(required):
+          raise ValueError(f"Manifest row {rowIndex + 1}: missing '{required}'.")
+      space = row.get("space", "").upper() or None
+      if space and space not in COORDINATE_SYSTEMS:
+        raise ValueError(f"Manifest row {rowIndex + 1}: 'space' must be RAS or LPS.")
+      cases.append({
+        "name" : row.get("name") or os.path.splitext(os.path.basename(row["output"]))[0],
+        "surface" : resolve(row["surface"]),
+        "centerline" : resolve(row["centerline"]),
+        "wall" : resolve(row["wall"]) if row.get("wall") else None,
+        "output" : resolve(row["output"]),
+        "space" : space,
+        })
+  return cases
+
+
+def processCase(case):
+  """Compute and write the table of a case.
+  It can run in a worker process; errors are returned instead of raised.
+  :return: dict with the case name, the number of points and empty sections, the duration and the error if any
+  """
+  startTime = time.time()
+  result = {"name" : case["name"], "numberOfPoints" : 0, "numberOfEmptySections" : 0, "error" : None}
+  try:
+    space = case.get("space")
+    surfacePolyData = readPolyData(case["surface"], space)
+    centerlinePolyData = readPolyData(case["centerline"], space)
+    wallPolyData = readPolyData(case["wall"], space) if case.get("wall") else None
+    columns, emptySectionIds = computeCrossSectionTable(surfacePolyData, centerlinePolyData, wallPolyData,
+                                                        case.get("numberOfThreads", 1),
+                                                        case.get("extractionMode", "closest"),
+                                                        case.get("coordinateSystemRAS", True))
+    writeCrossSectionTable(columns, case["output"])
+    result["numberOfPoints"] = len(columns[DISTANCE_ARRAY_NAME])
+    result["numberOfEmptySections"] = len(emptySectionIds)
+  except Exception as e:
+    result["error"] = str(e)
+  result["duration"] = time.time() - startTime
+  return result
+
+
+def processCases(cases, numberOfWorkers = None, inProcess = False):
+  """Run processCase() on each case in worker processes, even with a single worker.
+  A case that crashes its worker process fails alone: the other cases left
+  unfinished by the crash are run again, each in its own process.
+  Results are in the order of the cases.
+  :param inProcess: run the cases in this process instead, e.g. to debug them;
+    this is also done for a single case. A crash then stops the run.
+  """
+  if inProcess or len(cases) <= 1:
+    return [processCase(case) for case in cases]
+  if numberOfWorkers is None:
+    numberOfWorkers = os.cpu_count() or 1
+  numberOfWorkers = max(1, min(numberOfWorkers, len(cases)))
+
+  results = [None] * len(cases)
+  unfinishedIndices = _processCasesInPool(cases, range(len(cases)), numberOfWorkers, results)
+  if unfinishedIndices:
+    logging.warning(f"A worker process terminated abruptly, {len(unfinishedIndices)} cases are run again one by one.")
+  for index in unfinishedIndices:
+    if _processCasesInPool(cases, [index], 1, results):
+      results[index] = _failedCaseResult(cases[index], "The worker process terminated abruptly.")
+  return results
+
+
+def _processCasesInPool(cases, caseIndices, numberOfWorkers, results):
+  """Run processCase() on the cases in a pool of worker processes, and store their results.
+  :return: indices of the cases left without result because a worker process terminated abruptly
+  """
+  import multiprocessing
+  from concurrent.futures import ProcessPoolExecutor, as_completed
+  from concurrent.futures.process import BrokenProcessPool
+
+  unfinishedIndices = []
+  # VTK is not fork safe; the workers start a fresh interpreter, the same as this one.
+  context = multiprocessing.get_context("spawn")
+  with ProcessPoolExecutor(max_workers = numberOfWorkers, mp_context = context) as executor:
+    futures = {executor.submit(processCase, cases[index]) : index for index in caseIndices}
+    for future in as_completed(futures):
+      index = futures[future]
+      try:
+        results[index] = future.result()
+      except BrokenProcessPool:
+        unfinishedIndices.append(index)
+      except Exception as e:
+        results[index] = _failedCaseResult(cases[index], str(e))
+  return sorted(unfinishedIndices)
+
+
+def _failedCaseResult(case, error):
+  return {"name" : case["name"], "numberOfPoints" : 0, "numberOfEmptySections" : 0, "error" : error, "duration" : 0.0}
+
+
+def main(argv = None):
+  parser = argparse.ArgumentParser(description = "Compute cross-section tables of the cases of a manifest, without the application.")
+  parser.add_argument("manifest", help = "CSV file with surface, centerline, output and optional wall, name and space columns")
+  parser.add_argument("--workers", type = int, default = None, help = "number of cases processed in parallel (default: number of CPUs)")
+  parser.add_argument("--threads-per-case", type = int, default = 1, help = "threads of vtkCrossSectionCompute in each case")
+  parser.add_argument("--extraction-mode", choices = list(EXTRACTION_MODES.keys()), default = "closest",
+                      help = "regions of the surface kept in each section")
+  parser.add_argument("--lps", action = "store_true", help = "write LPS instead of RAS coordinates")
+  parser.add_argument("--in-process", action = "store_true",
+                      help = "run the cases in this process, without worker processes, e.g. to debug them")
+  args = parser.parse_args(argv)
+
+  logging.basicConfig(level = logging.INFO, format = "%(levelname)s: %(message)s")
+  cases = readManifest(args.manifest)
+  for case in cases:
+    case["numberOfThreads"] = args.threads_per_case
+    case["extractionMode"] = args.extraction_mode
+    case["coordinateSystemRAS"] = not args.lps
+
+  startTime = time.time()
+  results = processCases(cases, args.workers, args.in_process)
+  numberOfFailures = 0
+  for result in results:
+    if result["error"]:
+      numberOfFailures += 1
+      logging.error(f"{result['name']}: {result['error']}")
+    else:
+      emptySections = f", {result['numberOfEmptySections']} empty sections" if result["numberOfEmptySections"] else ""
+      logging.info(f"{result['name']}: {result['numberOfPoints']} points in {result['duration']:.2f} s{emptySections}")
+  logging.info(f"{len(cases) - numberOfFailures}/{len(cases)} cases processed in {time.time() - startTime:.2f} s.")
+  return 1 if numberOfFailures else 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,121 @@
+"""
+Closed surface representations of segments, shared by the modules of the extension.
+The module is not imported by the package: unlike BatchCrossSections, it needs
+the application scene. Import it explicitly:
+
+  from CrossSectionAnalysisLib.ClosedSurfaceCache import getClosedSurfaceCache
+"""
+import logging
+
+import vtk
+import slicer
+
+__all__ = ["ClosedSurfaceCache", "getClosedSurfaceCache"]
+
+
+class ClosedSurfaceCache:
+  """Closed surface representations of segments, shared by all modules.
+  A surface is regenerated only if the source representation of the segment
+  or the conversion parameters changed. The returned polydata are shared:
+  they must not be modified.
+  Entries of segmentation nodes removed from the scene, or of a closed scene,
+  are dropped.
+  """
+  def __init__(self):
+    # (segmentation node ID, segment ID) -> (key, closed surface polydata)
+    self.surfaces = {}
+    # segmentation node ID -> (segmentation node, observer tag)
+    self.observedSegmentationNodes = {}
+    # (scene, [observer tags])
+    self.sceneObservation = None
+
+  def getClosedSurfacePolyData(self, segmentationNode, segmentID):
+    """Return the shared closed surface of the segment, or None if it cannot be created."""
+    if not segmentationNode or not segmentID:
+      return None
+    segmentation = segmentationNode.GetSegmentation()
+    segment = segmentation.GetSegment(segmentID)
+    if not segment:
+      logging.error("Segment not found: " + segmentID)
+      return None
+    key = self.getSurfaceKey(segmentationNode, segmentID)
+    cacheKey = (segmentationNode.GetID(), segmentID)
+    cached = self.surfaces.get(cacheKey)
+    if cached and cached[0] == key:
+      return cached[1]
+
+    segmentationNode.CreateClosedSurfaceRepresentation()
+    closedSurfacePolyData = vtk.vtkPolyData()
+    if not segmentationNode.GetClosedSurfaceRepresentation(segmentID, closedSurfacePolyData):
+      logging.error("Could not get the closed surface of segment: " + segmentID)
+      return None
+    self.surfaces[cacheKey] = (key, closedSurfacePolyData)
+    self._observeSegmentationNode(segmentationNode)
+    return closedSurfacePolyData
+
+  @staticmethod
+  def getSurfaceKey(segmentationNode, segmentID):
+    """Changes whenever the closed surface of the segment must be regenerated."""
+    segmentation = segmentationNode.GetSegmentation()
+    segment = segmentation.GetSegment(segmentID)
+    if not segment:
+      return None
+    sourceRepresentationName = (segmentation.GetSourceRepresentationName() if hasattr(segmentation, "GetSourceRepresentationName")
+                                else segmentation.GetMasterRepresentationName())
+    sourceRepresentation = segment.GetRepresentation(sourceRepresentationName)
+    return (sourceRepresentation.GetMTime() if sourceRepresentation else 0,
+            segmentation.SerializeAllConversionParameters())
+
+  def invalidate(self, segmentationNodeID=None):
+    if segmentationNodeID is None:
+      self.surfaces.clear()
+      return
+    for cacheKey in [cacheKey for cacheKey in self.surfaces if cacheKey[0] == segmentationNodeID]:
+      del self.surfaces[cacheKey]
+
+  def forget(self, segmentationNodeID=None):
+    """Drop the entries and the observer of a segmentation node, or of all of them."""
+    nodeIDs = list(self.observedSegmentationNodes.keys()) if segmentationNodeID is None else [segmentationNodeID]
+    for nodeID in nodeIDs:
+      observed = self.observedSegmentationNodes.pop(nodeID, None)
+      if observed:
+        observed[0].RemoveObserver(observed[1])
+    self.invalidate(segmentationNodeID)
+
+  def _observeSegmentationNode(self, segmentationNode):
+    self._observeScene(segmentationNode.GetScene())
+    nodeID = segmentationNode.GetID()
+    observed = self.observedSegmentationNodes.get(nodeID)
+    if observed and observed[0] is segmentationNode:
+      return
+    if observed:
+      observed[0].RemoveObserver(observed[1])
+    tag = segmentationNode.AddObserver(slicer.vtkSegmentation.SourceRepresentationModified,
+                                       lambda caller, event, nodeID=nodeID: self.invalidate(nodeID))
+    self.observedSegmentationNodes[nodeID] = (segmentationNode, tag)
+
+  def _observeScene(self, scene):
+    if not scene or (self.sceneObservation and self.sceneObservation[0] is scene):
+      return
+    if self.sceneObservation:
+      for tag in self.sceneObservation[1]:
+        self.sceneObservation[0].RemoveObserver(tag)
+    self.sceneObservation = (scene, [scene.AddObserver(scene.NodeRemovedEvent, self._onNodeRemoved),
+                                     scene.AddObserver(scene.EndCloseEvent, self._onSceneEndClose)])
+
+  @vtk.calldata_type(vtk.VTK_OBJECT)
+  def _onNodeRemoved(self, caller, event, node):
+    if node and node.GetID() in self.observedSegmentationNodes:
+      self.forget(node.GetID())
+
+  def _onSceneEndClose(self, caller, event):
+    self.forget()
+
+_closedSurfaceCache = None
+
+def getClosedSurfaceCache():
+  """Return the closed surface cache shared by all modules."""
+  global _closedSurfaceCache
+  if _closedSurfaceCache is None:
+    _closedSurfaceCache = ClosedSurfaceCache()
+  return _closedSurfaceCache
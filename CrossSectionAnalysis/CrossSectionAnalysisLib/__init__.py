@@ -0,0 +1,2 @@
+from .BatchCrossSections import *
+# ClosedSurfaceCache needs the application scene: it is imported explicitly.
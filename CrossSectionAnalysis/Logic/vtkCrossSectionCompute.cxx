@@ -6,8 +6,14 @@
 #include <iostream>
 #include <thread>
 #include <mutex>
+#include <atomic>
+#include <chrono>
+#include <algorithm> // std::min
 #include <math.h> // sqrt
 #include <vector>
+#include <map>
+#include <sstream>
+#include <unordered_map>
 
 #include <vtkPlane.h>
 #include <vtkCutter.h>
@@ -19,14 +25,73 @@
 #include <vtkParallelTransportFrame.h>
 #include <vtkPointData.h>
 #include <vtkIdList.h>
+#include <vtkCellData.h>
+#include <vtkStaticCellLocator.h>
+#include <vtkCommand.h>
 
 std::mutex mtx;
 
 vtkStandardNewMacro(vtkCrossSectionCompute);
 
+//------------------------------------------------------------------------------
+/**
+ * Hands out chunks of centerline point indices to the threads.
+ * A thread that is done with a cheap chunk takes the next one,
+ * instead of waiting for the threads busy with expensive sections.
+ */
+class CrossSectionWorkQueue
+{
+public:
+  CrossSectionWorkQueue(vtkIdType numberOfPoints, vtkIdType chunkSize)
+  : NextPointIndex(0), NumberOfPoints(numberOfPoints), ChunkSize(chunkSize)
+  {
+  }
+
+  // Returns false when all points have been taken.
+  bool GetNextChunk(vtkIdType& startPointIndex, vtkIdType& endPointIndex)
+  {
+    startPointIndex = this->NextPointIndex.fetch_add(this->ChunkSize);
+    if (startPointIndex >= this->NumberOfPoints)
+    {
+      return false;
+    }
+    endPointIndex = std::min(startPointIndex + this->ChunkSize, this->NumberOfPoints) - 1;
+    return true;
+  }
+
+private:
+  std::atomic<vtkIdType> NextPointIndex;
+  const vtkIdType NumberOfPoints;
+  const vtkIdType ChunkSize;
+};
+
+//------------------------------------------------------------------------------
+/**
+ * What a thread could not compute, kept apart from the other threads.
+ * The reports are merged once, after the threads have joined.
+ */
+struct CrossSectionThreadReport
+{
+  std::vector<vtkIdType> EmptySectionIds;
+  // Point index, reason.
+  std::vector<std::pair<vtkIdType, std::string>> FailedSections;
+};
+
+//------------------------------------------------------------------------------
+/**
+ * A surface cut by the workers at each centerline point.
+ */
+struct CrossSectionSurface
+{
+  vtkPolyData * PolyData;
+  vtkAbstractCellLocator * Locator;
+  vtkCrossSectionCompute::ExtractionMode Mode;
+};
+
 //------------------------------------------------------------------------------
 /**
  * This class works with generated centerline polydata. Each thread has one instance of this class running.
+ * All surfaces are cut with the same plane at each point.
  */
 class CrossSectionComputeWorker
 {
@@ -35,35 +100,204 @@ public:
   CrossSectionComputeWorker();
   virtual ~CrossSectionComputeWorker();
 
+  /*
+   * The tuples of bufferArray are the point index, then the area and
+   * the circular equivalent diameter of the section of each surface.
+   * There is one report per surface.
+   */
   void operator () (vtkPolyData* generatedPolyData,
     vtkDoubleArray* generatedTangents,
-    vtkPolyData* closedSurfacePolyData,
+    const std::vector<CrossSectionSurface>* surfaces,
     vtkDoubleArray* bufferArray,
-    vtkIdType startPointIndex,
-    vtkIdType endPointIndex,
-    vtkIdList* emptySectionIds = nullptr,
-    vtkCrossSectionCompute::ExtractionMode extractionMode = vtkCrossSectionCompute::ExtractionMode::ClosestPoint);
+    CrossSectionWorkQueue* workQueue,
+    double* wallTime,
+    vtkIdType* numberOfSections,
+    std::atomic<vtkIdType>* numberOfComputedSections,
+    std::atomic<unsigned int>* numberOfFinishedThreads,
+    const std::atomic<bool>* abortExecute,
+    CrossSectionThreadReport* reports);
 
 private:
   /**
-   * Generates the cross-section polydata as closest contour
-   * around the generated centerline point.
-   * The result is returned in contourPolyData.
+   * Place the cutting plane perpendicular to the centerline at a point.
+   * Returns false if the centerline frame is not usable there.
    */
-  void ComputeCrossSectionPolydata(vtkPolyData* generatedPolyData,
+  bool ComputeCrossSectionPlane(vtkPolyData* generatedPolyData,
     vtkDoubleArray* generatedTangents,
-    vtkPolyData* closedSurfacePolyData,
+    vtkIdType pointIndex,
+    vtkPlane* plane,
+    CrossSectionThreadReport* report);
+  /**
+   * Generates the cross-section polydata of a surface with the plane.
+   * The result is returned in contourPolyData.
+   */
+  void ComputeCrossSectionPolydata(const CrossSectionSurface& surface,
+    vtkPlane* plane,
     vtkIdType pointIndex,
     vtkPolyData* contourPolyData,
-    vtkIdList* emptySectionIds = nullptr,
-    vtkCrossSectionCompute::ExtractionMode extractionMode = vtkCrossSectionCompute::ExtractionMode::ClosestPoint);
+    CrossSectionThreadReport* report);
 };
 
+//------------------------------------------------------------------------------
+// Index the cells of a copy of the input once, for concurrent reading.
+static void PrepareSurface(vtkPolyData * input, vtkSmartPointer<vtkPolyData>& surface,
+                           vtkStaticCellLocator * locator)
+{
+    locator->Initialize();
+    locator->SetDataSet(nullptr);
+    if (!input)
+    {
+        surface = nullptr;
+        return;
+    }
+    if (!surface)
+    {
+        surface = vtkSmartPointer<vtkPolyData>::New();
+    }
+    surface->DeepCopy(input);
+    /*
+     * Index the cells once. The workers query the locator concurrently and
+     * read the cells of the surface; these must be built in this thread.
+     */
+    if (surface->GetNumberOfCells() > 0)
+    {
+        surface->BuildCells();
+        locator->SetDataSet(surface);
+        locator->BuildLocator();
+    }
+}
+
+//------------------------------------------------------------------------------
+// Without cells, there is no locator and nothing to read.
+static CrossSectionSurface MakeCrossSectionSurface(vtkPolyData * surface, vtkStaticCellLocator * locator,
+                                                   vtkCrossSectionCompute::ExtractionMode extractionMode)
+{
+    CrossSectionSurface crossSectionSurface;
+    crossSectionSurface.PolyData = surface;
+    crossSectionSurface.Locator = locator->GetDataSet() ? locator : nullptr;
+    crossSectionSurface.Mode = extractionMode;
+    return crossSectionSurface;
+}
+
+//------------------------------------------------------------------------------
+/*
+ * Merge the per-thread reports of a surface once the threads have joined.
+ * The empty section ids are appended in ascending order. The failed sections
+ * are summarized, one line per reason with the point ids.
+ */
+static std::string MergeThreadReports(const std::vector<std::vector<CrossSectionThreadReport>>& threadReports,
+                                      unsigned int surfaceIndex, vtkIdList * emptySectionIds,
+                                      vtkIdType& numberOfFailedSections)
+{
+    std::vector<vtkIdType> allEmptySectionIds;
+    // Reason -> point indices.
+    std::map<std::string, std::vector<vtkIdType>> failedSections;
+    for (const std::vector<CrossSectionThreadReport>& reports : threadReports)
+    {
+        const CrossSectionThreadReport& report = reports[surfaceIndex];
+        allEmptySectionIds.insert(allEmptySectionIds.end(),
+                                  report.EmptySectionIds.begin(), report.EmptySectionIds.end());
+        for (const auto& failedSection : report.FailedSections)
+        {
+            failedSections[failedSection.second].push_back(failedSection.first);
+        }
+        numberOfFailedSections += report.FailedSections.size();
+    }
+    if (emptySectionIds)
+    {
+        std::sort(allEmptySectionIds.begin(), allEmptySectionIds.end());
+        for (vtkIdType pointIndex : allEmptySectionIds)
+        {
+            emptySectionIds->InsertNextId(pointIndex);
+        }
+    }
+    // One line per reason, instead of one line per section from the threads.
+    std::ostringstream report;
+    for (auto& failedSection : failedSections)
+    {
+        std::vector<vtkIdType>& pointIndices = failedSection.second;
+        std::sort(pointIndices.begin(), pointIndices.end());
+        report << failedSection.first << " (" << pointIndices.size() << " sections, at point ids ";
+        for (size_t i = 0; i < pointIndices.size(); i++)
+        {
+            report << ((i > 0) ? ", " : "") << pointIndices[i];
+        }
+        report << ")\n";
+    }
+    return report.str();
+}
+
+static vtkCrossSectionCompute::SectionCreationResult CreateCrossSectionPolyData(
+    vtkPolyData * result, vtkPolyData * input, vtkPlane * plane,
+    vtkCrossSectionCompute::ExtractionMode extractionMode,
+    vtkAbstractCellLocator * locator, std::string& message);
+
+//------------------------------------------------------------------------------
+/*
+ * Copy the cells of the input found along the plane by the locator to a compact
+ * polydata. Only the points used by these cells are kept, so that vtkCutter
+ * does not evaluate the plane function over the whole surface.
+ * Only thread safe methods of the input are used; its cells must have been built.
+ */
+static void ExtractCellsAlongPlane(vtkPolyData * input, vtkAbstractCellLocator * locator,
+                                   vtkPlane * plane, vtkPolyData * output)
+{
+    vtkNew<vtkIdList> cellIds;
+    locator->FindCellsAlongPlane(plane->GetOrigin(), plane->GetNormal(), 0.0, cellIds);
+    const vtkIdType numberOfCells = cellIds->GetNumberOfIds();
+
+    vtkNew<vtkPoints> points;
+    points->SetDataType(input->GetPoints()->GetDataType());
+    vtkPointData * inputPointData = input->GetPointData();
+    vtkPointData * outputPointData = output->GetPointData();
+    outputPointData->CopyAllocate(inputPointData, numberOfCells);
+    vtkCellData * inputCellData = input->GetCellData();
+    vtkCellData * outputCellData = output->GetCellData();
+    outputCellData->CopyAllocate(inputCellData, numberOfCells);
+    output->AllocateEstimate(numberOfCells, 3);
+
+    // Input point id -> output point id.
+    std::unordered_map<vtkIdType, vtkIdType> pointMap;
+    vtkNew<vtkIdList> cellPointIds;
+    vtkNew<vtkIdList> newCellPointIds;
+    double point[3] = {0.0, 0.0, 0.0};
+    for (vtkIdType c = 0; c < numberOfCells; c++)
+    {
+        const vtkIdType cellId = cellIds->GetId(c);
+        input->GetCellPoints(cellId, cellPointIds);
+        const vtkIdType numberOfCellPoints = cellPointIds->GetNumberOfIds();
+        newCellPointIds->SetNumberOfIds(numberOfCellPoints);
+        for (vtkIdType p = 0; p < numberOfCellPoints; p++)
+        {
+            const vtkIdType pointId = cellPointIds->GetId(p);
+            auto found = pointMap.find(pointId);
+            if (found == pointMap.end())
+            {
+                input->GetPoint(pointId, point);
+                const vtkIdType newPointId = points->InsertNextPoint(point);
+                outputPointData->CopyData(inputPointData, pointId, newPointId);
+                found = pointMap.emplace(pointId, newPointId).first;
+            }
+            newCellPointIds->SetId(p, found->second);
+        }
+        const vtkIdType newCellId = output->InsertNextCell(input->GetCellType(cellId), newCellPointIds);
+        outputCellData->CopyData(inputCellData, cellId, newCellId);
+    }
+    output->SetPoints(points);
+}
+
 //------------------------------------------------------------------------------
 vtkCrossSectionCompute::vtkCrossSectionCompute()
 {
   this->NumberOfThreads = 1;
+  this->ChunkSize = 8;
+  this->ProgressInterval = 0.1;
+  this->Progress = 0.0;
+  this->AbortExecute = false;
+  this->NumberOfFailedSections = 0;
   this->ClosedSurfacePolyData = vtkSmartPointer<vtkPolyData>::New();
+  this->SurfaceCellLocator = vtkSmartPointer<vtkStaticCellLocator>::New();
+  this->WallSurfaceCellLocator = vtkSmartPointer<vtkStaticCellLocator>::New();
 }
 
 //------------------------------------------------------------------------------
@@ -77,7 +311,16 @@ void vtkCrossSectionCompute::PrintSelf(ostream& os, vtkIndent indent)
     vtkObject::PrintSelf(os,indent);
 
     os << indent << "numberOfThreads: " << this->NumberOfThreads << "\n";
+    os << indent << "chunkSize: " << this->ChunkSize << "\n";
+    os << indent << "progressInterval: " << this->ProgressInterval << "\n";
+    os << indent << "abortExecute: " << this->AbortExecute << "\n";
+    for (unsigned int i = 0; i < this->ThreadWallTimes.size(); i++)
+    {
+        os << indent << "thread " << i << ": " << this->ThreadNumberOfSections[i]
+           << " sections in " << this->ThreadWallTimes[i] << " s\n";
+    }
     os << indent << "closedSurfacePolyData: " << this->ClosedSurfacePolyData << "\n";
+    os << indent << "wallSurfacePolyData: " << this->WallSurfacePolyData << "\n";
 }
 
 //------------------------------------------------------------------------------
@@ -86,11 +329,18 @@ void vtkCrossSectionCompute::SetInputSurfacePolyData(vtkPolyData * inputSurface)
     if (!inputSurface)
     {
         vtkErrorMacro("Invalid input surface.");
-        this->ClosedSurfacePolyData = nullptr;
-        return;
     }
+    PrepareSurface(inputSurface, this->ClosedSurfacePolyData, this->SurfaceCellLocator);
+}
 
-    this->ClosedSurfacePolyData->DeepCopy(inputSurface);
+//------------------------------------------------------------------------------
+void vtkCrossSectionCompute::SetInputWallSurfacePolyData(vtkPolyData * wallSurface)
+{
+    if (!wallSurface)
+    {
+        vtkErrorMacro("Invalid wall surface.");
+    }
+    PrepareSurface(wallSurface, this->WallSurfacePolyData, this->WallSurfaceCellLocator);
 }
 
 //------------------------------------------------------------------------------
@@ -113,6 +363,27 @@ void vtkCrossSectionCompute::SetInputCenterlinePolyData(vtkPolyData * inputCente
         pointData->GetAbstractArray(curveCoordinateSystemGenerator->GetTangentsArrayName()));
 }
 
+//------------------------------------------------------------------------------
+bool vtkCrossSectionCompute::SetInputCenterlineFramePolyData(vtkPolyData * centerlineFramePolyData)
+{
+    if (!centerlineFramePolyData)
+    {
+        vtkErrorMacro("Invalid centerline frame polydata.");
+        return false;
+    }
+    vtkNew<vtkParallelTransportFrame> curveCoordinateSystemGenerator;
+    vtkDoubleArray * tangents = vtkDoubleArray::SafeDownCast(centerlineFramePolyData->GetPointData()
+        ->GetAbstractArray(curveCoordinateSystemGenerator->GetTangentsArrayName()));
+    if (!tangents)
+    {
+        vtkErrorMacro("The centerline frame polydata has no tangents.");
+        return false;
+    }
+    this->GeneratedPolyData = centerlineFramePolyData;
+    this->GeneratedTangents = tangents;
+    return true;
+}
+
 //------------------------------------------------------------------------------
 bool vtkCrossSectionCompute::UpdateTable(vtkDoubleArray * crossSectionAreaArray, vtkDoubleArray * ceDiameterArray,
                                          vtkIdList* emptySectionIds, ExtractionMode extractionMode)
@@ -122,74 +393,227 @@ bool vtkCrossSectionCompute::UpdateTable(vtkDoubleArray * crossSectionAreaArray,
         vtkErrorMacro("Input surface is NULL.");
         return false;
     }
-    /*
-     * Divide the number of centerline points in equal blocks per thread.
-     * The last block will include the residual points also.
-     */
-    const unsigned int numberOfValues = crossSectionAreaArray->GetNumberOfValues();
-    unsigned int residual = numberOfValues % this->NumberOfThreads;
-    unsigned int numberOfValuesPerBlock = (numberOfValues) / this->NumberOfThreads;
-
-    std::vector<std::thread> threads;
+    std::vector<CrossSectionSurface> surfaces;
+    surfaces.push_back(MakeCrossSectionSurface(this->ClosedSurfacePolyData, this->SurfaceCellLocator, extractionMode));
     std::vector<vtkSmartPointer<vtkDoubleArray>> bufferArrays;
+    std::vector<std::vector<CrossSectionThreadReport>> reports;
+    this->NumberOfFailedSections = 0;
+    this->Report.clear();
+    this->WallReport.clear();
+    if (!this->ComputeSections(surfaces, crossSectionAreaArray->GetNumberOfValues(), bufferArrays, reports))
+    {
+        return false;
+    }
+    this->Report = MergeThreadReports(reports, 0, emptySectionIds, this->NumberOfFailedSections);
+    // Update the output table columns.
+    for (unsigned int i = 0; i < bufferArrays.size(); i++)
+    {
+        vtkDoubleArray * bufferArray = (bufferArrays[i].Get());
+        for (unsigned int r = 0; r < bufferArray->GetNumberOfTuples(); r++)
+        {
+            double tupleValues[3] = {0.0, 0.0, 0.0};
+            bufferArray->GetTypedTuple(r, tupleValues);
+            // Output table row index, cross-section area, CE diameter.
+            crossSectionAreaArray->SetValue((vtkIdType) tupleValues[0], tupleValues[1]);
+            ceDiameterArray->SetValue((vtkIdType) tupleValues[0], tupleValues[2]);
+        }
+    }
+    return true;
+}
 
-    for (unsigned int i = 0; i < this->NumberOfThreads; i++)
+//------------------------------------------------------------------------------
+bool vtkCrossSectionCompute::UpdateWallAndLumenTable(vtkDoubleArray * lumenAreaArray, vtkDoubleArray * lumenDiameterArray,
+                                                     vtkDoubleArray * wallAreaArray, vtkDoubleArray * wallDiameterArray,
+                                                     vtkDoubleArray * diameterStenosisArray, vtkDoubleArray * surfaceAreaStenosisArray,
+                                                     vtkDoubleArray * wallMinusLumenAreaArray,
+                                                     vtkIdList * lumenEmptySectionIds, vtkIdList * wallEmptySectionIds,
+                                                     ExtractionMode extractionMode)
+{
+    if (this->ClosedSurfacePolyData == nullptr)
     {
-        unsigned int startPointIndex = i * numberOfValuesPerBlock;
-        unsigned int endPointIndex = ((i + 1) * numberOfValuesPerBlock) - 1;
-        // The last block must include the residual points.
-        if (i == (this->NumberOfThreads -1))
+        vtkErrorMacro("Input surface is NULL.");
+        return false;
+    }
+    if (this->WallSurfacePolyData == nullptr)
+    {
+        vtkErrorMacro("Wall surface is NULL.");
+        return false;
+    }
+    if (!lumenAreaArray || !lumenDiameterArray || !wallAreaArray || !wallDiameterArray)
+    {
+        vtkErrorMacro("The area and diameter arrays are required.");
+        return false;
+    }
+    std::vector<CrossSectionSurface> surfaces;
+    surfaces.push_back(MakeCrossSectionSurface(this->ClosedSurfacePolyData, this->SurfaceCellLocator, extractionMode));
+    // AllRegions extractionMode is not relevent for a Tube.
+    surfaces.push_back(MakeCrossSectionSurface(this->WallSurfacePolyData, this->WallSurfaceCellLocator, ExtractionMode::ClosestPoint));
+    std::vector<vtkSmartPointer<vtkDoubleArray>> bufferArrays;
+    std::vector<std::vector<CrossSectionThreadReport>> reports;
+    this->NumberOfFailedSections = 0;
+    this->Report.clear();
+    this->WallReport.clear();
+    if (!this->ComputeSections(surfaces, lumenAreaArray->GetNumberOfValues(), bufferArrays, reports))
+    {
+        return false;
+    }
+    this->Report = MergeThreadReports(reports, 0, lumenEmptySectionIds, this->NumberOfFailedSections);
+    this->WallReport = MergeThreadReports(reports, 1, wallEmptySectionIds, this->NumberOfFailedSections);
+    // Update the output table columns.
+    for (unsigned int i = 0; i < bufferArrays.size(); i++)
+    {
+        vtkDoubleArray * bufferArray = (bufferArrays[i].Get());
+        for (vtkIdType r = 0; r < bufferArray->GetNumberOfTuples(); r++)
         {
-            endPointIndex += residual;
+            double tupleValues[5] = {0.0, 0.0, 0.0, 0.0, 0.0};
+            bufferArray->GetTypedTuple(r, tupleValues);
+            const vtkIdType row = (vtkIdType) tupleValues[0];
+            const double lumenArea = tupleValues[1];
+            const double lumenDiameter = tupleValues[2];
+            const double wallArea = tupleValues[3];
+            const double wallDiameter = tupleValues[4];
+            lumenAreaArray->SetValue(row, lumenArea);
+            lumenDiameterArray->SetValue(row, lumenDiameter);
+            wallAreaArray->SetValue(row, wallArea);
+            wallDiameterArray->SetValue(row, wallDiameter);
+            // The resolution of the Tube may be too low and can be increased.
+            const bool validWall = (wallDiameter != 0.0) && (wallArea != 0.0);
+            if (diameterStenosisArray)
+            {
+                diameterStenosisArray->SetValue(row, validWall ? ((wallDiameter - lumenDiameter) / wallDiameter) * 100 : -1.0);
+            }
+            if (surfaceAreaStenosisArray)
+            {
+                surfaceAreaStenosisArray->SetValue(row, validWall ? ((wallArea - lumenArea) / wallArea) * 100 : -1.0);
+            }
+            if (wallMinusLumenAreaArray)
+            {
+                wallMinusLumenAreaArray->SetValue(row, wallArea - lumenArea);
+            }
         }
-        
-        /* 
-         * Give each thread a copy of the closed surface.
-         */
-        vtkSmartPointer<vtkPolyData> closedSurfacePolyDataCopy = vtkSmartPointer<vtkPolyData>::New();
-        closedSurfacePolyDataCopy->DeepCopy(this->ClosedSurfacePolyData);
-        
+    }
+    return true;
+}
+
+//------------------------------------------------------------------------------
+bool vtkCrossSectionCompute::ComputeSections(const std::vector<CrossSectionSurface>& surfaces,
+                                             vtkIdType numberOfValues,
+                                             std::vector<vtkSmartPointer<vtkDoubleArray>>& bufferArrays,
+                                             std::vector<std::vector<CrossSectionThreadReport>>& reports)
+{
+    /*
+     * The cost of a section varies much along a vessel.
+     * Let the threads take chunks of centerline points dynamically.
+     */
+    const unsigned int numberOfThreads = (this->NumberOfThreads > 0) ? this->NumberOfThreads : 1;
+    CrossSectionWorkQueue workQueue(numberOfValues, this->ChunkSize);
+    this->ThreadWallTimes.assign(numberOfThreads, 0.0);
+    this->ThreadNumberOfSections.assign(numberOfThreads, 0);
+    this->AbortExecute = false;
+    this->Progress = 0.0;
+    // Shared by the threads, read here to report the progress.
+    std::atomic<vtkIdType> numberOfComputedSections(0);
+    std::atomic<unsigned int> numberOfFinishedThreads(0);
+
+    std::vector<std::thread> threads;
+    bufferArrays.clear();
+    // Nothing is shared between the threads to record the sections that fail.
+    reports.assign(numberOfThreads, std::vector<CrossSectionThreadReport>(surfaces.size()));
+    /*
+     * All threads share the closed surfaces; these are never copied nor modified here.
+     * The workers read them through the locators with thread safe methods only,
+     * and cut their own compact copy of the cells along each plane.
+     */
+    for (unsigned int i = 0; i < numberOfThreads; i++)
+    {
         // Each thread stores the results in this array.
         vtkSmartPointer<vtkDoubleArray> bufferArray = vtkSmartPointer<vtkDoubleArray>::New();
-        bufferArray->SetNumberOfComponents(3);
+        bufferArray->SetNumberOfComponents(1 + 2 * surfaces.size());
         bufferArrays.push_back(bufferArray);
         
         threads.push_back(std::thread(CrossSectionComputeWorker(),
                                       this->GeneratedPolyData,
                                       this->GeneratedTangents,
-                                      closedSurfacePolyDataCopy,
+                                      &surfaces,
                                       bufferArrays[i],
-                                      startPointIndex, endPointIndex,
-                                      emptySectionIds, extractionMode));
+                                      &workQueue,
+                                      &this->ThreadWallTimes[i],
+                                      &this->ThreadNumberOfSections[i],
+                                      &numberOfComputedSections,
+                                      &numberOfFinishedThreads,
+                                      &this->AbortExecute,
+                                      reports[i].data()));
+    }
+    /*
+     * Observers run in this thread only: poll the shared counter at the
+     * progress interval, instead of signalling from the workers for each section.
+     */
+    this->InvokeEvent(vtkCommand::StartEvent);
+    const auto progressInterval = std::chrono::duration<double>(this->ProgressInterval);
+    const auto pollInterval = std::chrono::milliseconds(5);
+    auto lastProgressTime = std::chrono::steady_clock::now();
+    while (numberOfFinishedThreads.load() < threads.size())
+    {
+        std::this_thread::sleep_for(pollInterval);
+        const auto now = std::chrono::steady_clock::now();
+        if ((now - lastProgressTime) < progressInterval)
+        {
+            continue;
+        }
+        lastProgressTime = now;
+        this->Progress = (numberOfValues > 0)
+                       ? (double) numberOfComputedSections.load() / (double) numberOfValues : 1.0;
+        this->InvokeEvent(vtkCommand::ProgressEvent, &this->Progress);
     }
     for (unsigned int i = 0; i < threads.size(); i++)
     {
         threads[i].join();
     }
-    // Update the output table columns.
-    for (unsigned int i = 0; i < this->NumberOfThreads; i++)
+    if (this->AbortExecute)
     {
-        vtkDoubleArray * bufferArray = (bufferArrays[i].Get());
-        for (unsigned int r = 0; r < bufferArray->GetNumberOfTuples(); r++)
-        {
-            double tupleValues[3] = {0.0, 0.0, 0.0};
-            tupleValues[0] = bufferArray->GetTuple3(r)[0]; // Output table row index
-            tupleValues[1] = bufferArray->GetTuple3(r)[1]; // Cross-section area
-            tupleValues[2] = bufferArray->GetTuple3(r)[2]; // CE diameter
-            crossSectionAreaArray->SetValue((int) tupleValues[0], tupleValues[1]);
-            ceDiameterArray->SetValue((int) tupleValues[0], tupleValues[2]);
-        }
+        // Discard the partial results.
+        this->InvokeEvent(vtkCommand::EndEvent);
+        return false;
     }
+    this->Progress = 1.0;
+    this->InvokeEvent(vtkCommand::ProgressEvent, &this->Progress);
+    this->InvokeEvent(vtkCommand::EndEvent);
     return true;
 }
 
+//------------------------------------------------------------------------------
+double vtkCrossSectionCompute::GetThreadWallTime(unsigned int threadIndex)
+{
+    if (threadIndex >= this->ThreadWallTimes.size())
+    {
+        vtkErrorMacro("Thread index " << threadIndex << " is out of range.");
+        return 0.0;
+    }
+    return this->ThreadWallTimes[threadIndex];
+}
+
+//------------------------------------------------------------------------------
+vtkIdType vtkCrossSectionCompute::GetThreadNumberOfSections(unsigned int threadIndex)
+{
+    if (threadIndex >= this->ThreadNumberOfSections.size())
+    {
+        vtkErrorMacro("Thread index " << threadIndex << " is out of range.");
+        return 0;
+    }
+    return this->ThreadNumberOfSections[threadIndex];
+}
+
 //------------------------------------------------------------------------------
 vtkCrossSectionCompute::SectionCreationResult vtkCrossSectionCompute::CreateCrossSection(
                                 vtkPolyData * result, vtkPolyData * input,
                                 vtkPlane * plane, ExtractionMode extractionMode,
-                                bool fromMainThread)
+                                bool fromMainThread, vtkAbstractCellLocator * locator)
 {
-    auto consoleMessage = [&] (const std::string& message) {
+    std::string message;
+    const SectionCreationResult creationResult = CreateCrossSectionPolyData(result, input, plane,
+                                                                            extractionMode, locator, message);
+    if (!message.empty())
+    {
         if (!fromMainThread)
         {
             mtx.lock();
@@ -199,16 +623,26 @@ vtkCrossSectionCompute::SectionCreationResult vtkCrossSectionCompute::CreateCros
         {
             mtx.unlock();
         }
-    };
+    }
+    return creationResult;
+}
 
+//------------------------------------------------------------------------------
+// The reason of an Abort result is returned in message, for the caller to report.
+static vtkCrossSectionCompute::SectionCreationResult CreateCrossSectionPolyData(
+    vtkPolyData * result, vtkPolyData * input, vtkPlane * plane,
+    vtkCrossSectionCompute::ExtractionMode extractionMode,
+    vtkAbstractCellLocator * locator, std::string& message)
+{
+    typedef vtkCrossSectionCompute::SectionCreationResult SectionCreationResult;
     if (!input)
     {
-        consoleMessage("Input polydata is NULL.");
+        message = "Input polydata is NULL.";
         return SectionCreationResult::Abort;
     }
     if (!plane)
     {
-        consoleMessage("Input cut plane is NULL.");
+        message = "Input cut plane is NULL.";
         return SectionCreationResult::Abort;
     }
 
@@ -216,28 +650,37 @@ vtkCrossSectionCompute::SectionCreationResult vtkCrossSectionCompute::CreateCros
     double * normal = plane->GetNormal();
     if (normal[0] == 0.0 && normal[1] == 0.0 && normal[2] == 0.0)
     {
-        std::string message("Invalid normal [0, 0, 0] at [");
+        message = "Invalid normal [0, 0, 0] at [";
         message += std::to_string(origin[0]) + std::string(", ");
         message += std::to_string(origin[1]) + std::string(", ");
         message += std::to_string(origin[2]) + std::string("].");
-        consoleMessage(message);
         return SectionCreationResult::Abort;
     }
     // Do not copy nor clean the input. Let a caller do what seems appropriate.
     // Cut through the closed surface and get the points of the contour.
     vtkNew<vtkCutter> planeCut;
-    planeCut->SetInputData(input);
+    if (locator)
+    {
+        // Cut the cells along the plane only.
+        vtkNew<vtkPolyData> candidateCells;
+        ExtractCellsAlongPlane(input, locator, plane, candidateCells);
+        planeCut->SetInputData(candidateCells);
+    }
+    else
+    {
+        planeCut->SetInputData(input);
+    }
     planeCut->SetCutFunction(plane);
     planeCut->Update();
     vtkPoints * planePoints = planeCut->GetOutput()->GetPoints();
     if (planePoints == NULL)
     {
-        consoleMessage("Could not cut segment. Is it visible in 3D view?");
+        message = "Could not cut segment. Is it visible in 3D view?";
         return SectionCreationResult::Abort;
     }
     if (planePoints->GetNumberOfPoints() < 3)
     {
-        consoleMessage("Not enough points to create surface");
+        message = "Not enough points to create surface";
         return SectionCreationResult::Abort;
     }
 
@@ -288,63 +731,85 @@ CrossSectionComputeWorker::~CrossSectionComputeWorker()
 
 void CrossSectionComputeWorker::operator () (vtkPolyData * generatedPolyData,
                                                 vtkDoubleArray * generatedTangents,
-                                                vtkPolyData * closedSurfacePolyData,
+                                                const std::vector<CrossSectionSurface>* surfaces,
                                                 vtkDoubleArray * bufferArray,
-                                                vtkIdType startPointIndex,
-                                                vtkIdType endPointIndex,
-                                                vtkIdList* emptySectionIds,
-                                                vtkCrossSectionCompute::ExtractionMode extractionMode)
+                                                CrossSectionWorkQueue* workQueue,
+                                                double* wallTime,
+                                                vtkIdType* numberOfSections,
+                                                std::atomic<vtkIdType>* numberOfComputedSections,
+                                                std::atomic<unsigned int>* numberOfFinishedThreads,
+                                                const std::atomic<bool>* abortExecute,
+                                                CrossSectionThreadReport* reports)
 {
-    for (vtkIdType i = startPointIndex; i <= endPointIndex; i++)
+    const auto startTime = std::chrono::steady_clock::now();
+    std::vector<double> tupleValues(1 + 2 * surfaces->size(), 0.0);
+    vtkIdType startPointIndex = 0;
+    vtkIdType endPointIndex = 0;
+    while (!abortExecute->load() && workQueue->GetNextChunk(startPointIndex, endPointIndex))
     {
-        // Get the contour polydata
-        vtkNew<vtkPolyData> contourPolyData;
-        ComputeCrossSectionPolydata(generatedPolyData, generatedTangents,
-                                    closedSurfacePolyData, i, contourPolyData,
-                                    emptySectionIds, extractionMode);
+        for (vtkIdType i = startPointIndex; i <= endPointIndex; i++)
         {
-            // Get the surface area and circular equivalent diameter
-            vtkNew<vtkMassProperties> crossSectionProperties;
-            crossSectionProperties->SetInputData(contourPolyData);
-            crossSectionProperties->Update();
-            const double crossSectionSurfaceArea = crossSectionProperties->GetSurfaceArea();
-            const double ceDiameter = (sqrt(crossSectionSurfaceArea / vtkMath::Pi())) * 2;
-            
-            bufferArray->InsertNextTuple3((double) i, crossSectionSurfaceArea, ceDiameter);
+            // Checked between sections; a section is never interrupted.
+            if (abortExecute->load())
+            {
+                break;
+            }
+            vtkNew<vtkPlane> plane;
+            const bool validPlane = ComputeCrossSectionPlane(generatedPolyData, generatedTangents,
+                                                             i, plane, &reports[0]);
+            if (!validPlane)
+            {
+                // No surface is cut at this point: report it for each of them.
+                for (size_t s = 1; s < surfaces->size(); s++)
+                {
+                    reports[s].FailedSections.push_back(reports[0].FailedSections.back());
+                }
+            }
+            tupleValues[0] = (double) i;
+            for (size_t s = 0; s < surfaces->size(); s++)
+            {
+                // Get the contour polydata
+                vtkNew<vtkPolyData> contourPolyData;
+                if (validPlane)
+                {
+                    ComputeCrossSectionPolydata((*surfaces)[s], plane, i, contourPolyData, &reports[s]);
+                }
+                // Get the surface area and circular equivalent diameter
+                vtkNew<vtkMassProperties> crossSectionProperties;
+                crossSectionProperties->SetInputData(contourPolyData);
+                crossSectionProperties->Update();
+                const double crossSectionSurfaceArea = crossSectionProperties->GetSurfaceArea();
+                const double ceDiameter = (sqrt(crossSectionSurfaceArea / vtkMath::Pi())) * 2;
+                tupleValues[1 + 2 * s] = crossSectionSurfaceArea;
+                tupleValues[2 + 2 * s] = ceDiameter;
+            }
+            bufferArray->InsertNextTypedTuple(tupleValues.data());
+            (*numberOfSections)++;
+            (*numberOfComputedSections)++;
         }
     }
+    const std::chrono::duration<double> elapsed = std::chrono::steady_clock::now() - startTime;
+    *wallTime = elapsed.count();
+    (*numberOfFinishedThreads)++;
 }
 
 // Translated and adapted from the Python implementation.
-void CrossSectionComputeWorker::ComputeCrossSectionPolydata(
+bool CrossSectionComputeWorker::ComputeCrossSectionPlane(
     vtkPolyData * generatedPolyData,
     vtkDoubleArray * generatedTangents,
-    vtkPolyData * closedSurfacePolyData,
     vtkIdType pointIndex,
-    vtkPolyData * contourPolyData,
-    vtkIdList* emptySectionIds,
-    vtkCrossSectionCompute::ExtractionMode extractionMode)
+    vtkPlane * plane,
+    CrossSectionThreadReport* report)
 {
     if (generatedPolyData == nullptr)
     {
-        mtx.lock();
-        std::cout << "Generated centerline polydata is NULL." << std::endl;
-        mtx.unlock();
-        return;
+        report->FailedSections.emplace_back(pointIndex, "Generated centerline polydata is NULL.");
+        return false;
     }
     if (generatedTangents == nullptr)
     {
-        mtx.lock();
-        std::cout << "Generated centerline tangents is NULL." << std::endl;
-        mtx.unlock();
-        return;
-    }
-    if (closedSurfacePolyData == nullptr)
-    {
-        mtx.lock();
-        std::cout << "Closed  surface polydata is NULL." << std::endl;
-        mtx.unlock();
-        return;
+        report->FailedSections.emplace_back(pointIndex, "Generated centerline tangents is NULL.");
+        return false;
     }
 
     double center[3] = {0.0, 0.0, 0.0};
@@ -358,26 +823,40 @@ void CrossSectionComputeWorker::ComputeCrossSectionPolydata(
 
     if (normal[0] == 0.0 &&  normal[1] == 0.0 &&  normal[2] == 0.0)
     {
-        mtx.lock();
-        std::cout << "Invalid normal [0, 0, 0] at point index " << pointIndex << "." << std::endl;
-        mtx.unlock();
-        return;
+        report->FailedSections.emplace_back(pointIndex, "Invalid normal [0, 0, 0].");
+        return false;
     }
 
     // Place a plane perpendicular to the centerline
-    vtkNew<vtkPlane> plane;
     plane->SetOrigin(center);
     plane->SetNormal(normal);
+    return true;
+}
+
+void CrossSectionComputeWorker::ComputeCrossSectionPolydata(
+    const CrossSectionSurface& surface,
+    vtkPlane * plane,
+    vtkIdType pointIndex,
+    vtkPolyData * contourPolyData,
+    CrossSectionThreadReport* report)
+{
+    if (surface.PolyData == nullptr)
+    {
+        report->FailedSections.emplace_back(pointIndex, "Closed  surface polydata is NULL.");
+        return;
+    }
 
+    std::string message;
     vtkCrossSectionCompute::SectionCreationResult
-    result = vtkCrossSectionCompute::CreateCrossSection(contourPolyData,
-                                                closedSurfacePolyData, plane,
-                                                extractionMode, false);
-    if (emptySectionIds && result == vtkCrossSectionCompute::SectionCreationResult::Empty)
-    {
-        mtx.lock();
-        emptySectionIds->InsertNextId(pointIndex);
-        mtx.unlock();
+    result = CreateCrossSectionPolyData(contourPolyData, surface.PolyData, plane,
+                                        surface.Mode, surface.Locator, message);
+    if (result == vtkCrossSectionCompute::SectionCreationResult::Empty)
+    {
+        report->EmptySectionIds.push_back(pointIndex);
+    }
+    else if (result == vtkCrossSectionCompute::SectionCreationResult::Abort)
+    {
+        report->FailedSections.emplace_back(pointIndex, message);
     }
 }
 
@@ -8,7 +8,10 @@
 
 // Created by cmake
 #include "vtkSlicerCrossSectionAnalysisModuleLogicExport.h"
+#include <atomic>
+#include <string>
 #include <thread>
+#include <vector>
 
 #include <vtkDoubleArray.h>
 #include <vtkMRMLNode.h>
@@ -16,6 +19,10 @@
 #include <vtkSmartPointer.h>
 #include <vtkObjectFactory.h>
 #include <vtkPlane.h>
+#include <vtkStaticCellLocator.h>
+
+struct CrossSectionSurface;
+struct CrossSectionThreadReport;
 
 /**
  * This class computes cross-section areas
@@ -34,42 +41,192 @@ public:
   {
     this->NumberOfThreads = number;
   }
+  unsigned int GetNumberOfThreads()
+  {
+    return this->NumberOfThreads;
+  }
+
+  /**
+   * The threads take the centerline points in chunks of this size
+   * from a shared counter, until all points are processed.
+   * Small chunks balance the load better, large chunks reduce contention.
+   */
+  void SetChunkSize(unsigned int size)
+  {
+    this->ChunkSize = (size > 0) ? size : 1;
+  }
+  unsigned int GetChunkSize()
+  {
+    return this->ChunkSize;
+  }
+
+  /**
+   * UpdateTable() invokes vtkCommand::ProgressEvent from the calling thread,
+   * at most once per interval while the threads work. The interval is in seconds.
+   */
+  void SetProgressInterval(double seconds)
+  {
+    this->ProgressInterval = (seconds > 0.0) ? seconds : 0.0;
+  }
+  double GetProgressInterval()
+  {
+    return this->ProgressInterval;
+  }
+  double GetProgress()
+  {
+    return this->Progress;
+  }
+
+  /**
+   * The threads stop taking new sections when this is set, typically by
+   * a ProgressEvent observer. UpdateTable() then returns false and leaves
+   * the output columns untouched. It is reset when UpdateTable() starts.
+   */
+  void SetAbortExecute(bool abort)
+  {
+    this->AbortExecute = abort;
+  }
+  bool GetAbortExecute()
+  {
+    return this->AbortExecute;
+  }
+  void AbortExecuteOn()
+  {
+    this->SetAbortExecute(true);
+  }
+  void AbortExecuteOff()
+  {
+    this->SetAbortExecute(false);
+  }
+
+  /**
+   * Per-thread counters of the last UpdateTable() call,
+   * to check the load balance. The wall time is in seconds.
+   */
+  double GetThreadWallTime(unsigned int threadIndex);
+  vtkIdType GetThreadNumberOfSections(unsigned int threadIndex);
+
+  /**
+   * Summary of the sections that could not be created in the last
+   * UpdateTable() call, one line per reason with the point ids.
+   * The threads do not log anything themselves.
+   */
+  vtkIdType GetNumberOfFailedSections()
+  {
+    return this->NumberOfFailedSections;
+  }
+  const char * GetReport()
+  {
+    return this->Report.c_str();
+  }
+  // The same for the wall surface, after UpdateWallAndLumenTable().
+  const char * GetWallReport()
+  {
+    return this->WallReport.c_str();
+  }
   
   void SetInputSurfacePolyData(vtkPolyData * inputSurface);
+  /**
+   * The wall surface, e.g. a Tube, cut with the input surface (the lumen)
+   * by UpdateWallAndLumenTable().
+   */
+  void SetInputWallSurfacePolyData(vtkPolyData * wallSurface);
   
   /**
    * Also computes GeneratedPolyData and GeneratedTangents once only.
    */ 
   void SetInputCenterlinePolyData(vtkPolyData * inputCenterlinePolyData);
+
+  /**
+   * The centerline with the tangents, normals and binormals computed
+   * by vtkParallelTransportFrame in SetInputCenterlinePolyData().
+   */
+  vtkPolyData * GetCenterlineFramePolyData()
+  {
+    return this->GeneratedPolyData;
+  }
+  /**
+   * Use a frame computed by SetInputCenterlinePolyData() of another instance,
+   * as is. The frame is not computed again.
+   */
+  bool SetInputCenterlineFramePolyData(vtkPolyData * centerlineFramePolyData);
   
   /**
    * This is the main purpose of this class.
    * The cross-section area and circular equivalent diameter
    * columns of the output table are updated in parallel.
+   * Returns false if it failed or has been aborted; the columns are then not modified.
    */
   enum ExtractionMode{LargestRegion = 0, AllRegions, ClosestPoint};
   bool UpdateTable(vtkDoubleArray * crossSectionAreaArray, vtkDoubleArray * ceDiameterArray,
                    vtkIdList* emptySectionIds  = nullptr,
                    ExtractionMode extractionMode = ExtractionMode::ClosestPoint);
 
+  /**
+   * Cut the lumen (the input surface) and the wall at the same plane
+   * in a single threaded pass. The stenosis ratios are in percent,
+   * -1 where the wall section is empty. The stenosis and the wall minus
+   * lumen area arrays are optional.
+   * Returns false if it failed or has been aborted; the columns are then not modified.
+   */
+  bool UpdateWallAndLumenTable(vtkDoubleArray * lumenAreaArray, vtkDoubleArray * lumenDiameterArray,
+                               vtkDoubleArray * wallAreaArray, vtkDoubleArray * wallDiameterArray,
+                               vtkDoubleArray * diameterStenosisArray = nullptr,
+                               vtkDoubleArray * surfaceAreaStenosisArray = nullptr,
+                               vtkDoubleArray * wallMinusLumenAreaArray = nullptr,
+                               vtkIdList * lumenEmptySectionIds = nullptr,
+                               vtkIdList * wallEmptySectionIds = nullptr,
+                               ExtractionMode extractionMode = ExtractionMode::ClosestPoint);
+
   /**
    * Create a cross-section polydata of the input polydata with a given plane.
    * In ClosestPoint mode, holes nearby to the reference point are rightly
    * excluded.
+   * If a cell locator built on the input is given, only the cells in the
+   * buckets crossed by the plane are cut; the result is the same.
+   * The input must then have its cells built before concurrent calls.
    */
   enum SectionCreationResult {Success = 0, Abort, Empty};
   static SectionCreationResult CreateCrossSection(vtkPolyData * result, vtkPolyData * input,
                                           vtkPlane * plane,
                                           ExtractionMode extractionMode = ExtractionMode::ClosestPoint,
-                                          bool fromMainThread = true);
+                                          bool fromMainThread = true,
+                                          vtkAbstractCellLocator * locator = nullptr);
 
 protected:
   vtkCrossSectionCompute();
   virtual ~vtkCrossSectionCompute();
 
+  /**
+   * Cut all surfaces at each centerline point in the threads, with progress
+   * events and abort checks. Each thread fills its own buffer array and reports.
+   * Returns false if aborted.
+   */
+  bool ComputeSections(const std::vector<CrossSectionSurface>& surfaces,
+                       vtkIdType numberOfValues,
+                       std::vector<vtkSmartPointer<vtkDoubleArray>>& bufferArrays,
+                       std::vector<std::vector<CrossSectionThreadReport>>& reports);
+
 private:
   unsigned int NumberOfThreads;
+  unsigned int ChunkSize;
+  double ProgressInterval;
+  double Progress;
+  std::atomic<bool> AbortExecute;
+  std::vector<double> ThreadWallTimes;
+  std::vector<vtkIdType> ThreadNumberOfSections;
+  vtkIdType NumberOfFailedSections;
+  std::string Report;
+  std::string WallReport;
+  // The only copy of the input surface, shared read-only by all threads.
   vtkSmartPointer<vtkPolyData> ClosedSurfacePolyData;
+  /**
+   * Built once per input surface. Each cut only visits the cells
+   * straddling the plane, instead of the whole surface.
+   */
+  vtkSmartPointer<vtkStaticCellLocator> SurfaceCellLocator;
+  vtkSmartPointer<vtkPolyData> WallSurfacePolyData;
+  vtkSmartPointer<vtkStaticCellLocator> WallSurfaceCellLocator;
   
   /**
    * We don't need normals and binormals.
@@ -532,12 +532,12 @@ class EditCenterlineLogic(ScriptedLoadableModuleLogic):
         gvsLogic.setParameterNode(gvsParameterNode)
         
         segmentID = gvsLogic.process()
-        segmentationNode.CreateClosedSurfaceRepresentation()
         # At this step, the segment editor is already setup.
 
-        # Get segment as polydata.
-        segmentPolyData = vtk.vtkPolyData()
-        if not segmentationNode.GetClosedSurfaceRepresentation(segmentID, segmentPolyData):
+        # Get segment as polydata; it is shared with other modules and is only read here.
+        from CrossSectionAnalysisLib.ClosedSurfaceCache import getClosedSurfaceCache
+        segmentPolyData = getClosedSurfaceCache().getClosedSurfacePolyData(segmentationNode, segmentID)
+        if not segmentPolyData:
             if not self._parameterNode.GetNodeReference(ROLE_OUTPUT_SEGMENTATION):
                 slicer.mrmlScene.RemoveNode(segmentationNode)
             raise RuntimeError(_("Failed to get segment polydata."))
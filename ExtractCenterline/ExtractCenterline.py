@@ -1,11 +1,16 @@
 import os
 import unittest
 import logging
+import hashlib
+import re
+import numpy as np
 import vtk, qt, ctk, slicer
 from slicer.ScriptedLoadableModule import *
 from slicer.util import VTKObservationMixin
 from slicer.i18n import tr as _
 from slicer.i18n import translate
+import ExtractCenterlineLib
+from ExtractCenterlineLib import instrumentedStage
 #
 # ExtractCenterline
 #
@@ -380,6 +385,9 @@ class ExtractCenterlineWidget(ScriptedLoadableModuleWidget, VTKObservationMixin)
 # ExtractCenterlineLogic
 #
 
+# Files of the centerline cache: SHA-256 key, then the kind of polydata.
+CENTERLINE_CACHE_FILE_NAME_PATTERN = re.compile(r"^([0-9a-f]{64})_(centerline|voronoi)\.vtp$")
+
 class ExtractCenterlineLogic(ScriptedLoadableModuleLogic):
     """This class should implement all the actual
     computation done by your module.  The interface
@@ -406,6 +414,14 @@ class ExtractCenterlineLogic(ScriptedLoadableModuleLogic):
         self.frenetTangentArrayName = 'FrenetTangent'
         self.frenetNormalArrayName = 'FrenetNormal'
         self.frenetBinormalArrayName = 'FrenetBinormal'
+        # On-disk cache of extractCenterline() results, disabled if None.
+        self.centerlineCacheDirectory = None
+        self.centerlineCacheMaxSizeMB = 500.0
+        # (points, points MTime, locator) of the last surface opened by openSurfaceAtPoint().
+        # It keeps the surface alive: extractNetwork() releases it once the hole is cut.
+        self.surfacePointLocatorCache = None
+        # Timing and memory of the pipeline stages, disabled by default.
+        self.instrumentation = ExtractCenterlineLib.StageInstrumentation()
 
     def setDefaultParameters(self, parameterNode):
         """
@@ -432,15 +448,64 @@ class ExtractCenterlineLogic(ScriptedLoadableModuleLogic):
             return surfaceNode.GetPolyData()
         elif surfaceNode.IsA("vtkMRMLSegmentationNode"):
             # Segmentation node
+            # The closed surface is shared with other modules: return a copy, the caller may modify it.
+            from CrossSectionAnalysisLib.ClosedSurfaceCache import getClosedSurfaceCache
             polyData = vtk.vtkPolyData()
-            surfaceNode.CreateClosedSurfaceRepresentation()
-            surfaceNode.GetClosedSurfaceRepresentation(segmentId, polyData)
+            closedSurfacePolyData = getClosedSurfaceCache().getClosedSurfacePolyData(surfaceNode, segmentId)
+            if closedSurfacePolyData:
+                polyData.DeepCopy(closedSurfacePolyData)
             return polyData
         else:
             logging.error(_("Surface can only be loaded from model or segmentation node"))
             return None
 
-    def preprocess(self, surfacePolyData, targetNumberOfPoints, decimationAggressiveness, subdivide):
+    def decimateSurface(self, surfacePolyData, reductionFactor):
+        """Decimate a surface in memory, without scene nodes nor CLI module.
+        See ExtractCenterlineLib.decimateSurface().
+        """
+        return ExtractCenterlineLib.decimateSurface(surfacePolyData, reductionFactor)
+
+    def decimateSurfaceWithCLI(self, surfacePolyData, reductionFactor, decimationAggressiveness):
+        """Decimate a surface with the FastQuadric method of the Decimation CLI module.
+        Temporary model nodes are added to the scene, and removed.
+        """
+        parameters = {}
+        inputSurfaceModelNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLModelNode", "tempInputSurfaceModel")
+        inputSurfaceModelNode.SetAndObserveMesh(surfacePolyData)
+        parameters["inputModel"] = inputSurfaceModelNode
+        outputSurfaceModelNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLModelNode", "tempDecimatedSurfaceModel")
+        parameters["outputModel"] = outputSurfaceModelNode
+        parameters["reductionFactor"] = reductionFactor
+        parameters["method"] = "FastQuadric"
+        parameters["aggressiveness"] = decimationAggressiveness
+        decimation = slicer.modules.decimation
+        cliNode = slicer.cli.runSync(decimation, None, parameters)
+        decimatedPolyData = outputSurfaceModelNode.GetPolyData()
+        slicer.mrmlScene.RemoveNode(inputSurfaceModelNode)
+        slicer.mrmlScene.RemoveNode(outputSurfaceModelNode)
+        slicer.mrmlScene.RemoveNode(cliNode)
+        return decimatedPolyData
+
+    def setInstrumentationEnabled(self, enabled):
+        """Record wall time, CPU time, RSS change and input size of each pipeline stage."""
+        self.instrumentation.enabled = enabled
+
+    def exportInstrumentation(self, tableNode=None):
+        """Return the stage records as JSON, and fill tableNode with them if specified."""
+        if tableNode:
+            self.instrumentation.toTable(tableNode.GetTable())
+            tableNode.GetTable().Modified()
+        return self.instrumentation.toJson()
+
+    @instrumentedStage("preprocess")
+    def preprocess(self, surfacePolyData, targetNumberOfPoints, decimationAggressiveness, subdivide, inMemoryDecimation=False):
+        """
+        :param inMemoryDecimation: decimate with decimateSurface() instead of the Decimation CLI module.
+          The scene is not modified, so this can run headless or in a worker process.
+          The surface differs from the one of the CLI: quadric decimation ignores decimationAggressiveness
+          and reaches targetNumberOfPoints, while the mesh size of the FastQuadric method of the CLI mainly
+          depends on decimationAggressiveness. It is also much slower on surfaces of millions of triangles.
+        """
         # import the vmtk libraries
         try:
             import vtkvmtkComputationalGeometryPython as vtkvmtkComputationalGeometry
@@ -452,93 +517,54 @@ class ExtractCenterlineLogic(ScriptedLoadableModuleLogic):
         if numberOfInputPoints == 0:
             raise(_("Input surface model is empty"))
         reductionFactor = (numberOfInputPoints-targetNumberOfPoints) / numberOfInputPoints
-        if reductionFactor > 0.0:
-            parameters = {}
-            inputSurfaceModelNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLModelNode", "tempInputSurfaceModel")
-            inputSurfaceModelNode.SetAndObserveMesh(surfacePolyData)
-            parameters["inputModel"] = inputSurfaceModelNode
-            outputSurfaceModelNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLModelNode", "tempDecimatedSurfaceModel")
-            parameters["outputModel"] = outputSurfaceModelNode
-            parameters["reductionFactor"] = reductionFactor
-            parameters["method"] = "FastQuadric"
-            parameters["aggressiveness"] = decimationAggressiveness
-            decimation = slicer.modules.decimation
-            cliNode = slicer.cli.runSync(decimation, None, parameters)
-            surfacePolyData = outputSurfaceModelNode.GetPolyData()
-            slicer.mrmlScene.RemoveNode(inputSurfaceModelNode)
-            slicer.mrmlScene.RemoveNode(outputSurfaceModelNode)
-            slicer.mrmlScene.RemoveNode(cliNode)
-
-        surfaceCleaner = vtk.vtkCleanPolyData()
-        surfaceCleaner.SetInputData(surfacePolyData)
-        surfaceCleaner.Update()
-
-        surfaceTriangulator = vtk.vtkTriangleFilter()
-        surfaceTriangulator.SetInputData(surfaceCleaner.GetOutput())
-        surfaceTriangulator.PassLinesOff()
-        surfaceTriangulator.PassVertsOff()
-        surfaceTriangulator.Update()
-
-        # new steps for preparation to avoid problems because of slim models (f.e. at stenosis)
-        if subdivide:
-            subdiv = vtk.vtkLinearSubdivisionFilter()
-            subdiv.SetInputData(surfaceTriangulator.GetOutput())
-            subdiv.SetNumberOfSubdivisions(1)
-            subdiv.Update()
-            if subdiv.GetOutput().GetNumberOfPoints() == 0:
-                logging.warning(_("Mesh subdivision failed. Skip subdivision step."))
-                subdivide = False
-
-        normals = vtk.vtkPolyDataNormals()
-        if subdivide:
-            normals.SetInputData(subdiv.GetOutput())
-        else:
-            normals.SetInputData(surfaceTriangulator.GetOutput())
-        normals.SetAutoOrientNormals(1)
-        normals.SetFlipNormals(0)
-        normals.SetConsistency(1)
-        normals.SplittingOff()
-        normals.Update()
+        if reductionFactor > 0.0 and inMemoryDecimation:
+            surfacePolyData = self.decimateSurface(surfacePolyData, reductionFactor)
+        elif reductionFactor > 0.0:
+            surfacePolyData = self.decimateSurfaceWithCLI(surfacePolyData, reductionFactor, decimationAggressiveness)
 
-        return normals.GetOutput()
+        return ExtractCenterlineLib.prepareSurface(surfacePolyData, subdivide)
 
     def extractNonManifoldEdges(self, polyData, nonManifoldEdgesPolyData=None):
         '''
         Returns non-manifold edge center positions.
         nonManifoldEdgesPolyData: optional vtk.vtkPolyData() input, if specified then a polydata is returned that contains the edges
+        Edges are counted over the polygon connectivity array: an edge shared by more than 2 polygons is non-manifold.
+        Edges are returned sorted by point ids.
         '''
-        import vtkvmtkDifferentialGeometryPython as vtkvmtkDifferentialGeometry
-        neighborhoods = vtkvmtkDifferentialGeometry.vtkvmtkNeighborhoods()
-        neighborhoods.SetNeighborhoodTypeToPolyDataManifoldNeighborhood()
-        neighborhoods.SetDataSet(polyData)
-        neighborhoods.Build()
-
-        polyData.BuildCells()
-        polyData.BuildLinks(0)
+        from vtk.util.numpy_support import vtk_to_numpy, numpy_to_vtkIdTypeArray
+
+        polys = polyData.GetPolys()
+        connectivity = vtk_to_numpy(polys.GetConnectivityArray()).astype(np.int64)
+        offsets = vtk_to_numpy(polys.GetOffsetsArray()).astype(np.int64)
+        # Each point of a polygon starts an edge, which ends at the next point of the polygon (cyclically).
+        cellSizes = np.diff(offsets)
+        nextPositions = np.arange(1, len(connectivity) + 1, dtype=np.int64)
+        nonEmptyCells = cellSizes > 0
+        nextPositions[offsets[1:][nonEmptyCells] - 1] = offsets[:-1][nonEmptyCells]
+        edgeStart = connectivity
+        edgeEnd = connectivity[nextPositions]
+        edgeMin = np.minimum(edgeStart, edgeEnd)
+        edgeMax = np.maximum(edgeStart, edgeEnd)
+        # Encode each undirected edge as a single integer, counting them takes a single sort.
+        numberOfPoints = np.int64(max(polyData.GetNumberOfPoints(), 1))
+        edgeKeys = edgeMin * numberOfPoints + edgeMax
+        uniqueEdgeKeys, edgeCounts = np.unique(edgeKeys, return_counts=True)
+        nonManifoldEdgeKeys = uniqueEdgeKeys[edgeCounts > 2]
+        nonManifoldEdgePointIds = np.stack((nonManifoldEdgeKeys // numberOfPoints, nonManifoldEdgeKeys % numberOfPoints), axis=1)
 
         edgeCenterPositions = []
-
-        neighborCellIds = vtk.vtkIdList()
-        nonManifoldEdgeLines = vtk.vtkCellArray()
-        points = polyData.GetPoints()
-        for i in range(neighborhoods.GetNumberOfNeighborhoods()):
-            neighborhood = neighborhoods.GetNeighborhood(i)
-            for j in range(neighborhood.GetNumberOfPoints()):
-                neighborId = neighborhood.GetPointId(j)
-                if i < neighborId:
-                    neighborCellIds.Initialize()
-                    polyData.GetCellEdgeNeighbors(-1, i, neighborId, neighborCellIds)
-                    if neighborCellIds.GetNumberOfIds() > 2:
-                        nonManifoldEdgeLines.InsertNextCell(2)
-                        nonManifoldEdgeLines.InsertCellPoint(i)
-                        nonManifoldEdgeLines.InsertCellPoint(neighborId)
-                        p1 = points.GetPoint(i)
-                        p2 = points.GetPoint(neighborId)
-                        edgeCenterPositions.append([(p1[0]+p2[0])/2.0, (p1[1]+p2[1])/2.0, (p1[2]+p2[2])/2.0])
+        if len(nonManifoldEdgePointIds):
+            points = vtk_to_numpy(polyData.GetPoints().GetData())
+            edgeCenters = (points[nonManifoldEdgePointIds[:, 0]] + points[nonManifoldEdgePointIds[:, 1]]) / 2.0
+            edgeCenterPositions = edgeCenters.astype(float).tolist()
 
         if nonManifoldEdgesPolyData:
             if not polyData.GetPoints():
-                raise ValueError(_("Failed to get non-manifold edges (neighborhood filter output was empty)"))
+                raise ValueError(_("Failed to get non-manifold edges (input surface has no points)"))
+            nonManifoldEdgeOffsets = np.arange(0, 2 * len(nonManifoldEdgePointIds) + 1, 2, dtype=np.int64)
+            nonManifoldEdgeLines = vtk.vtkCellArray()
+            nonManifoldEdgeLines.SetData(numpy_to_vtkIdTypeArray(nonManifoldEdgeOffsets, deep=True),
+                                         numpy_to_vtkIdTypeArray(nonManifoldEdgePointIds.ravel(), deep=True))
             pointsCopy = vtk.vtkPoints()
             pointsCopy.DeepCopy(polyData.GetPoints())
             nonManifoldEdgesPolyData.SetPoints(pointsCopy)
@@ -561,6 +587,7 @@ class ExtractCenterlineLogic(ScriptedLoadableModuleLogic):
         # All points are selected, use the first one as start point
         return 0
 
+    @instrumentedStage("extractNetwork")
     def extractNetwork(self, surfacePolyData, endPointsMarkupsNode, computeGeometry=False):
         """
         Extract centerline network from surfacePolyData
@@ -606,6 +633,7 @@ class ExtractCenterlineLogic(ScriptedLoadableModuleLogic):
             simplifiedPolyData.GetBounds(bounds)
             startPosition = [bounds[0], bounds[2], bounds[4]]
         self.openSurfaceAtPoint(simplifiedPolyData, startPosition)
+        self.surfacePointLocatorCache = None
 
         # Extract network
         networkExtraction = vtkvmtkMisc.vtkvmtkPolyDataNetworkExtraction()
@@ -635,39 +663,97 @@ class ExtractCenterlineLogic(ScriptedLoadableModuleLogic):
         else:
             return networkExtraction.GetOutput()
 
-    def extractCenterline(self, surfacePolyData, endPointsMarkupsNode, curveSamplingDistance=1.0):
-        """Compute centerline.
-        This is more robust and accurate but takes longer than the network extraction.
-        :param surfacePolyData:
-        :param endPointsMarkupsNode:
-        :return:
+    def setCenterlineCache(self, directory, maxSizeMB=500.0):
+        """Enable the on-disk cache of extractCenterline() results.
+        :param directory: cache directory, created if needed; None disables the cache.
+        :param maxSizeMB: the least recently used results are removed beyond this size.
         """
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.centerlineCacheDirectory = directory
+        self.centerlineCacheMaxSizeMB = maxSizeMB
+
+    def _centerlineCacheKey(self, surfacePolyData, endPoints, curveSamplingDistance, enableVoronoiSmoothing, preprocessing=None):
+        """Hash of the surface geometry, the endpoints and the extraction parameters.
+        :param preprocessing: parameters of the preprocessing applied after the surface is hashed, if any
+        """
+        from vtk.util.numpy_support import vtk_to_numpy
+        key = hashlib.sha256()
+        if surfacePolyData.GetPoints():
+            key.update(vtk_to_numpy(surfacePolyData.GetPoints().GetData()).tobytes())
+        for cells in [surfacePolyData.GetVerts(), surfacePolyData.GetLines(), surfacePolyData.GetPolys(), surfacePolyData.GetStrips()]:
+            key.update(vtk_to_numpy(cells.GetOffsetsArray()).tobytes())
+            key.update(vtk_to_numpy(cells.GetConnectivityArray()).tobytes())
+        for position, isTarget in endPoints:
+            key.update(np.array(position, dtype=np.float64).tobytes())
+            key.update(b"1" if isTarget else b"0")
+        key.update(repr((curveSamplingDistance, enableVoronoiSmoothing, self.radiusArrayName)).encode())
+        if preprocessing is not None:
+            key.update(repr(preprocessing).encode())
+        return key.hexdigest()
+
+    def _centerlineCacheFilePaths(self, key):
+        return [os.path.join(self.centerlineCacheDirectory, key + suffix) for suffix in ["_centerline.vtp", "_voronoi.vtp"]]
+
+    def _readCenterlineCache(self, key):
+        """Return the cached centerline and Voronoi diagram polydata, or None."""
+        filePaths = self._centerlineCacheFilePaths(key)
+        if not all(os.path.isfile(filePath) for filePath in filePaths):
+            return None
+        polyDatas = []
+        for filePath in filePaths:
+            reader = vtk.vtkXMLPolyDataReader()
+            reader.SetFileName(filePath)
+            reader.Update()
+            if reader.GetErrorCode() != 0 or not reader.GetOutput():
+                return None
+            polyData = vtk.vtkPolyData()
+            polyData.DeepCopy(reader.GetOutput())
+            polyDatas.append(polyData)
+            # Last access time for LRU eviction.
+            os.utime(filePath)
+        return polyDatas[0], polyDatas[1]
+
+    def _writeCenterlineCache(self, key, centerlinePolyData, voronoiDiagramPolyData):
+        for filePath, polyData in zip(self._centerlineCacheFilePaths(key), [centerlinePolyData, voronoiDiagramPolyData]):
+            writer = vtk.vtkXMLPolyDataWriter()
+            writer.SetFileName(filePath)
+            writer.SetInputData(polyData)
+            writer.SetDataModeToBinary()
+            if not writer.Write():
+                logging.warning(_("Could not write centerline cache file ") + filePath)
+                return
+        self._evictCenterlineCache()
+
+    def _evictCenterlineCache(self):
+        """Remove the least recently used cache entries beyond the size limit.
+        Only the files written by the cache are considered, and both files of an entry are removed together.
+        """
+        # key -> [last access time, size, file paths]
+        cacheEntries = {}
+        for fileName in os.listdir(self.centerlineCacheDirectory):
+            match = CENTERLINE_CACHE_FILE_NAME_PATTERN.match(fileName)
+            if not match:
+                continue
+            filePath = os.path.join(self.centerlineCacheDirectory, fileName)
+            fileStat = os.stat(filePath)
+            cacheEntry = cacheEntries.setdefault(match.group(1), [0.0, 0, []])
+            cacheEntry[0] = max(cacheEntry[0], fileStat.st_mtime)
+            cacheEntry[1] += fileStat.st_size
+            cacheEntry[2].append(filePath)
+        maxSize = self.centerlineCacheMaxSizeMB * 1024 * 1024
+        totalSize = sum(entrySize for _mtime, entrySize, _filePaths in cacheEntries.values())
+        for _mtime, entrySize, filePaths in sorted(cacheEntries.values()):
+            if totalSize <= maxSize:
+                break
+            for filePath in filePaths:
+                os.remove(filePath)
+            totalSize -= entrySize
 
-        import vtkvmtkComputationalGeometryPython as vtkvmtkComputationalGeometry
-        import vtkvmtkMiscPython as vtkvmtkMisc
-
-        # Cap all the holes that are in the mesh that are not marked as endpoints
-        # Maybe this is not needed.
-        capDisplacement = 0.0
-        surfaceCapper = vtkvmtkComputationalGeometry.vtkvmtkCapPolyData()
-        surfaceCapper.SetInputData(surfacePolyData)
-        surfaceCapper.SetDisplacement(capDisplacement)
-        surfaceCapper.SetInPlaneDisplacement(capDisplacement)
-        surfaceCapper.Update()
-
-        if not endPointsMarkupsNode or endPointsMarkupsNode.GetNumberOfControlPoints() < 2:
-            raise ValueError(_("At least two endpoints are needed for centerline extraction"))
-
-        tubePolyData = surfaceCapper.GetOutput()
-        pos = [0.0, 0.0, 0.0]
-        # It seems that vtkvmtkComputationalGeometry does not need holes (unlike network extraction, which does need one hole)
-        # # Punch holes at surface endpoints to have tubular structure
-        # tubePolyData = surfaceCapper.GetOutput()
-        # numberOfEndpoints = endPointsMarkupsNode.GetNumberOfControlPoints()
-        # for pointIndex in range(numberOfEndpoints):
-        #     endPointsMarkupsNode.GetNthControlPointPosition(pointIndex, pos)
-        #     self.openSurfaceAtPoint(tubePolyData, pos)
-
+    def endPointsFromMarkupsNode(self, endPointsMarkupsNode):
+        """Return the endpoints as a list of (position, isTarget).
+        Unselected control points are sources. If all of them are selected then the first one is the source.
+        """
         numberOfControlPoints = endPointsMarkupsNode.GetNumberOfControlPoints()
         foundStartPoint = False
         for controlPointIndex in range(numberOfControlPoints):
@@ -675,93 +761,261 @@ class ExtractCenterlineLogic(ScriptedLoadableModuleLogic):
                 foundStartPoint = True
                 break
 
-        sourceIdList = vtk.vtkIdList()
-        targetIdList = vtk.vtkIdList()
-
-        pointLocator = vtk.vtkPointLocator()
-        pointLocator.SetDataSet(tubePolyData)
-        pointLocator.BuildLocator()
-
+        endPoints = []
         for controlPointIndex in range(numberOfControlPoints):
             isTarget = endPointsMarkupsNode.GetNthControlPointSelected(controlPointIndex)
             if not foundStartPoint and controlPointIndex == 0:
                 # If no start point found then use the first point as source
                 isTarget = False
+            pos = [0.0, 0.0, 0.0]
             endPointsMarkupsNode.GetNthControlPointPosition(controlPointIndex, pos)
-            # locate the point on the surface
-            pointId = pointLocator.FindClosestPoint(pos)
-            if isTarget:
-                targetIdList.InsertNextId(pointId)
-            else:
-                sourceIdList.InsertNextId(pointId)
+            endPoints.append((pos, bool(isTarget)))
+        return endPoints
 
-        slicer.tubePolyData = tubePolyData
+    @instrumentedStage("extractCenterline")
+    def extractCenterline(self, surfacePolyData, endPointsMarkupsNode, curveSamplingDistance=1.0):
+        """Compute centerline.
+        This is more robust and accurate but takes longer than the network extraction.
+        Results are read from and written to the centerline cache if it is enabled, see setCenterlineCache().
+        :param surfacePolyData:
+        :param endPointsMarkupsNode:
+        :return:
+        """
 
-        centerlineFilter = vtkvmtkComputationalGeometry.vtkvmtkPolyDataCenterlines()
-        centerlineFilter.SetInputData(tubePolyData)
-        centerlineFilter.SetSourceSeedIds(sourceIdList)
-        centerlineFilter.SetTargetSeedIds(targetIdList)
-        centerlineFilter.SetRadiusArrayName(self.radiusArrayName)
-        centerlineFilter.SetCostFunction('1/R')  # this makes path search prefer go through points with large radius
-        centerlineFilter.SetFlipNormals(False)
-        centerlineFilter.SetAppendEndPointsToCenterlines(0)
+        if not endPointsMarkupsNode or endPointsMarkupsNode.GetNumberOfControlPoints() < 2:
+            raise ValueError(_("At least two endpoints are needed for centerline extraction"))
 
-        # Voronoi smoothing slightly improves connectivity
-        # Unfortunately, Voronoi smoothing is broken if VMTK is used with VTK9, therefore
-        # disable this feature for now (https://github.com/vmtk/SlicerExtension-VMTK/issues/34)
-        enableVoronoiSmoothing = (slicer.app.majorVersion * 100 + slicer.app.minorVersion < 413)
-        centerlineFilter.SetSimplifyVoronoi(enableVoronoiSmoothing)
+        enableVoronoiSmoothing = self._enableVoronoiSmoothing()
+        endPoints = self.endPointsFromMarkupsNode(endPointsMarkupsNode)
 
-        centerlineFilter.SetCenterlineResampling(0)
-        centerlineFilter.SetResamplingStepLength(curveSamplingDistance)
-        centerlineFilter.Update()
+        cacheKey = None
+        if self.centerlineCacheDirectory:
+            cacheKey = self._centerlineCacheKey(surfacePolyData, endPoints, curveSamplingDistance, enableVoronoiSmoothing)
+            cachedResult = self._readCenterlineCache(cacheKey)
+            if cachedResult:
+                logging.debug(_("Centerline read from cache."))
+                return cachedResult
 
-        if not centerlineFilter.GetOutput():
-            raise ValueError(_("Failed to compute centerline (no output was generated)"))
-        centerlinePolyData = vtk.vtkPolyData()
-        centerlinePolyData.DeepCopy(centerlineFilter.GetOutput())
+        centerlinePolyData, voronoiDiagramPolyData = ExtractCenterlineLib.computeCenterline(
+            surfacePolyData, endPoints, curveSamplingDistance, self.radiusArrayName, enableVoronoiSmoothing)
 
-        if not centerlineFilter.GetVoronoiDiagram():
-            raise ValueError(_("Failed to compute centerline (no Voronoi diagram was generated)"))
-        voronoiDiagramPolyData = vtk.vtkPolyData()
-        voronoiDiagramPolyData.DeepCopy(centerlineFilter.GetVoronoiDiagram())
+        if cacheKey:
+            self._writeCenterlineCache(cacheKey, centerlinePolyData, voronoiDiagramPolyData)
 
         logging.debug(_("End of Centerline Computation."))
         return centerlinePolyData, voronoiDiagramPolyData
 
+    def _enableVoronoiSmoothing(self):
+        # Voronoi smoothing slightly improves connectivity
+        # Unfortunately, Voronoi smoothing is broken if VMTK is used with VTK9, therefore
+        # disable this feature for now (https://github.com/vmtk/SlicerExtension-VMTK/issues/34)
+        return (slicer.app.majorVersion * 100 + slicer.app.minorVersion < 413)
+
+    def extractCenterlinesBatch(self, segmentationNode, segmentEndPoints, targetNumberOfPoints=5000.0, subdivide=False,
+                                curveSamplingDistance=1.0, numberOfWorkers=None, decimationAggressiveness=4.0,
+                                inMemoryDecimation=False):
+        """Extract the centerlines of several segments in a pool of worker processes.
+        Curves and tables are created in the scene afterwards, in a single batch.
+        By default, the surfaces are decimated with the Decimation CLI module before they are sent to the workers,
+        as in preprocess(): the centerlines are the same as the interactive ones.
+        With inMemoryDecimation, the workers decimate with decimateSurface() instead, see preprocess().
+        If the centerline cache is enabled, cached segments are not sent to the workers, and new results are cached.
+        :param segmentEndPoints: list of (segmentId, endPointsMarkupsNode)
+        :param numberOfWorkers: number of worker processes, the number of CPUs by default
+        :return: dict segmentId -> (centerlineModelNode, centerlineCurveNode, centerlinePropertiesTableNode),
+          None for the segments that failed
+        """
+        enableVoronoiSmoothing = self._enableVoronoiSmoothing()
+        tasks = []
+        # segmentId -> centerline polydata, None if it failed.
+        centerlines = {}
+        cacheKeys = {}
+        for segmentId, endPointsMarkupsNode in segmentEndPoints:
+            if not endPointsMarkupsNode or endPointsMarkupsNode.GetNumberOfControlPoints() < 2:
+                raise ValueError(_("At least two endpoints are needed for centerline extraction"))
+            surfacePolyData = self.polyDataFromNode(segmentationNode, segmentId)
+            endPoints = self.endPointsFromMarkupsNode(endPointsMarkupsNode)
+            if self.centerlineCacheDirectory:
+                # The surface is preprocessed afterwards: the preprocessing parameters are part of the key.
+                cacheKey = self._centerlineCacheKey(surfacePolyData, endPoints, curveSamplingDistance, enableVoronoiSmoothing,
+                                                    (targetNumberOfPoints, subdivide, inMemoryDecimation,
+                                                     None if inMemoryDecimation else decimationAggressiveness))
+                cachedResult = self._readCenterlineCache(cacheKey)
+                if cachedResult:
+                    logging.debug(_("Centerline of segment {0} read from cache.").format(segmentId))
+                    centerlines[segmentId] = cachedResult[0]
+                    continue
+                cacheKeys[segmentId] = cacheKey
+            if not inMemoryDecimation and surfacePolyData.GetNumberOfPoints() > targetNumberOfPoints:
+                reductionFactor = (surfacePolyData.GetNumberOfPoints() - targetNumberOfPoints) / surfacePolyData.GetNumberOfPoints()
+                surfacePolyData = self.decimateSurfaceWithCLI(surfacePolyData, reductionFactor, decimationAggressiveness)
+            tasks.append({"segmentId": segmentId,
+                          "surface": ExtractCenterlineLib.polyDataToString(surfacePolyData),
+                          "endPoints": endPoints,
+                          "decimate": inMemoryDecimation,
+                          "targetNumberOfPoints": targetNumberOfPoints,
+                          "subdivide": subdivide,
+                          "curveSamplingDistance": curveSamplingDistance,
+                          "radiusArrayName": self.radiusArrayName,
+                          "enableVoronoiSmoothing": enableVoronoiSmoothing,
+                          "returnVoronoiDiagram": segmentId in cacheKeys})
+        if not tasks and not centerlines:
+            return {}
+
+        for result in self._runCenterlineTasks(tasks, numberOfWorkers):
+            segmentId = result["segmentId"]
+            if "error" in result:
+                logging.error(_("Failed to extract the centerline of segment {0}: {1}").format(segmentId, result["error"]))
+                centerlines[segmentId] = None
+                continue
+            centerlinePolyData = ExtractCenterlineLib.polyDataFromString(result["centerline"])
+            if segmentId in cacheKeys:
+                self._writeCenterlineCache(cacheKeys[segmentId], centerlinePolyData,
+                                           ExtractCenterlineLib.polyDataFromString(result["voronoiDiagram"]))
+            centerlines[segmentId] = centerlinePolyData
+
+        outputs = {}
+        segmentation = segmentationNode.GetSegmentation()
+        slicer.mrmlScene.StartState(slicer.vtkMRMLScene.BatchProcessState)
+        try:
+            for segmentId, _endPointsMarkupsNode in segmentEndPoints:
+                centerlinePolyData = centerlines[segmentId]
+                if centerlinePolyData is None:
+                    outputs[segmentId] = None
+                    continue
+                segmentName = segmentation.GetSegment(segmentId).GetName()
+                centerlineModelNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLModelNode", _("{0} centerline model").format(segmentName))
+                centerlineModelNode.SetAndObserveMesh(centerlinePolyData)
+                centerlineModelNode.CreateDefaultDisplayNodes()
+                centerlineModelNode.GetDisplayNode().SetColor(0.0, 1.0, 0.0)
+                centerlineModelNode.GetDisplayNode().SetLineWidth(3)
+                centerlineCurveNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsCurveNode", _("{0} centerline curve").format(segmentName))
+                centerlineCurveNode.CreateDefaultDisplayNodes()
+                centerlinePropertiesTableNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLTableNode", _("{0} centerline properties").format(segmentName))
+                self.createCurveTreeFromCenterline(centerlinePolyData, centerlineCurveNode, centerlinePropertiesTableNode, curveSamplingDistance)
+                outputs[segmentId] = (centerlineModelNode, centerlineCurveNode, centerlinePropertiesTableNode)
+        finally:
+            slicer.mrmlScene.EndState(slicer.vtkMRMLScene.BatchProcessState)
+        return outputs
+
+    def _runCenterlineTasks(self, tasks, numberOfWorkers=None):
+        """Run ExtractCenterlineLib.extractSegmentCenterline() on each task in worker processes.
+        A task that crashes its worker process fails alone: the other tasks left unfinished by the crash
+        are run again, each in its own process. Tasks run in this process only if the worker processes cannot be started.
+        Results are in the order of the tasks.
+        """
+        import multiprocessing
+        import multiprocessing.spawn
+
+        if not tasks:
+            return []
+        if numberOfWorkers is None:
+            numberOfWorkers = os.cpu_count() or 1
+        numberOfWorkers = max(1, min(numberOfWorkers, len(tasks)))
+        results = [None] * len(tasks)
+        context = multiprocessing.get_context("spawn")
+        # Workers run the Python interpreter of Slicer, not the application executable.
+        # The executable is global to all spawn contexts: restore it once the pools are shut down.
+        previousExecutable = multiprocessing.spawn.get_executable()
+        pythonSlicerExecutable = os.path.join(slicer.app.slicerHome, "bin", "PythonSlicer" + (".exe" if os.name == "nt" else ""))
+        context.set_executable(pythonSlicerExecutable)
+        try:
+            try:
+                unfinishedIndices = self._runCenterlineTasksInPool(context, tasks, range(len(tasks)), numberOfWorkers, results)
+            except Exception as e:
+                logging.warning(_("Worker processes could not be used, centerlines are extracted sequentially: ") + str(e))
+                return [result if result is not None else ExtractCenterlineLib.extractSegmentCenterline(task)
+                        for task, result in zip(tasks, results)]
+            if unfinishedIndices:
+                logging.warning(_("A worker process terminated abruptly, {0} centerlines are extracted again one by one.").format(
+                    len(unfinishedIndices)))
+            for index in unfinishedIndices:
+                try:
+                    crashed = self._runCenterlineTasksInPool(context, tasks, [index], 1, results)
+                except Exception as e:
+                    results[index] = {"segmentId": tasks[index]["segmentId"], "error": str(e)}
+                    continue
+                if crashed:
+                    results[index] = {"segmentId": tasks[index]["segmentId"], "error": _("The worker process terminated abruptly.")}
+        finally:
+            context.set_executable(previousExecutable)
+        return results
+
+    @staticmethod
+    def _runCenterlineTasksInPool(context, tasks, taskIndices, numberOfWorkers, results):
+        """Run the tasks in a pool of worker processes, and store their results.
+        Raises an exception if the worker processes cannot be started.
+        :return: indices of the tasks left without result because a worker process terminated abruptly
+        """
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        from concurrent.futures.process import BrokenProcessPool
+
+        unfinishedIndices = []
+        with ProcessPoolExecutor(max_workers=numberOfWorkers, mp_context=context) as executor:
+            futures = {executor.submit(ExtractCenterlineLib.extractSegmentCenterline, tasks[index]): index for index in taskIndices}
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    results[index] = future.result()
+                except BrokenProcessPool:
+                    unfinishedIndices.append(index)
+                except Exception as e:
+                    results[index] = {"segmentId": tasks[index]["segmentId"], "error": str(e)}
+        return sorted(unfinishedIndices)
+
     def openSurfaceAtPoint(self, polyData, holePosition=None, holePointIndex=None):
         '''
         Modifies the polyData by cutting a hole at the given position.
         '''
 
         if holePointIndex is None:
-            pointLocator = vtk.vtkPointLocator()
-            pointLocator.SetDataSet(polyData)
-            pointLocator.BuildLocator()
             # find the closest point to the desired hole position
-            holePointIndex = pointLocator.FindClosestPoint(holePosition)
+            pointLocator = self.getSurfacePointLocator(polyData)
+            holePointIndex = pointLocator.FindClosestPoint(holePosition) if pointLocator else -1
 
         if holePointIndex < 0:
             # Calling GetPoint(-1) would crash the application
             raise ValueError(_("openSurfaceAtPoint failed: empty input polydata"))
 
+        # Only the first cell of the point is removed (smaller hole).
+        if polyData.GetNumberOfPolys() == polyData.GetNumberOfCells():
+            # Find the first polygon using the point from the connectivity array, without building links.
+            from vtk.util.numpy_support import vtk_to_numpy
+            polys = polyData.GetPolys()
+            connectivityPositions = np.flatnonzero(vtk_to_numpy(polys.GetConnectivityArray()) == holePointIndex)
+            if len(connectivityPositions) > 0:
+                cellId = int(np.searchsorted(vtk_to_numpy(polys.GetOffsetsArray()), connectivityPositions[0], side='right') - 1)
+                polyData.BuildCells()
+                polyData.DeleteCell(cellId)
+                polyData.RemoveDeletedCells()
+            return
+
         # Tell the polydata to build 'upward' links from points to cells
         polyData.BuildLinks()
         # Mark cells as deleted
         cellIds = vtk.vtkIdList()
         polyData.GetPointCells(holePointIndex, cellIds)
-        removeFirstCell = True
-        if removeFirstCell:
-            # remove first cell only (smaller hole)
-            if cellIds.GetNumberOfIds() > 0:
-                polyData.DeleteCell(cellIds.GetId(0))
-                polyData.RemoveDeletedCells()
-        else:
-            # remove all cells
-            for cellIdIndex in range(cellIds.GetNumberOfIds()):
-                polyData.DeleteCell(cellIds.GetId(cellIdIndex))
+        if cellIds.GetNumberOfIds() > 0:
+            polyData.DeleteCell(cellIds.GetId(0))
             polyData.RemoveDeletedCells()
 
+    def getSurfacePointLocator(self, polyData):
+        '''
+        Returns a vtkStaticPointLocator of the polyData points. It is kept until the points change.
+        '''
+        points = polyData.GetPoints()
+        if points is None:
+            return None
+        if self.surfacePointLocatorCache:
+            cachedPoints, cachedPointsMTime, pointLocator = self.surfacePointLocatorCache
+            if cachedPoints is points and cachedPointsMTime == points.GetMTime():
+                return pointLocator
+        pointLocator = vtk.vtkStaticPointLocator()
+        pointLocator.SetDataSet(polyData)
+        pointLocator.BuildLocator()
+        self.surfacePointLocatorCache = (points, points.GetMTime(), pointLocator)
+        return pointLocator
+
     def getEndPoints(self, inputNetworkPolyData, startPointPosition):
         '''
         Clips the surfacePolyData on the endpoints identified using the networkPolyData.
@@ -778,51 +1032,45 @@ class ExtractCenterlineLogic(ScriptedLoadableModuleLogic):
         cleaner.SetInputData(inputNetworkPolyData)
         cleaner.Update()
         network = cleaner.GetOutput()
-        network.BuildCells()
-        network.BuildLinks(0)
 
+        from vtk.util.numpy_support import vtk_to_numpy
         networkPoints = network.GetPoints()
-        radiusArray = network.GetPointData().GetArray(self.radiusArrayName)
-
-        startPointId = -1
-        maxRadius = 0
-        minDistance2 = 0
+        endpointPositions = []
+        if not networkPoints or network.GetNumberOfLines() == 0:
+            return endpointPositions
 
-        endpointIds = vtk.vtkIdList()
-        for i in range(network.GetNumberOfCells()):
-            numberOfCellPoints = network.GetCell(i).GetNumberOfPoints()
-            if numberOfCellPoints < 2:
-                continue
+        # Point degree: number of cells using each point, over all cell types.
+        pointDegrees = np.zeros(network.GetNumberOfPoints(), dtype=np.int64)
+        for cells in [network.GetVerts(), network.GetLines(), network.GetPolys(), network.GetStrips()]:
+            pointDegrees += np.bincount(vtk_to_numpy(cells.GetConnectivityArray()).astype(np.int64), minlength=len(pointDegrees))
+
+        # First and last points of the lines with at least 2 points, in cell order.
+        lines = network.GetLines()
+        offsets = vtk_to_numpy(lines.GetOffsetsArray()).astype(np.int64)
+        connectivity = vtk_to_numpy(lines.GetConnectivityArray()).astype(np.int64)
+        validLines = np.diff(offsets) >= 2
+        lineEndPointIds = np.stack((connectivity[offsets[:-1][validLines]], connectivity[offsets[1:][validLines] - 1]), axis=1).ravel()
+        lineEndPointIds = lineEndPointIds[pointDegrees[lineEndPointIds] == 1]
+        # Unique ids, in the order they are found.
+        _unused, firstIndices = np.unique(lineEndPointIds, return_index=True)
+        endpointIds = lineEndPointIds[np.sort(firstIndices)]
+        if len(endpointIds) == 0:
+            return endpointPositions
 
-            for pointIndex in [0, numberOfCellPoints - 1]:
-                pointId = network.GetCell(i).GetPointId(pointIndex)
-                pointCells = vtk.vtkIdList()
-                network.GetPointCells(pointId, pointCells)
-                if pointCells.GetNumberOfIds() == 1:
-                    endpointIds.InsertUniqueId(pointId)
-                    if startPointPosition is not None:
-                        # find start point based on position
-                        position = networkPoints.GetPoint(pointId)
-                        distance2 = vtk.vtkMath.Distance2BetweenPoints(position, startPointPosition)
-                        if startPointId < 0 or distance2 < minDistance2:
-                            minDistance2 = distance2
-                            startPointId = pointId
-                    else:
-                        # find start point based on radius
-                        radius = radiusArray.GetValue(pointId)
-                        if startPointId < 0 or radius > maxRadius:
-                            maxRadius = radius
-                            startPointId = pointId
+        if startPointPosition is not None:
+            # find start point based on position
+            positions = vtk_to_numpy(networkPoints.GetData())[endpointIds]
+            distances2 = np.sum((positions - np.array(startPointPosition)) ** 2, axis=1)
+            startPointId = int(endpointIds[np.argmin(distances2)])
+        else:
+            # find start point based on radius
+            radii = vtk_to_numpy(network.GetPointData().GetArray(self.radiusArrayName))[endpointIds]
+            startPointId = int(endpointIds[np.argmax(radii)])
 
-        endpointPositions = []
-        numberOfEndpointIds = endpointIds.GetNumberOfIds()
-        if numberOfEndpointIds == 0:
-            return endpointPositions
         # add the largest radius point first
         endpointPositions.append(networkPoints.GetPoint(startPointId))
         # add all the other points
-        for pointIdIndex in range(numberOfEndpointIds):
-            pointId = endpointIds.GetId(pointIdIndex)
+        for pointId in endpointIds.tolist():
             if pointId == startPointId:
                 # already added
                 continue
@@ -830,6 +1078,7 @@ class ExtractCenterlineLogic(ScriptedLoadableModuleLogic):
 
         return endpointPositions
 
+    @instrumentedStage("createCurveTreeFromCenterline")
     def createCurveTreeFromCenterline(self, centerlinePolyData, centerlineCurveNode=None, centerlinePropertiesTableNode=None, curveSamplingDistance=1.0):
 
         import vtkvmtkComputationalGeometryPython as vtkvmtkComputationalGeometry
@@ -931,9 +1180,55 @@ class ExtractCenterlineLogic(ScriptedLoadableModuleLogic):
         shNode = slicer.vtkMRMLSubjectHierarchyNode.GetSubjectHierarchyNode(slicer.mrmlScene)
         curveItem = shNode.GetItemByDataNode(centerlineCurveNode)
         shNode.RemoveItemChildren(curveItem)
+        if mergedCenterlines.GetNumberOfCells() == 0:
+            return
         # Add centerline widgets
-        self.processedCellIds = []
-        self._addCenterline(mergedCenterlines, replaceCurve=centerlineCurveNode)
+        cellIndex = self._buildCenterlineCellIndex(mergedCenterlines)
+        slicer.app.pauseRender()
+        try:
+            # Depth-first traversal from the first cell: same order as a recursion over the child cells.
+            processedCellIds = set()
+            # (cellId, baseName, parentItem)
+            pendingCells = [(0, None, None)]
+            while pendingCells:
+                cellId, baseName, parentItem = pendingCells.pop()
+                if cellId in processedCellIds:
+                    continue
+                processedCellIds.add(cellId)
+                replaceCurve = centerlineCurveNode if cellId == 0 and parentItem is None else None
+                baseName, curveItem = self._addCenterline(mergedCenterlines, cellIndex, baseName, cellId, parentItem, replaceCurve)
+                childCellIds = cellIndex["childCellIds"].get(cellIndex["endPointIds"][cellId], [])
+                for childCellId in reversed(childCellIds):
+                    if childCellId not in processedCellIds:
+                        pendingCells.append((childCellId, baseName, curveItem))
+        finally:
+            slicer.app.resumeRender()
+
+    def _buildCenterlineCellIndex(self, mergedCenterlines):
+        """Index the merged centerline cells in a single pass.
+        childCellIds: start point id -> ids of the cells that start there, in cell order.
+        endPointIds: end point id of each cell.
+        groupPointIds: group id -> (first cell id of the group, point ids of all cells of the group).
+        """
+        groupIdsArray = mergedCenterlines.GetCellData().GetArray(self.groupIdsArrayName)
+        childCellIds = {}
+        endPointIds = []
+        groupPointIds = {}
+        cellPointIds = vtk.vtkIdList()
+        for cellId in range(mergedCenterlines.GetNumberOfCells()):
+            mergedCenterlines.GetCellPoints(cellId, cellPointIds)
+            numberOfCellPoints = cellPointIds.GetNumberOfIds()
+            pointIds = [cellPointIds.GetId(i) for i in range(numberOfCellPoints)]
+            if numberOfCellPoints == 0:
+                endPointIds.append(-1)
+                continue
+            childCellIds.setdefault(pointIds[0], []).append(cellId)
+            endPointIds.append(pointIds[-1])
+            groupId = groupIdsArray.GetValue(cellId)
+            if groupId not in groupPointIds:
+                groupPointIds[groupId] = (cellId, [])
+            groupPointIds[groupId][1].extend(pointIds)
+        return {"childCellIds": childCellIds, "endPointIds": endPointIds, "groupPointIds": groupPointIds}
 
     def _addCurveMeasurementArray(self, curveNode, radiusArray):
         try:
@@ -952,18 +1247,9 @@ class ExtractCenterlineLogic(ScriptedLoadableModuleLogic):
             # This Slicer version does not support curve measurements
             pass
 
-    def _addCenterline(self, mergedCenterlines, baseName=None, cellId=0, parentItem=None, replaceCurve=None):
-        # Add current cell as a curve node
-        assignAttribute = vtk.vtkAssignAttribute()
-        assignAttribute.SetInputData(mergedCenterlines)
-        assignAttribute.Assign(self.groupIdsArrayName, vtk.vtkDataSetAttributes.SCALARS, vtk.vtkAssignAttribute.CELL_DATA)
-
-        thresholder = vtk.vtkThreshold()
-        thresholder.SetInputConnection(assignAttribute.GetOutputPort())
+    def _addCenterline(self, mergedCenterlines, cellIndex, baseName=None, cellId=0, parentItem=None, replaceCurve=None):
+        """Add a single cell as a curve node. Returns the base name and the subject hierarchy item of the curve."""
         groupId = mergedCenterlines.GetCellData().GetArray(self.groupIdsArrayName).GetValue(cellId)
-        thresholder.SetLowerThreshold(groupId - 0.5)
-        thresholder.SetUpperThreshold(groupId + 0.5)
-        thresholder.Update()
 
         if replaceCurve:
             # update existing curve widget
@@ -993,29 +1279,27 @@ class ExtractCenterlineLogic(ScriptedLoadableModuleLogic):
 
         # Add control points in the order as appears in the cell (line) because the point IDs are not in the
         # correct order (the branching points always have the highest ID).
-        curveNode.SetControlPointPositionsWorld(thresholder.GetOutput().GetCell(0).GetPoints())
-
-        self._addCurveMeasurementArray(curveNode, thresholder.GetOutput().GetPointData().GetArray('Radius'))
+        # The first cell of the group and the radius of the points of the group, as a group threshold gives.
+        firstGroupCellId, groupPointIds = cellIndex["groupPointIds"][groupId]
+        curveNode.SetControlPointPositionsWorld(mergedCenterlines.GetCell(firstGroupCellId).GetPoints())
+
+        inputRadiusArray = mergedCenterlines.GetPointData().GetArray('Radius')
+        if inputRadiusArray:
+            radiusArray = vtk.vtkDoubleArray()
+            radiusArray.SetName(inputRadiusArray.GetName())
+            addedPointIds = set()
+            for pointId in groupPointIds:
+                if pointId not in addedPointIds:
+                    addedPointIds.add(pointId)
+                    radiusArray.InsertNextValue(inputRadiusArray.GetValue(pointId))
+            self._addCurveMeasurementArray(curveNode, radiusArray)
 
         slicer.modules.markups.logic().SetAllControlPointsVisibility(curveNode, False)
-        slicer.app.processEvents()
         shNode = slicer.vtkMRMLSubjectHierarchyNode.GetSubjectHierarchyNode(slicer.mrmlScene)
         curveItem = shNode.GetItemByDataNode(curveNode)
         if parentItem is not None:
             shNode.SetItemParent(curveItem, parentItem)
-        # Add connecting cells
-        self.processedCellIds.append(cellId)
-        cellPoints = mergedCenterlines.GetCell(cellId).GetPointIds()
-        endPointIndex = cellPoints.GetId(cellPoints.GetNumberOfIds() - 1)
-        numberOfCells = mergedCenterlines.GetNumberOfCells()
-        branchIndex = 0
-        for neighborCellIndex in range(numberOfCells):
-            if neighborCellIndex in self.processedCellIds:
-                continue
-            if endPointIndex != mergedCenterlines.GetCell(neighborCellIndex).GetPointIds().GetId(0):
-                continue
-            branchIndex += 1
-            self._addCenterline(mergedCenterlines, baseName, neighborCellIndex, curveItem)
+        return baseName, curveItem
 
     def addNetworkProperties(self, networkPolyData, networkPropertiesTableNode):
         networkPropertiesTableNode.RemoveAllColumns()
@@ -1092,37 +1376,54 @@ class ExtractCenterlineLogic(ScriptedLoadableModuleLogic):
         if baseName is None:
             baseName = centerlineCurveNode.GetName()
 
+        from vtk.util.numpy_support import vtk_to_numpy, numpy_to_vtk
+
         colorNode = slicer.mrmlScene.GetNodeByID("vtkMRMLColorTableNodeRandom")
         numberOfCells = networkPolyData.GetNumberOfCells()
+        if numberOfCells == 0:
+            return
+        points = vtk_to_numpy(networkPolyData.GetPoints().GetData())
+        radii = vtk_to_numpy(networkPolyData.GetPointData().GetArray('Radius'))
+        # The network is made of lines only: read the point ids of all cells from the connectivity array.
+        lines = networkPolyData.GetLines()
+        linesOnly = (lines.GetNumberOfCells() == numberOfCells)
+        if linesOnly:
+            offsets = vtk_to_numpy(lines.GetOffsetsArray())
+            connectivity = vtk_to_numpy(lines.GetConnectivityArray())
+        cellPointIdList = vtk.vtkIdList()
         slicer.app.pauseRender()
         try:
-            radiusArray = networkPolyData.GetPointData().GetArray('Radius')
             for cellId in range(numberOfCells):
+                if linesOnly:
+                    cellPointIds = connectivity[offsets[cellId]:offsets[cellId + 1]]
+                else:
+                    networkPolyData.GetCellPoints(cellId, cellPointIdList)
+                    cellPointIds = np.array([cellPointIdList.GetId(i) for i in range(cellPointIdList.GetNumberOfIds())], dtype=np.int64)
+
                 # Create curve node
                 curveNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsCurveNode", "{0} ({1})".format(baseName, cellId))
                 curveNode.CreateDefaultDisplayNodes()
+                wasModifying = curveNode.StartModify()
                 color = [0.5, 0.5, 0.5, 1.0]
                 colorNode.GetColor(cellId, color)
                 curveNode.GetDisplayNode().SetSelectedColor(color[0:3])
                 curveNode.SetNumberOfPointsPerInterpolatingSegment(1)
-                # Add to subject hierarchy
-                curveItem = shNode.GetItemByDataNode(curveNode)
-                shNode.SetItemParent(curveItem, parentItem)
-
-                # Add point positions and radius array
-                radiusMeasurementArray = vtk.vtkDoubleArray()
-                radiusMeasurementArray.SetName('Radius')
                 curveNode.SetAttribute("CellId", str(cellId))
-                cellPoints = networkPolyData.GetCell(cellId).GetPointIds()
-                numberOfCellCurvePoints = cellPoints.GetNumberOfIds()
-                for cellPointIdIndex in range(numberOfCellCurvePoints):
-                    pointId = cellPoints.GetId(cellPointIdIndex)
-                    curveNode.AddControlPointWorld(vtk.vtkVector3d(networkPolyData.GetPoint(pointId)))
-                    radiusMeasurementArray.InsertNextValue(radiusArray.GetValue(pointId))
 
+                # Set all point positions and the radius array at once
+                curvePoints = vtk.vtkPoints()
+                curvePoints.SetData(numpy_to_vtk(points[cellPointIds], deep=True))
+                curveNode.SetControlPointPositionsWorld(curvePoints)
+                radiusMeasurementArray = numpy_to_vtk(radii[cellPointIds].astype(np.float64), deep=True)
+                radiusMeasurementArray.SetName('Radius')
                 self._addCurveMeasurementArray(curveNode, radiusMeasurementArray)
 
                 slicer.modules.markups.logic().SetAllControlPointsVisibility(curveNode, False)
+                curveNode.EndModify(wasModifying)
+
+                # Add to subject hierarchy
+                curveItem = shNode.GetItemByDataNode(curveNode)
+                shNode.SetItemParent(curveItem, parentItem)
         finally:
             slicer.app.resumeRender()
 
@@ -1148,6 +1449,9 @@ class ExtractCenterlineTest(ScriptedLoadableModuleTest):
         """
         self.setUp()
         self.test_ExtractCenterline1()
+        self.test_NonManifoldEdges()
+        self.test_NetworkEndPoints()
+        self.test_DecimationPaths()
 
     def test_ExtractCenterline1(self):
         """ Ideally you should have several levels of tests.  At the lowest level
@@ -1199,3 +1503,93 @@ class ExtractCenterlineTest(ScriptedLoadableModuleTest):
 
         self.delayDisplay('Test passed')
 
+    def test_NonManifoldEdges(self):
+        """Three triangles sharing one edge, and a manifold patch that must not be reported."""
+        self.delayDisplay("Starting the test")
+        points = vtk.vtkPoints()
+        for position in [(0, 0, 0), (1, 0, 0), (0, 1, 0), (0, -1, 0), (0, 0, 1),
+                         (10, 0, 0), (11, 0, 0), (11, 1, 0), (10, 1, 0)]:
+            points.InsertNextPoint(position)
+        polys = vtk.vtkCellArray()
+        for triangle in [(0, 1, 2), (0, 1, 3), (1, 0, 4), (5, 6, 7), (5, 7, 8)]:
+            polys.InsertNextCell(3, triangle)
+        polyData = vtk.vtkPolyData()
+        polyData.SetPoints(points)
+        polyData.SetPolys(polys)
+
+        logic = ExtractCenterlineLogic()
+        nonManifoldEdgesPolyData = vtk.vtkPolyData()
+        edgeCenterPositions = logic.extractNonManifoldEdges(polyData, nonManifoldEdgesPolyData)
+        self.assertEqual(len(edgeCenterPositions), 1)
+        np.testing.assert_allclose(edgeCenterPositions[0], [0.5, 0.0, 0.0])
+        self.assertEqual(nonManifoldEdgesPolyData.GetNumberOfLines(), 1)
+        edgePointIds = vtk.vtkIdList()
+        nonManifoldEdgesPolyData.GetLines().GetCellAtId(0, edgePointIds)
+        self.assertEqual([edgePointIds.GetId(i) for i in range(edgePointIds.GetNumberOfIds())], [0, 1])
+        self.assertEqual(nonManifoldEdgesPolyData.GetNumberOfPoints(), polyData.GetNumberOfPoints())
+        self.delayDisplay('Test passed')
+
+    def test_NetworkEndPoints(self):
+        """Only the line ends used by a single cell are endpoints; the largest radius or the closest one is first."""
+        self.delayDisplay("Starting the test")
+        logic = ExtractCenterlineLogic()
+        points = vtk.vtkPoints()
+        radii = vtk.vtkDoubleArray()
+        radii.SetName(logic.radiusArrayName)
+        for position, radius in [((0, 0, 0), 3.0), ((0, 0, 10), 2.5), ((5, 0, 20), 1.0), ((-5, 0, 20), 1.5)]:
+            points.InsertNextPoint(position)
+            radii.InsertNextValue(radius)
+        lines = vtk.vtkCellArray()
+        # The junction point 1 is used by the three lines.
+        for line in [(0, 1), (1, 2), (1, 3)]:
+            lines.InsertNextCell(2, line)
+        network = vtk.vtkPolyData()
+        network.SetPoints(points)
+        network.SetLines(lines)
+        network.GetPointData().AddArray(radii)
+
+        endPoints = logic.getEndPoints(network, None)
+        np.testing.assert_allclose(endPoints, [(0, 0, 0), (5, 0, 20), (-5, 0, 20)])
+        endPoints = logic.getEndPoints(network, (-4, 0, 19))
+        np.testing.assert_allclose(endPoints, [(-5, 0, 20), (0, 0, 0), (5, 0, 20)])
+        self.delayDisplay('Test passed')
+
+    def test_DecimationPaths(self):
+        """In-memory decimation stays close to the Decimation CLI module, in point count and in shape."""
+        self.delayDisplay("Starting the test")
+        sphereSource = vtk.vtkSphereSource()
+        sphereSource.SetRadius(20.0)
+        sphereSource.SetThetaResolution(200)
+        sphereSource.SetPhiResolution(200)
+        sphereSource.Update()
+        surfacePolyData = sphereSource.GetOutput()
+        targetNumberOfPoints = 5000
+        reductionFactor = (surfacePolyData.GetNumberOfPoints() - targetNumberOfPoints) / surfacePolyData.GetNumberOfPoints()
+
+        logic = ExtractCenterlineLogic()
+        inMemoryPolyData = logic.decimateSurface(surfacePolyData, reductionFactor)
+        cliPolyData = logic.decimateSurfaceWithCLI(surfacePolyData, reductionFactor, 4.0)
+        self.assertLessEqual(inMemoryPolyData.GetNumberOfPoints(), 1.1 * targetNumberOfPoints)
+        self.assertLessEqual(abs(inMemoryPolyData.GetNumberOfPoints() - cliPolyData.GetNumberOfPoints()),
+                             0.25 * cliPolyData.GetNumberOfPoints())
+
+        # Largest distance from the points of each surface to the other surface.
+        def maximumDistance(polyData, toPolyData):
+            cellLocator = vtk.vtkStaticCellLocator()
+            cellLocator.SetDataSet(toPolyData)
+            cellLocator.BuildLocator()
+            closestPoint = [0.0, 0.0, 0.0]
+            cell = vtk.vtkGenericCell()
+            cellId = vtk.reference(0)
+            subId = vtk.reference(0)
+            distance2 = vtk.reference(0.0)
+            maximumDistance2 = 0.0
+            for pointId in range(polyData.GetNumberOfPoints()):
+                cellLocator.FindClosestPoint(polyData.GetPoint(pointId), closestPoint, cell, cellId, subId, distance2)
+                maximumDistance2 = max(maximumDistance2, distance2.get())
+            return maximumDistance2 ** 0.5
+        tolerance = 0.01 * sphereSource.GetRadius()
+        self.assertLess(maximumDistance(inMemoryPolyData, cliPolyData), tolerance)
+        self.assertLess(maximumDistance(cliPolyData, inMemoryPolyData), tolerance)
+        self.delayDisplay('Test passed')
+
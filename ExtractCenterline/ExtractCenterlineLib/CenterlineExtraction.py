@@ -0,0 +1,177 @@
+"""
+Surface preprocessing and centerline extraction on vtkPolyData only.
+Nothing here uses the scene, Qt or the application: these functions can run
+in worker processes, see extractSegmentCenterline().
+"""
+import logging
+import vtk
+
+__all__ = ["decimateSurface", "prepareSurface", "computeCenterline",
+           "polyDataToString", "polyDataFromString", "extractSegmentCenterline"]
+
+
+def decimateSurface(surfacePolyData, reductionFactor):
+    """Decimate a surface in memory, without scene nodes nor CLI module.
+    Quadric decimation is used; the decimation aggressiveness of the CLI FastQuadric method has no equivalent here,
+    and it is much slower than the CLI on surfaces of millions of triangles.
+    :param reductionFactor: fraction of the triangles to remove, in [0, 1[
+    :return: a new decimated vtkPolyData
+    """
+    triangulator = vtk.vtkTriangleFilter()
+    triangulator.SetInputData(surfacePolyData)
+    triangulator.PassLinesOff()
+    triangulator.PassVertsOff()
+    decimation = vtk.vtkQuadricDecimation()
+    decimation.SetInputConnection(triangulator.GetOutputPort())
+    decimation.SetTargetReduction(reductionFactor)
+    decimation.VolumePreservationOn()
+    decimation.Update()
+    decimatedPolyData = vtk.vtkPolyData()
+    decimatedPolyData.DeepCopy(decimation.GetOutput())
+    return decimatedPolyData
+
+
+def prepareSurface(surfacePolyData, subdivide):
+    """Clean, triangulate, optionally subdivide the surface and compute consistent normals."""
+    surfaceCleaner = vtk.vtkCleanPolyData()
+    surfaceCleaner.SetInputData(surfacePolyData)
+    surfaceCleaner.Update()
+
+    surfaceTriangulator = vtk.vtkTriangleFilter()
+    surfaceTriangulator.SetInputData(surfaceCleaner.GetOutput())
+    surfaceTriangulator.PassLinesOff()
+    surfaceTriangulator.PassVertsOff()
+    surfaceTriangulator.Update()
+
+    # new steps for preparation to avoid problems because of slim models (f.e. at stenosis)
+    if subdivide:
+        subdiv = vtk.vtkLinearSubdivisionFilter()
+        subdiv.SetInputData(surfaceTriangulator.GetOutput())
+        subdiv.SetNumberOfSubdivisions(1)
+        subdiv.Update()
+        if subdiv.GetOutput().GetNumberOfPoints() == 0:
+            logging.warning("Mesh subdivision failed. Skip subdivision step.")
+            subdivide = False
+
+    normals = vtk.vtkPolyDataNormals()
+    if subdivide:
+        normals.SetInputData(subdiv.GetOutput())
+    else:
+        normals.SetInputData(surfaceTriangulator.GetOutput())
+    normals.SetAutoOrientNormals(1)
+    normals.SetFlipNormals(0)
+    normals.SetConsistency(1)
+    normals.SplittingOff()
+    normals.Update()
+
+    return normals.GetOutput()
+
+
+def computeCenterline(surfacePolyData, endPoints, curveSamplingDistance, radiusArrayName, enableVoronoiSmoothing):
+    """Compute the centerline between endpoints of a preprocessed surface.
+    :param endPoints: list of (position, isTarget); at least one of them must be a source.
+    :return: centerline and Voronoi diagram polydata
+    """
+    import vtkvmtkComputationalGeometryPython as vtkvmtkComputationalGeometry
+
+    # Cap all the holes that are in the mesh that are not marked as endpoints
+    # Maybe this is not needed.
+    capDisplacement = 0.0
+    surfaceCapper = vtkvmtkComputationalGeometry.vtkvmtkCapPolyData()
+    surfaceCapper.SetInputData(surfacePolyData)
+    surfaceCapper.SetDisplacement(capDisplacement)
+    surfaceCapper.SetInPlaneDisplacement(capDisplacement)
+    surfaceCapper.Update()
+
+    tubePolyData = surfaceCapper.GetOutput()
+    # It seems that vtkvmtkComputationalGeometry does not need holes (unlike network extraction, which does need one hole)
+
+    sourceIdList = vtk.vtkIdList()
+    targetIdList = vtk.vtkIdList()
+
+    pointLocator = vtk.vtkPointLocator()
+    pointLocator.SetDataSet(tubePolyData)
+    pointLocator.BuildLocator()
+
+    for position, isTarget in endPoints:
+        # locate the point on the surface
+        pointId = pointLocator.FindClosestPoint(position)
+        if isTarget:
+            targetIdList.InsertNextId(pointId)
+        else:
+            sourceIdList.InsertNextId(pointId)
+
+    centerlineFilter = vtkvmtkComputationalGeometry.vtkvmtkPolyDataCenterlines()
+    centerlineFilter.SetInputData(tubePolyData)
+    centerlineFilter.SetSourceSeedIds(sourceIdList)
+    centerlineFilter.SetTargetSeedIds(targetIdList)
+    centerlineFilter.SetRadiusArrayName(radiusArrayName)
+    centerlineFilter.SetCostFunction('1/R')  # this makes path search prefer go through points with large radius
+    centerlineFilter.SetFlipNormals(False)
+    centerlineFilter.SetAppendEndPointsToCenterlines(0)
+    centerlineFilter.SetSimplifyVoronoi(enableVoronoiSmoothing)
+
+    centerlineFilter.SetCenterlineResampling(0)
+    centerlineFilter.SetResamplingStepLength(curveSamplingDistance)
+    centerlineFilter.Update()
+
+    if not centerlineFilter.GetOutput():
+        raise ValueError("Failed to compute centerline (no output was generated)")
+    centerlinePolyData = vtk.vtkPolyData()
+    centerlinePolyData.DeepCopy(centerlineFilter.GetOutput())
+
+    if not centerlineFilter.GetVoronoiDiagram():
+        raise ValueError("Failed to compute centerline (no Voronoi diagram was generated)")
+    voronoiDiagramPolyData = vtk.vtkPolyData()
+    voronoiDiagramPolyData.DeepCopy(centerlineFilter.GetVoronoiDiagram())
+
+    return centerlinePolyData, voronoiDiagramPolyData
+
+
+def polyDataToString(polyData):
+    """Serialize a polydata to send it to or from a worker process."""
+    writer = vtk.vtkXMLPolyDataWriter()
+    writer.SetInputData(polyData)
+    writer.SetDataModeToBinary()  # base64 encoded, the string is ASCII
+    writer.WriteToOutputStringOn()
+    writer.Write()
+    return writer.GetOutputString()
+
+
+def polyDataFromString(polyDataString):
+    reader = vtk.vtkXMLPolyDataReader()
+    reader.ReadFromInputStringOn()
+    reader.SetInputString(polyDataString)
+    reader.Update()
+    polyData = vtk.vtkPolyData()
+    polyData.DeepCopy(reader.GetOutput())
+    return polyData
+
+
+def extractSegmentCenterline(task):
+    """Worker entry point: preprocess a segment surface and extract its centerline.
+    :param task: dict with segmentId, surface (serialized polydata), endPoints, decimate, targetNumberOfPoints,
+      subdivide, curveSamplingDistance, radiusArrayName, enableVoronoiSmoothing and returnVoronoiDiagram.
+    :return: dict with segmentId, and the serialized centerline, and Voronoi diagram if requested.
+      On failure, an error message instead of the polydata.
+    """
+    try:
+        surfacePolyData = polyDataFromString(task["surface"])
+        numberOfInputPoints = surfacePolyData.GetNumberOfPoints()
+        if numberOfInputPoints == 0:
+            raise ValueError("Input surface model is empty")
+        reductionFactor = (numberOfInputPoints - task["targetNumberOfPoints"]) / numberOfInputPoints
+        # The surface may have been decimated by the caller already.
+        if task.get("decimate", True) and reductionFactor > 0.0:
+            surfacePolyData = decimateSurface(surfacePolyData, reductionFactor)
+        preprocessedPolyData = prepareSurface(surfacePolyData, task["subdivide"])
+        centerlinePolyData, voronoiDiagramPolyData = computeCenterline(preprocessedPolyData, task["endPoints"],
+            task["curveSamplingDistance"], task["radiusArrayName"], task["enableVoronoiSmoothing"])
+    except Exception as e:
+        return {"segmentId": task["segmentId"], "error": str(e)}
+    # Only what the caller reads is serialized, the polydata can be large.
+    result = {"segmentId": task["segmentId"],
+              "centerline": polyDataToString(centerlinePolyData)}
+    if task.get("returnVoronoiDiagram"):
+        result["voronoiDiagram"] = polyDataToString(voronoiDiagramPolyData)
+    return result
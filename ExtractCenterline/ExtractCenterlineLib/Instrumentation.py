@@ -0,0 +1,116 @@
+"""
+Stage-level timing and memory records of the centerline pipeline.
+"""
+import functools
+import inspect
+import json
+import os
+import time
+
+import vtk
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+__all__ = ["StageInstrumentation", "instrumentedStage"]
+
+
+def _residentSetSizeKB():
+    """Current resident set size of the process, or None if it cannot be sampled.
+    The lifetime peak (ru_maxrss) is not used: in a long session, it rarely moves during a stage.
+    """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 1024.0
+    try:
+        # Linux only; the second field is the number of resident pages.
+        with open("/proc/self/statm") as statm:
+            residentPages = int(statm.read().split()[1])
+        return residentPages * os.sysconf("SC_PAGE_SIZE") / 1024.0
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class StageInstrumentation:
+    """Records wall time, CPU time, RSS change and input size of pipeline stages.
+    Nothing is recorded unless enabled.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.records = []
+
+    def clear(self):
+        self.records = []
+
+    def begin(self, stageName, polyData=None):
+        """Return a token for end(), or None if disabled."""
+        if not self.enabled:
+            return None
+        return (stageName,
+                polyData.GetNumberOfPoints() if polyData else 0,
+                polyData.GetNumberOfCells() if polyData else 0,
+                time.perf_counter(), time.process_time(), _residentSetSizeKB())
+
+    def end(self, token):
+        if token is None:
+            return
+        stageName, numberOfPoints, numberOfCells, wallStart, cpuStart, rssStart = token
+        rssEnd = _residentSetSizeKB()
+        self.records.append({
+            "stage": stageName,
+            "wallTime": time.perf_counter() - wallStart,
+            "cpuTime": time.process_time() - cpuStart,
+            # Sampled at both ends: memory retained by the stage, negative if it freed more than it kept.
+            "rssDeltaKB": (rssEnd - rssStart) if (rssStart is not None and rssEnd is not None) else None,
+            "numberOfPoints": numberOfPoints,
+            "numberOfCells": numberOfCells})
+
+    def toJson(self):
+        return json.dumps(self.records)
+
+    def toTable(self, table):
+        """Fill a vtkTable with one row per record."""
+        table.Initialize()
+        stageArray = vtk.vtkStringArray()
+        stageArray.SetName("Stage")
+        table.AddColumn(stageArray)
+        for columnName, arrayClass in [("WallTime", vtk.vtkDoubleArray), ("CpuTime", vtk.vtkDoubleArray),
+                                       ("RSSDeltaKB", vtk.vtkDoubleArray),
+                                       ("NumberOfPoints", vtk.vtkIntArray), ("NumberOfCells", vtk.vtkIntArray)]:
+            array = arrayClass()
+            array.SetName(columnName)
+            table.AddColumn(array)
+        table.SetNumberOfRows(len(self.records))
+        for row, record in enumerate(self.records):
+            table.SetValue(row, 0, vtk.vtkVariant(record["stage"]))
+            table.SetValue(row, 1, vtk.vtkVariant(record["wallTime"]))
+            table.SetValue(row, 2, vtk.vtkVariant(record["cpuTime"]))
+            rssDelta = record["rssDeltaKB"]
+            # NaN if not sampled: -1.0 would be a valid decrease.
+            table.SetValue(row, 3, vtk.vtkVariant(rssDelta if rssDelta is not None else float("nan")))
+            table.SetValue(row, 4, vtk.vtkVariant(record["numberOfPoints"]))
+            table.SetValue(row, 5, vtk.vtkVariant(record["numberOfCells"]))
+
+
+def instrumentedStage(stageName):
+    """Decorator of methods whose first argument is the input polydata.
+    The instance must have an 'instrumentation' StageInstrumentation attribute.
+    """
+    def decorator(method):
+        polyDataParameterName = list(inspect.signature(method).parameters)[1]
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            instrumentation = self.instrumentation
+            if not instrumentation.enabled:
+                return method(self, *args, **kwargs)
+            polyData = args[0] if args else kwargs.get(polyDataParameterName)
+            token = instrumentation.begin(stageName, polyData)
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                instrumentation.end(token)
+        return wrapper
+    return decorator
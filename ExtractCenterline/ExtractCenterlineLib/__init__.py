@@ -0,0 +1,2 @@
+from .CenterlineExtraction import *
+from .Instrumentation import *
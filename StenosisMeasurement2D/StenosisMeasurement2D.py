@@ -724,9 +724,11 @@ class StenosisMeasurement2DLogic(ScriptedLoadableModuleLogic):
     logging.info(_("Processing started"))
 
     # ---------------------- Generate cut polydata ---------
-    closedSurfacePolyData = vtk.vtkPolyData()
-    inputSegmentation.CreateClosedSurfaceRepresentation()
-    inputSegmentation.GetClosedSurfaceRepresentation(segmentID, closedSurfacePolyData)
+    # Shared with other modules; it is only read here.
+    from CrossSectionAnalysisLib.ClosedSurfaceCache import getClosedSurfaceCache
+    closedSurfacePolyData = getClosedSurfaceCache().getClosedSurfacePolyData(inputSegmentation, segmentID)
+    if not closedSurfacePolyData:
+      raise ValueError(_("Could not get the closed surface of the segment"))
     # Cut the segment.
     plane = vtk.vtkPlane()
     plane.SetOrigin(center)
@@ -34,8 +34,13 @@
 #include <vtkTable.h>
 #include <vtkMassProperties.h>
 #include <vtkPolyDataConnectivityFilter.h>
-#include <vtkExtractEnclosedPoints.h>
+#include <vtkSelectEnclosedPoints.h>
+#include <vtkStaticCellLocator.h>
+#include <vtkGenericCell.h>
+#include <vtkIdList.h>
 #include <vtkBooleanOperationPolyDataFilter.h>
+#include <vtkCollisionDetectionFilter.h>
+#include <vtkMatrix4x4.h>
 #include <vtkCleanPolyData.h>
 #include <vtkImageThreshold.h>
 #include <vtkImageOpenClose3D.h>
@@ -54,8 +59,11 @@
 #include <vtkSQLiteQuery.h>
 #include <vtkQuadricDecimation.h>
 #include <vtkMRMLI18N.h>
+#include <vtkStaticPointLocator.h>
+#include <vtksys/SystemTools.hxx>
 
 #include <iostream>
+#include <algorithm>
 
 static const char* COLUMN_NAME_STUDY = "Study";
 static const char* COLUMN_NAME_WALL = "WallVolume";
@@ -76,7 +84,8 @@ std::mutex mtx;
 //------------------------------------------------------------------------------
 /**
  * Each thread has one instance of this class running.
- * It computes volumes and distances from startBlockId to endBlockId.
+ * It computes the volumes of the slabs from startSlabId to endSlabId.
+ * A slab lies between spline points 'id' and 'id + 1'.
  */
 class VolumeComputeWorker
 {
@@ -89,26 +98,47 @@ public:
                     int ID, vtkPolyData * wallSurface, // Closed
                     vtkPolyData * lumenSurface, // Clipped in tube and closed
                     vtkPolyData * spline, vtkDoubleArray* bufferArray,
-                    vtkIdType startBlockId, vtkIdType endBlockId);
+                    vtkIdType startSlabId, vtkIdType endSlabId);
 
   int GetId() { return Id;}
-  double CalculateSplineDistance(vtkPolyData * spline, vtkIdType startId, vtkIdType endId);
 
 private:
   int Id = 0;
 };
 
+//----------------------------------------------------------------------------
+/**
+ * Cumulative arc lengths and point locator of the trimmed spline of a tube.
+ * It is built once per tube geometry, and is shared by the processing
+ * functions and the volume workers.
+ */
+class vtkSlicerStenosisMeasurement3DLogic::vtkInternal
+{
+public:
+  // Compared only, not referenced.
+  vtkMRMLMarkupsShapeNode * ShapeNode = nullptr;
+  vtkMTimeType ShapeNodeMTime = 0;
+  vtkMTimeType SplineMTime = 0;
+
+  vtkSmartPointer<vtkPolyData> Spline;
+  // Distance from the first spline point, at each spline point.
+  vtkSmartPointer<vtkDoubleArray> ArcLengths;
+  vtkSmartPointer<vtkStaticPointLocator> Locator;
+};
+
 //----------------------------------------------------------------------------
 vtkStandardNewMacro(vtkSlicerStenosisMeasurement3DLogic);
 
 //----------------------------------------------------------------------------
 vtkSlicerStenosisMeasurement3DLogic::vtkSlicerStenosisMeasurement3DLogic()
 {
+  this->Internal = new vtkInternal;
 }
 
 //----------------------------------------------------------------------------
 vtkSlicerStenosisMeasurement3DLogic::~vtkSlicerStenosisMeasurement3DLogic()
 {
+  delete this->Internal;
 }
 
 //----------------------------------------------------------------------------
@@ -180,8 +210,8 @@ bool vtkSlicerStenosisMeasurement3DLogic::Process(vtkMRMLMarkupsShapeNode * wall
   }
 
   // Get the spline polydata from the shape markups node.
-  vtkSmartPointer<vtkPolyData> spline = vtkSmartPointer<vtkPolyData>::New();
-  if (!wallShapeNode->GetTrimmedSplineWorld(spline))
+  vtkPolyData * spline = this->GetIndexedSpline(wallShapeNode);
+  if (!spline)
   {
     vtkErrorMacro("The tube does not have a valid spline."); // < 4 points for example.
     return false;
@@ -199,8 +229,8 @@ bool vtkSlicerStenosisMeasurement3DLogic::Process(vtkMRMLMarkupsShapeNode * wall
 
   vtkPoints * splinePoints = spline->GetPoints();
   // Get boundaries where polydatas will be cut.
-  const vtkIdType p1IdType = spline->FindPoint(p1);
-  const vtkIdType p2IdType = spline->FindPoint(p2);
+  const vtkIdType p1IdType = this->FindClosestSplinePointId(wallShapeNode, p1);
+  const vtkIdType p2IdType = this->FindClosestSplinePointId(wallShapeNode, p2);
 
   // Get adjacent points to boundaries to calculate normals.
   /*
@@ -323,15 +353,15 @@ bool vtkSlicerStenosisMeasurement3DLogic::UpdateBoundaryControlPointPosition
     return false;
   }
   // Get the spline polydata from the shape markups node.
-  vtkSmartPointer<vtkPolyData> spline = vtkSmartPointer<vtkPolyData>::New();
-  if (!shapeNode->GetTrimmedSplineWorld(spline))
+  vtkPolyData * spline = this->GetIndexedSpline(shapeNode);
+  if (!spline)
   {
     vtkErrorMacro("The tube does not have a valid spline.");
     return false;
   }
   double controlPointCoordinate[3] = { 0.0 };
   fiducialNode->GetNthControlPointPositionWorld(pointIndex, controlPointCoordinate);
-  vtkIdType targetPointId = spline->FindPoint(controlPointCoordinate);
+  vtkIdType targetPointId = this->FindClosestSplinePointId(shapeNode, controlPointCoordinate);
   double * targetPointCoordinate = spline->GetPoint(targetPointId);
   if (controlPointCoordinate[0] != targetPointCoordinate[0]
     || controlPointCoordinate[1] != targetPointCoordinate[1]
@@ -342,6 +372,86 @@ bool vtkSlicerStenosisMeasurement3DLogic::UpdateBoundaryControlPointPosition
   return true;
 }
 
+//-----------------------------------------------------------------------------
+vtkPolyData * vtkSlicerStenosisMeasurement3DLogic::GetIndexedSpline(vtkMRMLMarkupsShapeNode * shapeNode)
+{
+  if (!shapeNode || !shapeNode->GetSplineWorld())
+  {
+    return nullptr;
+  }
+  vtkInternal * index = this->Internal;
+  // Trimming is tracked by the node's modified time.
+  if (index->Spline && index->ShapeNode == shapeNode
+    && index->ShapeNodeMTime == shapeNode->GetMTime()
+    && index->SplineMTime == shapeNode->GetSplineWorld()->GetMTime())
+  {
+    return index->Spline;
+  }
+
+  vtkSmartPointer<vtkPolyData> spline = vtkSmartPointer<vtkPolyData>::New();
+  if (!shapeNode->GetTrimmedSplineWorld(spline) || spline->GetNumberOfPoints() == 0)
+  {
+    index->Spline = nullptr;
+    return nullptr;
+  }
+  const vtkIdType numberOfPoints = spline->GetNumberOfPoints();
+  vtkSmartPointer<vtkDoubleArray> arcLengths = vtkSmartPointer<vtkDoubleArray>::New();
+  arcLengths->SetNumberOfValues(numberOfPoints);
+  arcLengths->SetValue(0, 0.0);
+  double previousPoint[3] = { 0.0 };
+  double point[3] = { 0.0 };
+  spline->GetPoint(0, previousPoint);
+  for (vtkIdType i = 1; i < numberOfPoints; i++)
+  {
+    spline->GetPoint(i, point);
+    arcLengths->SetValue(i, arcLengths->GetValue(i - 1)
+                          + std::sqrt(vtkMath::Distance2BetweenPoints(previousPoint, point)));
+    previousPoint[0] = point[0];
+    previousPoint[1] = point[1];
+    previousPoint[2] = point[2];
+  }
+  vtkSmartPointer<vtkStaticPointLocator> locator = vtkSmartPointer<vtkStaticPointLocator>::New();
+  locator->SetDataSet(spline);
+  locator->BuildLocator();
+
+  index->ShapeNode = shapeNode;
+  index->ShapeNodeMTime = shapeNode->GetMTime();
+  index->SplineMTime = shapeNode->GetSplineWorld()->GetMTime();
+  index->Spline = spline;
+  index->ArcLengths = arcLengths;
+  index->Locator = locator;
+  return index->Spline;
+}
+
+//-----------------------------------------------------------------------------
+vtkIdType vtkSlicerStenosisMeasurement3DLogic::FindClosestSplinePointId(vtkMRMLMarkupsShapeNode * shapeNode,
+                                                                       double point[3])
+{
+  if (!point || !this->GetIndexedSpline(shapeNode))
+  {
+    return -1;
+  }
+  return this->Internal->Locator->FindClosestPoint(point);
+}
+
+//-----------------------------------------------------------------------------
+double vtkSlicerStenosisMeasurement3DLogic::GetSplineDistance(vtkMRMLMarkupsShapeNode * shapeNode,
+                                                            vtkIdType startId, vtkIdType endId)
+{
+  if (!this->GetIndexedSpline(shapeNode))
+  {
+    vtkErrorMacro("The tube does not have a valid spline.");
+    return -1.0;
+  }
+  vtkDoubleArray * arcLengths = this->Internal->ArcLengths;
+  if (startId < 0 || endId < 0 || startId > endId || endId >= arcLengths->GetNumberOfValues())
+  {
+    vtkErrorMacro("Invalid input, cannot calculate spline distance.");
+    return -1.0;
+  }
+  return arcLengths->GetValue(endId) - arcLengths->GetValue(startId);
+}
+
 //-----------------------------------------------------------------------------
 bool vtkSlicerStenosisMeasurement3DLogic::ClipClosedSurfaceWithClosedOutput(vtkPolyData * input, vtkPolyData * output,
             double * startOrigin, double * startNormal, double * endOrigin, double * endNormal)
@@ -408,23 +518,18 @@ bool vtkSlicerStenosisMeasurement3DLogic::CalculateClippedSplineLength(vtkMRMLMa
     return false;
   }
   // Get the spline polydata from the shape markups node.
-  vtkSmartPointer<vtkPolyData> spline = vtkSmartPointer<vtkPolyData>::New();
-  if (!shapeNode->GetTrimmedSplineWorld(spline))
+  if (!this->GetIndexedSpline(shapeNode))
   {
     vtkErrorMacro("The tube does not have a valid spline.");
     return false;
   }
   double p1Fiducial[3] = { 0.0 };
   fiducialNode->GetNthControlPointPositionWorld(0, p1Fiducial);
-  vtkIdType p1SplineId = spline->FindPoint(p1Fiducial);
-  double p1Spline[3] = { 0.0 };
-  spline->GetPoint(p1SplineId, p1Spline);
+  vtkIdType p1SplineId = this->FindClosestSplinePointId(shapeNode, p1Fiducial);
 
   double p2Fiducial[3] = { 0.0 };
   fiducialNode->GetNthControlPointPositionWorld(1, p2Fiducial);
-  vtkIdType p2SplineId = spline->FindPoint(p2Fiducial);
-  double p2Spline[3] = { 0.0 };
-  spline->GetPoint(p2SplineId, p2Spline);
+  vtkIdType p2SplineId = this->FindClosestSplinePointId(shapeNode, p2Fiducial);
 
   if (p1SplineId == p2SplineId)
   {
@@ -435,15 +540,7 @@ bool vtkSlicerStenosisMeasurement3DLogic::CalculateClippedSplineLength(vtkMRMLMa
   vtkIdType startSplineId = vtkMath::Min(p1SplineId, p2SplineId);
   vtkIdType endSplineId = vtkMath::Max(p1SplineId, p2SplineId);
 
-  double length = 0.0;
-  for (vtkIdType splineId = startSplineId; splineId < endSplineId; splineId++)
-  {
-    double p1[3] = { 0.0 };
-    double p2[3] = { 0.0 };
-    spline->GetPoint(splineId, p1);
-    spline->GetPoint(splineId + 1, p2);
-    length += std::sqrt(vtkMath::Distance2BetweenPoints(p1, p2));
-  }
+  const double length = this->GetSplineDistance(shapeNode, startSplineId, endSplineId);
   result->InsertNextValue(startSplineId);
   result->InsertNextValue(endSplineId);
   result->InsertNextValue(length);
@@ -600,15 +697,10 @@ vtkSlicerStenosisMeasurement3DLogic::GetClosedSurfaceEnclosingType(vtkPolyData*
     return EnclosingType::EnclosingType_Last;
   }
 
-  int firstInSecondPointCount = 0;
-  int secondInFirstPointCount = 0;
-  int intersectionPointCount = 0;
-  int firstPointCount = -1;
-  int secondPointCount = -1;
   vtkNew<vtkPolyData> _first;
   vtkNew<vtkPolyData> _second;
 
-  auto process = [] (vtkPolyData * input, vtkPolyData * _input, bool& inputIsPreProcessed, int& pointCount)
+  auto process = [] (vtkPolyData * input, vtkPolyData * _input, bool& inputIsPreProcessed)
   {
     if (!inputIsPreProcessed) // Not decimated.
     {
@@ -626,79 +718,197 @@ vtkSlicerStenosisMeasurement3DLogic::GetClosedSurfaceEnclosingType(vtkPolyData*
       cleanerFirst->SetInputConnection(triangulatorFirst->GetOutputPort());
       cleanerFirst->Update();
       _input->DeepCopy(cleanerFirst->GetOutput());
-      pointCount = _input->GetNumberOfPoints();
     }
     else // Already decimated.
     {
-      pointCount = input->GetNumberOfPoints();
       _input->DeepCopy(input);
     }
   };
 
-  process(first, _first, firstIsPreProcessed, firstPointCount);
-  process(second, _second, secondIsPreProcessed, secondPointCount);
+  process(first, _first, firstIsPreProcessed);
+  process(second, _second, secondIsPreProcessed);
 
+  const EnclosingType enclosingType = this->ClassifyClosedSurfaceEnclosure(_first, _second);
+  if (!enclosed)
   {
-    vtkNew<vtkExtractEnclosedPoints> pointExtractor;
-    pointExtractor->SetInputData(_first);
-    pointExtractor->SetSurfaceData(_second);
-    pointExtractor->Update();
-    firstInSecondPointCount = pointExtractor->GetOutput()->GetNumberOfPoints();
+    return enclosingType;
   }
 
+  switch (enclosingType)
   {
-    vtkNew<vtkExtractEnclosedPoints> pointExtractor;
-    pointExtractor->SetInputData(_second);
-    pointExtractor->SetSurfaceData(_first);
-    pointExtractor->Update();
-    secondInFirstPointCount = pointExtractor->GetOutput()->GetNumberOfPoints();
-  }
-
-  /*
-   * NOTE: Below may fail. In one scene, it fails with a tube resolution at 45,
-   * and succeeds at 44, 46 and even 15. In another scene, 45 is OK. The input
-   * segment is a regular one.
-   * Both outputs of the boolFilter have zero point on failure. It's not
-   * possible to detect a processing failure.
-   */
-  vtkNew<vtkBooleanOperationPolyDataFilter> boolFilter;
-  boolFilter->SetOperationToIntersection();
-  boolFilter->SetInputData(_first);
-  boolFilter->AddInputData(1, _second);
-  boolFilter->Update();
-  // 0 means completely distinct or one is completely enclosed in the other.
-  intersectionPointCount = boolFilter->GetOutput()->GetNumberOfPoints();
-
-  if (intersectionPointCount != 0)
-  {
-    if (enclosed)
+    case EnclosingType::Intersection:
     {
+      /*
+       * The classification does not depend on the boolean filter anymore. It
+       * is still needed to build the intersection surface itself.
+       * NOTE: Below may fail. In one scene, it fails with a tube resolution at 45,
+       * and succeeds at 44, 46 and even 15. In another scene, 45 is OK. The input
+       * segment is a regular one.
+       * Both outputs of the boolFilter have zero point on failure.
+       */
+      vtkNew<vtkBooleanOperationPolyDataFilter> boolFilter;
+      boolFilter->SetOperationToIntersection();
+      boolFilter->SetInputData(_first);
+      boolFilter->AddInputData(1, _second);
+      boolFilter->Update();
+      if (boolFilter->GetOutput()->GetNumberOfPoints() == 0)
+      {
+        // Not Distinct: the surfaces do overlap.
+        vtkErrorMacro("The intersection of the surfaces could not be created.");
+        return EnclosingType::EnclosingType_Last;
+      }
       // There may be triangles and/or strips beyond each end.
       // Further processing must be done by the caller.
       enclosed->Initialize();
       enclosed->DeepCopy(boolFilter->GetOutput());
+      break;
     }
-    return EnclosingType::Intersection;
-  }
-  if (firstInSecondPointCount == firstPointCount)
-  {
-    if (enclosed)
-    {
+    case EnclosingType::FirstIsEnclosed:
       enclosed->Initialize();
       enclosed->DeepCopy(first);
+      break;
+    case EnclosingType::SecondIsEnclosed:
+      enclosed->Initialize();
+      enclosed->DeepCopy(second);
+      break;
+    default:
+      break;
+  }
+
+  return enclosingType;
+}
+
+//-----------------------------------------------------------------------------
+namespace
+{
+enum PointsEnclosure {AllOutside = 0, AllInside, Mixed};
+
+/*
+ * Ray-parity test of the points of 'input' against the closed 'surface'.
+ * The points are visited with a stride so that the first samples are spread
+ * over the whole input: a mixed result is then usually known very early.
+ */
+PointsEnclosure ClassifyPointsInSurface(vtkPolyData * input, vtkPolyData * surface)
+{
+  vtkNew<vtkStaticCellLocator> locator;
+  locator->SetDataSet(surface);
+  locator->BuildLocator();
+
+  double bounds[6] = { 0.0 };
+  surface->GetBounds(bounds);
+  const double length = surface->GetLength();
+  const double tolerance = 0.001 * length; // vtkSelectEnclosedPoints default.
+
+  vtkNew<vtkIdList> cellIds;
+  vtkNew<vtkGenericCell> genericCell;
+  vtkIntersectionCounter counter(tolerance, length);
+
+  const vtkIdType numberOfPoints = input->GetNumberOfPoints();
+  const vtkIdType stride = std::max<vtkIdType>(1, numberOfPoints / 64);
+  bool hasInside = false;
+  bool hasOutside = false;
+  double point[3] = { 0.0 };
+  for (vtkIdType offset = 0; offset < stride; offset++)
+  {
+    for (vtkIdType i = offset; i < numberOfPoints; i += stride)
+    {
+      input->GetPoint(i, point);
+      const int inside = vtkSelectEnclosedPoints::IsInsideSurface(point, surface, bounds, length, tolerance,
+                                                                  locator, cellIds, genericCell, counter);
+      if (inside)
+      {
+        hasInside = true;
+      }
+      else
+      {
+        hasOutside = true;
+      }
+      if (hasInside && hasOutside)
+      {
+        return PointsEnclosure::Mixed;
+      }
     }
-    return EnclosingType::FirstIsEnclosed;
   }
-  if (secondInFirstPointCount == secondPointCount)
+  return hasInside ? PointsEnclosure::AllInside : PointsEnclosure::AllOutside;
+}
+
+/*
+ * Whether any cell of 'first' crosses a cell of 'second'.
+ * The vertices of a surface may all be on one side of the other surface
+ * while their faces still cross, e.g. a coarse tube and a lumen at a bend.
+ * OBB trees of both surfaces are tested; it stops at the first contact.
+ */
+bool SurfacesCross(vtkPolyData * first, vtkPolyData * second)
+{
+  double firstBounds[6] = { 0.0 };
+  double secondBounds[6] = { 0.0 };
+  first->GetBounds(firstBounds);
+  second->GetBounds(secondBounds);
+  for (int i = 0; i < 3; i++)
   {
-    if (enclosed)
+    if (firstBounds[2 * i + 1] < secondBounds[2 * i] || secondBounds[2 * i + 1] < firstBounds[2 * i])
     {
-      enclosed->Initialize();
-      enclosed->DeepCopy(second);
+      return false;
     }
-    return EnclosingType::SecondIsEnclosed;
   }
+  // Both surfaces are in the same space.
+  vtkNew<vtkMatrix4x4> identity;
+  vtkNew<vtkCollisionDetectionFilter> collisionFilter;
+  collisionFilter->SetInputData(0, first);
+  collisionFilter->SetInputData(1, second);
+  collisionFilter->SetMatrix(0, identity);
+  collisionFilter->SetMatrix(1, identity);
+  collisionFilter->SetCollisionModeToFirstContact();
+  collisionFilter->GenerateScalarsOff();
+  collisionFilter->Update();
+  return collisionFilter->GetNumberOfContacts() > 0;
+}
+}
 
+//-----------------------------------------------------------------------------
+// Both input surfaces *must* be closed.
+vtkSlicerStenosisMeasurement3DLogic::EnclosingType
+vtkSlicerStenosisMeasurement3DLogic::ClassifyClosedSurfaceEnclosure(vtkPolyData* first, vtkPolyData* second)
+{
+  if (!first || !second)
+  {
+    vtkErrorMacro("Parameter 'first' or 'second' is NULL.");
+    return EnclosingType::EnclosingType_Last;
+  }
+  if (first->GetNumberOfPoints() == 0 || second->GetNumberOfPoints() == 0)
+  {
+    vtkErrorMacro("Parameter 'first' or 'second' has zero point.");
+    return EnclosingType::EnclosingType_Last;
+  }
+
+  const PointsEnclosure firstInSecond = ClassifyPointsInSurface(first, second);
+  if (firstInSecond == PointsEnclosure::Mixed)
+  {
+    return EnclosingType::Intersection;
+  }
+  // If first is inside second, second can only cross first, not be inside it.
+  const PointsEnclosure secondInFirst = (firstInSecond == PointsEnclosure::AllInside)
+    ? PointsEnclosure::AllOutside : ClassifyPointsInSurface(second, first);
+  if (secondInFirst == PointsEnclosure::Mixed)
+  {
+    return EnclosingType::Intersection;
+  }
+  /*
+   * The vertices do not tell everything: the faces may still cross,
+   * e.g. a coarse or concave tube, or a lumen bump between tube rings.
+   */
+  if (SurfacesCross(first, second))
+  {
+    return EnclosingType::Intersection;
+  }
+  if (firstInSecond == PointsEnclosure::AllInside)
+  {
+    return EnclosingType::FirstIsEnclosed;
+  }
+  if (secondInFirst == PointsEnclosure::AllInside)
+  {
+    return EnclosingType::SecondIsEnclosed;
+  }
   return EnclosingType::Distinct;
 }
 
@@ -757,8 +967,8 @@ bool vtkSlicerStenosisMeasurement3DLogic::CreateLesion(vtkMRMLMarkupsShapeNode *
   }
 
   // Get the spline polydata from the shape markups node.
-  vtkSmartPointer<vtkPolyData> spline = vtkSmartPointer<vtkPolyData>::New();
-  if (!wallShapeNode->GetTrimmedSplineWorld(spline))
+  vtkPolyData * spline = this->GetIndexedSpline(wallShapeNode);
+  if (!spline)
   {
     vtkErrorMacro("The tube does not have a valid spline.");
     return false;
@@ -780,8 +990,8 @@ bool vtkSlicerStenosisMeasurement3DLogic::CreateLesion(vtkMRMLMarkupsShapeNode *
 
   vtkPoints * splinePoints = spline->GetPoints();
   // Get boundaries where polydatas will be cut.
-  const vtkIdType p1IdType = spline->FindPoint(p1);
-  const vtkIdType p2IdType = spline->FindPoint(p2);
+  const vtkIdType p1IdType = this->FindClosestSplinePointId(wallShapeNode, p1);
+  const vtkIdType p2IdType = this->FindClosestSplinePointId(wallShapeNode, p2);
 
   // Get adjacent points to boundaries to calculate normals.
   /*
@@ -870,22 +1080,20 @@ bool vtkSlicerStenosisMeasurement3DLogic::CreateLesion(vtkMRMLMarkupsShapeNode *
   return true;
 }
 //------------------------------------------------------------------------------
-bool vtkSlicerStenosisMeasurement3DLogic::DumpAggregateVolumes(vtkMRMLMarkupsShapeNode* wallShapeNode,
-                                                              vtkPolyData* enclosedSurface,
-                                                              std::string filepath)
+bool vtkSlicerStenosisMeasurement3DLogic::ComputeCumulativeVolumes(vtkMRMLMarkupsShapeNode* wallShapeNode,
+                                                                  vtkPolyData* enclosedSurface,
+                                                                  vtkTable * cumulativeVolumes)
 {
-  /* 
-   * There may be marginal differences with the result from ::Process(), mainly
-   * with the lumen volume. These are inversely proportional to the spline
-   * resolution. The surface resolution influences less.
-   * 
-   * Chop the surfaces in blocks, one thread for each block.
-   * Calculate volumes from the first spline id of a block to the next until the last id.
-   * Append the array from each thread in the 'result' table.
-   * Cross join the table in SQLite and create a new aggregate table.
-   * Each row is crossed with the entire table.
+  /*
+   * Chop the surfaces in slabs between consecutive spline points; each slab is
+   * clipped once only. Each thread processes a block of slabs.
+   * The boundary plane at a spline point is the same for the slabs on
+   * either side, hence the slabs tile the surfaces and their volumes can be
+   * summed. The cumulative volume at a spline point is the same as that of a
+   * single clip from the first spline point, within the precision of
+   * vtkMassProperties.
    */
-  if (wallShapeNode == nullptr || enclosedSurface == nullptr || filepath.empty()
+  if (wallShapeNode == nullptr || enclosedSurface == nullptr || cumulativeVolumes == nullptr
     || wallShapeNode->GetShapeName() != vtkMRMLMarkupsShapeNode::Tube
     || wallShapeNode->GetNumberOfControlPoints() < 4
   )
@@ -894,52 +1102,52 @@ bool vtkSlicerStenosisMeasurement3DLogic::DumpAggregateVolumes(vtkMRMLMarkupsSha
     return false;
   }
 
-  vtkNew<vtkPolyData> trimmedSpline;
-  if (!wallShapeNode->GetTrimmedSplineWorld(trimmedSpline))
+  // The workers only read the points of the spline.
+  vtkPolyData * trimmedSpline = this->GetIndexedSpline(wallShapeNode);
+  if (!trimmedSpline)
   {
     vtkErrorMacro("The tube does not have a valid spline.");
     return false;
   }
 
-  vtkNew<vtkMRMLTableNode> result;
-
-  // Exclude the last point to remain within bounds. 851 spline points -> 850 measurements.
-  const int numberOfPoints = trimmedSpline->GetNumberOfPoints() - 1;
+  // 851 spline points -> 850 slabs.
+  const int numberOfSlabs = trimmedSpline->GetNumberOfPoints() - 1;
+  if (numberOfSlabs < 1)
+  {
+    vtkErrorMacro("The spline does not have enough points.");
+    return false;
+  }
   int numberOfThreads = std::thread::hardware_concurrency(); // Does not mean number of cores/cpus.
-  if (numberOfThreads < 1 || numberOfPoints < numberOfThreads)
+  if (numberOfThreads < 1 || numberOfSlabs < numberOfThreads)
   {
     numberOfThreads = 1;
   }
-  const int residual = numberOfPoints % numberOfThreads;
-  const int numberOfPointsPerBlock = numberOfPoints / numberOfThreads;
+  const int residual = numberOfSlabs % numberOfThreads;
+  const int numberOfSlabsPerBlock = numberOfSlabs / numberOfThreads;
   std::vector<std::thread> threads;
   std::vector<vtkSmartPointer<vtkDoubleArray>> bufferArrays;
 
   for (int i = 0; i < numberOfThreads; i++)
   {
-    const vtkIdType startBlockId = i * numberOfPointsPerBlock;
-    vtkIdType endBlockId = ((i + 1) * numberOfPointsPerBlock) - 1;
+    const vtkIdType startSlabId = i * numberOfSlabsPerBlock;
+    vtkIdType endSlabId = ((i + 1) * numberOfSlabsPerBlock) - 1;
     if (i == (numberOfThreads - 1))
     {
-      endBlockId += residual;
+      endSlabId += residual;
     }
     vtkSmartPointer<vtkDoubleArray> bufferArray = vtkSmartPointer<vtkDoubleArray> ::New();
-    bufferArray->SetNumberOfComponents(5);
+    bufferArray->SetNumberOfComponents(4);
     bufferArrays.push_back(bufferArray);
 
     vtkSmartPointer<vtkPolyData> wallSurfaceCopy = vtkSmartPointer<vtkPolyData>::New();
     vtkSmartPointer<vtkPolyData> lumenSurfaceCopy = vtkSmartPointer<vtkPolyData>::New();
-    vtkSmartPointer<vtkPolyData> trimmedSplineCopy = vtkSmartPointer<vtkPolyData>::New();
     wallSurfaceCopy->DeepCopy(wallShapeNode->GetCappedTubeWorld());
     lumenSurfaceCopy->DeepCopy(enclosedSurface);
-    vtkNew<vtkPolyData> threadTrimmedSpline;
-    wallShapeNode->GetTrimmedSplineWorld(threadTrimmedSpline);
-    trimmedSplineCopy->DeepCopy(threadTrimmedSpline);
     threads.push_back(std::thread(
                         VolumeComputeWorker(),
                         this, i,
-                        wallSurfaceCopy, lumenSurfaceCopy, trimmedSplineCopy,
-                        bufferArray, startBlockId, endBlockId
+                        wallSurfaceCopy, lumenSurfaceCopy, trimmedSpline,
+                        bufferArray, startSlabId, endSlabId
                           ) // std::thread
                       );    // threads
 
@@ -949,40 +1157,152 @@ bool vtkSlicerStenosisMeasurement3DLogic::DumpAggregateVolumes(vtkMRMLMarkupsSha
     threads[i].join();
   }
 
-  vtkTable * table = result->GetTable();
+  // Slab values, indexed by slab id.
+  std::vector<double> slabWallVolumes(numberOfSlabs, 0.0);
+  std::vector<double> slabLumenVolumes(numberOfSlabs, 0.0);
+  std::vector<bool> slabFailures(numberOfSlabs, false);
+  for (int i = 0; i < numberOfThreads; i++)
+  {
+    vtkDoubleArray * bufferArray = bufferArrays[i];
+    for (vtkIdType t = 0; t < bufferArray->GetNumberOfTuples(); t++)
+    {
+      double tuple[4] = { 0.0 };
+      bufferArray->GetTuple(t, tuple);
+      const vtkIdType slabId = (vtkIdType) tuple[0];
+      slabWallVolumes[slabId] = tuple[1];
+      slabLumenVolumes[slabId] = tuple[2];
+      slabFailures[slabId] = (tuple[3] != 0.0);
+    }
+  }
+
+  // Prefix sums. Row 0 is the first spline point, with zero values.
+  // The distances are the cumulative arc lengths of the spline index.
+  vtkDoubleArray * arcLengths = this->Internal->ArcLengths;
   vtkNew<vtkDoubleArray> splineIdColumn;
   vtkNew<vtkDoubleArray> distanceColumn;
   vtkNew<vtkDoubleArray> wallVolumeColumn;
   vtkNew<vtkDoubleArray> lumenVolumeColumn;
+  vtkNew<vtkIntArray> failedSlabsColumn;
   splineIdColumn->SetName("SplineId");
   distanceColumn->SetName("Distance");
   wallVolumeColumn->SetName("WallVolume");
   lumenVolumeColumn->SetName("LumenVolume");
-  table->AddColumn(splineIdColumn);
-  table->AddColumn(distanceColumn);
-  table->AddColumn(wallVolumeColumn);
-  table->AddColumn(lumenVolumeColumn);
-  table->InsertNextBlankRow();
-
-  double totalCumulated[3] = {0.0};
-  for (int i = 0; i < numberOfThreads; i++)
-  {
-    vtkDoubleArray * bufferArray = bufferArrays[i];
-    for (int t = 0; t < bufferArray->GetNumberOfTuples(); t++)
+  failedSlabsColumn->SetName("FailedSlabs");
+  splineIdColumn->SetNumberOfValues(numberOfSlabs + 1);
+  distanceColumn->SetNumberOfValues(numberOfSlabs + 1);
+  wallVolumeColumn->SetNumberOfValues(numberOfSlabs + 1);
+  lumenVolumeColumn->SetNumberOfValues(numberOfSlabs + 1);
+  failedSlabsColumn->SetNumberOfValues(numberOfSlabs + 1);
+  splineIdColumn->SetValue(0, 0.0);
+  distanceColumn->SetValue(0, arcLengths->GetValue(0));
+  wallVolumeColumn->SetValue(0, 0.0);
+  lumenVolumeColumn->SetValue(0, 0.0);
+  failedSlabsColumn->SetValue(0, 0);
+  std::string failedSlabIds;
+  for (vtkIdType id = 1; id <= numberOfSlabs; id++)
+  {
+    splineIdColumn->SetValue(id, (double) id);
+    distanceColumn->SetValue(id, arcLengths->GetValue(id));
+    wallVolumeColumn->SetValue(id, wallVolumeColumn->GetValue(id - 1) + slabWallVolumes[id - 1]);
+    lumenVolumeColumn->SetValue(id, lumenVolumeColumn->GetValue(id - 1) + slabLumenVolumes[id - 1]);
+    failedSlabsColumn->SetValue(id, failedSlabsColumn->GetValue(id - 1) + (slabFailures[id - 1] ? 1 : 0));
+    if (slabFailures[id - 1])
     {
-      double * currentTuple = bufferArray->GetTuple(t);
-      vtkNew<vtkVariantArray> cumulated;
-      cumulated->InsertNextValue(currentTuple[1]); // endBlockId, startBlockId is always 0
-      cumulated->InsertNextValue(currentTuple[2] + totalCumulated[0]); // distance
-      cumulated->InsertNextValue(currentTuple[3] + totalCumulated[1]); // wallVolume
-      cumulated->InsertNextValue(currentTuple[4] + totalCumulated[2]); // lumenVolume
-      table->InsertNextRow(cumulated);
+      failedSlabIds += (failedSlabIds.empty() ? "" : ", ") + std::to_string(id - 1);
     }
+  }
+
+  cumulativeVolumes->Initialize();
+  cumulativeVolumes->AddColumn(splineIdColumn);
+  cumulativeVolumes->AddColumn(distanceColumn);
+  cumulativeVolumes->AddColumn(wallVolumeColumn);
+  cumulativeVolumes->AddColumn(lumenVolumeColumn);
+  cumulativeVolumes->AddColumn(failedSlabsColumn);
+
+  if (!failedSlabIds.empty())
+  {
+    // The table is complete, but the volumes across these slabs are too low.
+    vtkErrorMacro("Slabs could not be clipped, their volumes are missing: " << failedSlabIds << ".");
+    return false;
+  }
+  return true;
+}
+
+//------------------------------------------------------------------------------
+bool vtkSlicerStenosisMeasurement3DLogic::GetBoundVolumes(vtkTable * cumulativeVolumes,
+                                                         vtkIdType startId, vtkIdType endId,
+                                                         vtkVariantArray * result)
+{
+  if (!cumulativeVolumes || !result)
+  {
+    vtkErrorMacro("Invalid input, cannot continue.");
+    return false;
+  }
+  vtkDataArray * distanceColumn = vtkArrayDownCast<vtkDataArray>(cumulativeVolumes->GetColumnByName("Distance"));
+  vtkDataArray * wallVolumeColumn = vtkArrayDownCast<vtkDataArray>(cumulativeVolumes->GetColumnByName("WallVolume"));
+  vtkDataArray * lumenVolumeColumn = vtkArrayDownCast<vtkDataArray>(cumulativeVolumes->GetColumnByName("LumenVolume"));
+  if (!distanceColumn || !wallVolumeColumn || !lumenVolumeColumn)
+  {
+    vtkErrorMacro("The table does not hold cumulative volumes.");
+    return false;
+  }
+  // Row index is spline id.
+  if (startId < 0 || endId <= startId || endId >= cumulativeVolumes->GetNumberOfRows())
+  {
+    vtkErrorMacro("Invalid spline ids: " << startId << ", " << endId << ".");
+    return false;
+  }
+  vtkDataArray * failedSlabsColumn = vtkArrayDownCast<vtkDataArray>(cumulativeVolumes->GetColumnByName("FailedSlabs"));
+  if (failedSlabsColumn && failedSlabsColumn->GetTuple1(endId) != failedSlabsColumn->GetTuple1(startId))
+  {
+    vtkErrorMacro("The range from spline id " << startId << " to " << endId
+                  << " includes slabs that could not be clipped, the volumes would be too low.");
+    return false;
+  }
+  const double distance = distanceColumn->GetTuple1(endId) - distanceColumn->GetTuple1(startId);
+  const double wallVolume = wallVolumeColumn->GetTuple1(endId) - wallVolumeColumn->GetTuple1(startId);
+  const double lumenVolume = lumenVolumeColumn->GetTuple1(endId) - lumenVolumeColumn->GetTuple1(startId);
+  const double lesionVolume = wallVolume - lumenVolume;
+  const double degree = wallVolume ? (lesionVolume / wallVolume) : -1.0;
+
+  result->Initialize();
+  result->InsertNextValue(startId);
+  result->InsertNextValue(endId);
+  result->InsertNextValue(distance);
+  result->InsertNextValue(wallVolume);
+  result->InsertNextValue(lumenVolume);
+  result->InsertNextValue(lesionVolume);
+  result->InsertNextValue(wallVolume ? degree * 100 : -1.0); // Stenosis
+  result->InsertNextValue(distance ? (lesionVolume / distance) * 10.0 : -1.0); // Lesion volume per cm
+  result->InsertNextValue((wallVolume && distance) ? (degree / distance) * 10.0 : -1.0); // Stenosis per cm
 
-    vtkVariantArray * lastCumulatedTuple = table->GetRow(table->GetNumberOfRows() - 1);
-    totalCumulated[0] = lastCumulatedTuple->GetValue(1).ToDouble(); // distance
-    totalCumulated[1] = lastCumulatedTuple->GetValue(2).ToDouble(); // wallVolume
-    totalCumulated[2] = lastCumulatedTuple->GetValue(3).ToDouble(); // lumenVolume
+  return true;
+}
+
+//------------------------------------------------------------------------------
+bool vtkSlicerStenosisMeasurement3DLogic::DumpAggregateVolumes(vtkMRMLMarkupsShapeNode* wallShapeNode,
+                                                              vtkPolyData* enclosedSurface,
+                                                              std::string filepath, bool compact)
+{
+  /* 
+   * There may be marginal differences with the result from ::Process(), mainly
+   * with the lumen volume. These are inversely proportional to the spline
+   * resolution. The surface resolution influences less.
+   * 
+   * Get the cumulative volumes at each spline point, in the 'result' table.
+   * Cross join the table in SQLite and create a new aggregate table.
+   * Each row is crossed with the entire table.
+   * In compact mode, the aggregate table is replaced by a view.
+   */
+  if (filepath.empty())
+  {
+    vtkErrorMacro("Invalid input, cannot continue.");
+    return false;
+  }
+  vtkNew<vtkTable> result;
+  if (!this->ComputeCumulativeVolumes(wallShapeNode, enclosedSurface, result))
+  {
+    return false; // Logging done.
   }
 
   vtkNew<vtkSQLiteDatabase> db;
@@ -996,9 +1316,51 @@ bool vtkSlicerStenosisMeasurement3DLogic::DumpAggregateVolumes(vtkMRMLMarkupsSha
   // Cumulative volumes from spline id 0 to the last one.
   dbWriter->SetTableName("CumulativeVolumes");
   dbWriter->SetDatabase(db);
-  dbWriter->SetInputData(result->GetTable());
+  dbWriter->SetInputData(result);
   dbWriter->Update();
 
+  if (compact)
+  {
+    // Same columns as the BoundVolumes table, evaluated on query using the SplineId index.
+    std::string sql = "CREATE VIEW BoundVolumes AS"
+    " SELECT *,"
+    " CAST((LesionVolume / WallVolume)  * 100 AS REAL) Stenosis,"
+    " CAST((LesionVolume / Distance) * 10 AS REAL) LesionVolumePerCm,"
+    " CAST(((LesionVolume / WallVolume) / Distance) * 10 AS REAL) StenosisPerCm"
+    " FROM (SELECT V1.SplineId StartId, V2.SplineId EndId,"
+    " CAST((V2.Distance - V1.Distance) AS REAL) Distance,"
+    " CAST((V2.WallVolume - V1.WallVolume) AS REAL ) WallVolume,"
+    " CAST((V2.LumenVolume - V1.LumenVolume) AS REAL ) LumenVolume,"
+    " CAST(((V2.WallVolume - V1.WallVolume) - (V2.LumenVolume - V1.LumenVolume)) AS REAL) LesionVolume"
+    " FROM CumulativeVolumes V1 JOIN CumulativeVolumes V2"
+    " ON V1.SplineId < V2.SplineId)";
+    vtkSQLiteQuery * query = static_cast<vtkSQLiteQuery*> (db->GetQueryInstance());
+    query->SetQuery(sql.c_str());
+    bool success = query->Execute();
+    if (!success)
+    {
+      vtkErrorMacro("Error creating 'BoundVolumes' view, aborting.");
+    }
+    else
+    {
+      sql = "CREATE UNIQUE INDEX CumulativeVolumes_SplineId ON CumulativeVolumes(SplineId)";
+      query->SetQuery(sql.c_str());
+      success = query->Execute();
+      if (!success)
+      {
+        vtkErrorMacro("Error creating index on CumulativeVolumes table, aborting.");
+      }
+    }
+    query->Delete();
+    db->Close();
+    // Do not leave a half-written database: a new attempt would fail because the file exists.
+    if (!success && !vtksys::SystemTools::RemoveFile(filepath))
+    {
+      vtkErrorMacro("Could not remove the incomplete database file: " << filepath);
+    }
+    return success;
+  }
+
   // Using an intermediate for easier read/write of SQL expressions.
   // Volumes between spline points, from id1 to id2.
   std::string sql = "CREATE TABLE Intermediate AS" 
@@ -1237,77 +1599,76 @@ void VolumeComputeWorker::operator()(vtkSlicerStenosisMeasurement3DLogic * logic
                                      vtkPolyData* lumenSurface,
                                      vtkPolyData* spline,
                                      vtkDoubleArray* bufferArray,
-                                     vtkIdType startBlockId,
-                                     vtkIdType endBlockId)
+                                     vtkIdType startSlabId,
+                                     vtkIdType endSlabId)
 {
   this->Id = ID;
-  double startPoint[3] = { 0.0 };
-  double startPointNeighbour[3] = { 0.0 };
-  double startNormal[3] = { 0.0 };
-  spline->GetPoint(startBlockId, startPoint);
-  spline->GetPoint(startBlockId + 1, startPointNeighbour);
-  vtkMath::Subtract(startPointNeighbour, startPoint, startNormal);
-
-  for (vtkIdType i = startBlockId + 1; i <= endBlockId + 1; i++) // +1, +1
+  for (vtkIdType i = startSlabId; i <= endSlabId; i++)
   {
+    /*
+     * The boundary plane at spline point 'i' is oriented along the spline
+     * segment ending at 'i', for the previous and for the next slabs.
+     * The first spline point has no previous segment.
+     */
+    double p1[3] = { 0.0 };
+    double p1Previous[3] = { 0.0 };
     double p2[3] = { 0.0 };
-    double p2Neighbour[3] = { 0.0 };
+    double startNormal[3] = { 0.0 };
     double endNormal[3] = { 0.0 };
-    spline->GetPoint(i, p2);
-    spline->GetPoint(i - 1, p2Neighbour);
-    vtkMath::Subtract(p2Neighbour, p2, endNormal);
+    spline->GetPoint(i, p1);
+    spline->GetPoint(i + 1, p2);
+    if (i == 0)
+    {
+      vtkMath::Subtract(p2, p1, startNormal);
+    }
+    else
+    {
+      spline->GetPoint(i - 1, p1Previous);
+      vtkMath::Subtract(p1, p1Previous, startNormal);
+    }
+    vtkMath::Subtract(p1, p2, endNormal);
 
+    // Set if either surface could not be clipped; the slab volumes are then unreliable.
+    bool failed = false;
+    double wallVolume = 0.0;
     vtkNew<vtkPolyData> clippedWall;
-    if (!logic->ClipClosedSurfaceWithClosedOutput(wallSurface, clippedWall,
-                                             startPoint, startNormal,
+    if (logic->ClipClosedSurfaceWithClosedOutput(wallSurface, clippedWall,
+                                             p1, startNormal,
                                              p2, endNormal))
     {
-      std::cerr << "Error clipping wall surface from id " << startBlockId
-              << " to " << i << "." << std::endl;
-      continue;
+      vtkNew<vtkMassProperties> wallProperties;
+      wallProperties->SetInputData(clippedWall);
+      wallProperties->Update();
+      wallVolume = wallProperties->GetVolume();
     }
+    else
+    {
+      failed = true;
+      mtx.lock();
+      std::cerr << "Error clipping wall surface from id " << i
+              << " to " << (i + 1) << "." << std::endl;
+      mtx.unlock();
+    }
+    double lumenVolume = 0.0;
     vtkNew<vtkPolyData> clippedLumen;
-    if (!logic->ClipClosedSurfaceWithClosedOutput(lumenSurface, clippedLumen,
-                                              startPoint, startNormal,
+    if (logic->ClipClosedSurfaceWithClosedOutput(lumenSurface, clippedLumen,
+                                              p1, startNormal,
                                               p2, endNormal))
     {
-      std::cerr << "Error clipping lumen surface from id " << startBlockId
-      << " to " << i << "." << std::endl;
-      continue;
+      vtkNew<vtkMassProperties> lumenProperties;
+      lumenProperties->SetInputData(clippedLumen);
+      lumenProperties->Update();
+      lumenVolume = lumenProperties->GetVolume();
     }
-    double distance = this->CalculateSplineDistance(spline, startBlockId, i);
-
-    vtkNew<vtkMassProperties> wallProperties;
-    wallProperties->SetInputData(clippedWall);
-    wallProperties->Update();
-    vtkNew<vtkMassProperties> lumenProperties;
-    lumenProperties->SetInputData(clippedLumen);
-    lumenProperties->Update();
-    double tuple[5] = {(double) startBlockId, (double) i, distance,
-                wallProperties->GetVolume(), lumenProperties->GetVolume()};
+    else
+    {
+      failed = true;
+      mtx.lock();
+      std::cerr << "Error clipping lumen surface from id " << i
+      << " to " << (i + 1) << "." << std::endl;
+      mtx.unlock();
+    }
+    double tuple[4] = {(double) i, wallVolume, lumenVolume, failed ? 1.0 : 0.0};
     bufferArray->InsertNextTuple(tuple);
   }
 }
-
-//------------------------------------------------------------------------------
-double VolumeComputeWorker::CalculateSplineDistance(vtkPolyData* spline, vtkIdType startId, vtkIdType endId)
-{
-  if (!spline || startId < 0 || endId < 0 || startId > endId)
-  {
-    mtx.lock();
-    std::cerr << "Invalid input, cannot calculate spline distance." << std::endl;
-    mtx.unlock();
-    return -1.0;
-  }
-  double length = 0.0;
-  for (vtkIdType splineId = startId; splineId < endId; splineId++)
-  {
-    double p1[3] = { 0.0 };
-    double p2[3] = { 0.0 };
-    spline->GetPoint(splineId, p1);
-    spline->GetPoint(splineId + 1, p2);
-    length += std::sqrt(vtkMath::Distance2BetweenPoints(p1, p2));
-  }
-  return length;
-}
-
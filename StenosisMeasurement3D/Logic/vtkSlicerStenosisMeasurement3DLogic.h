@@ -40,6 +40,7 @@
 #include <vtkMRMLTableNode.h>
 
 class vtkImageData;
+class vtkTable;
 
 /// \ingroup Slicer_QtModules_ExtensionTemplate
 class VTK_SLICER_STENOSISMEASUREMENT3D_MODULE_LOGIC_EXPORT vtkSlicerStenosisMeasurement3DLogic :
@@ -53,6 +54,14 @@ public:
 
   bool UpdateBoundaryControlPointPosition(int pointIndex, vtkMRMLMarkupsFiducialNode * fiducialNode,
                                           vtkMRMLMarkupsShapeNode * shapeNode);
+  /*
+   * These use an index of the trimmed spline of the tube, with cumulative
+   * arc lengths and a point locator. It is rebuilt when the tube is modified.
+   */
+  // Returns -1 if the tube does not have a valid spline.
+  vtkIdType FindClosestSplinePointId(vtkMRMLMarkupsShapeNode * shapeNode, double point[3]);
+  // Length of the spline between two spline points. Returns -1.0 on error.
+  double GetSplineDistance(vtkMRMLMarkupsShapeNode * shapeNode, vtkIdType startId, vtkIdType endId);
   // The caller must pass in an enclosed surface.
   bool Process(vtkMRMLMarkupsShapeNode * wallShapeNode, vtkPolyData * enclosedSurface,
                vtkMRMLMarkupsFiducialNode * boundaryFiducialNode,
@@ -66,7 +75,19 @@ public:
                     vtkPolyData * lesion);
 
   enum EnclosingType{Distinct = 0, Intersection, FirstIsEnclosed, SecondIsEnclosed, EnclosingType_Last};
-  // Both input surfaces *must* be closed. This may be time consuming.
+  /*
+   * Both input surfaces *must* be closed.
+   * Ray-parity test of the points of each surface against a locator built on
+   * the other one. It stops at the first point that proves an intersection.
+   * Unless the points are mixed, the cells are also tested for crossing
+   * before Distinct, FirstIsEnclosed or SecondIsEnclosed is returned.
+   */
+  EnclosingType ClassifyClosedSurfaceEnclosure(vtkPolyData * first, vtkPolyData * second);
+  /*
+   * Both input surfaces *must* be closed.
+   * The boolean filter is only run when 'enclosed' is requested and the
+   * surfaces intersect. EnclosingType_Last is returned if it fails.
+   */
   EnclosingType GetClosedSurfaceEnclosingType(vtkPolyData * first, vtkPolyData * second,
                                               vtkPolyData * enclosed = nullptr,
                                               bool firstIsPreProcessed = false,
@@ -89,8 +110,36 @@ public:
   bool ClipClosedSurfaceWithClosedOutput(vtkPolyData * input, vtkPolyData * output,
                   double * startOrigin, double * startNormal, double * endOrigin, double * endNormal);
 
+  /*
+   * The wall and the lumen are clipped once between each pair of consecutive
+   * spline points, and the slab volumes are cumulated from the first spline point.
+   * The volumes between any two spline points are then differences of the
+   * cumulative values.
+   * Output columns: SplineId, Distance, WallVolume, LumenVolume, FailedSlabs.
+   * FailedSlabs is the cumulative count of slabs that could not be clipped;
+   * their volumes are missing. The table is then filled, but false is returned.
+   */
+  bool ComputeCumulativeVolumes(vtkMRMLMarkupsShapeNode * wallShapeNode, vtkPolyData * enclosedSurface,
+                                vtkTable * cumulativeVolumes);
+  /*
+   * Volumes between two spline points, from a table of ComputeCumulativeVolumes(),
+   * in constant time. The values are those of a row of the BoundVolumes table:
+   * StartId, EndId, Distance, WallVolume, LumenVolume, LesionVolume,
+   * Stenosis, LesionVolumePerCm, StenosisPerCm.
+   * Ratios that cannot be calculated are -1.0.
+   * Returns false if the range includes a slab that could not be clipped.
+   */
+  bool GetBoundVolumes(vtkTable * cumulativeVolumes, vtkIdType startId, vtkIdType endId,
+                       vtkVariantArray * result);
+  /*
+   * In compact mode, only the CumulativeVolumes table is stored.
+   * BoundVolumes is then a view, evaluated on query, and the database
+   * grows linearly with the number of spline points.
+   * If the view or its index cannot be created, the file is removed
+   * and false is returned.
+   */
   bool DumpAggregateVolumes(vtkMRMLMarkupsShapeNode * wallShapeNode, vtkPolyData * enclosedSurface,
-                           std::string filepath);
+                           std::string filepath, bool compact = false);
 
   int GetNumberOfRegionsInSegment(vtkMRMLSegmentationNode * segmentation, const std::string& segmentID);
   bool UpdateSegmentBySmoothClosing(vtkMRMLSegmentationNode * segmentation, const std::string& segmentID, double kernel = 1.1);
@@ -110,12 +159,16 @@ protected:
                                     vtkMRMLMarkupsShapeNode * shapeNode,
                                     vtkDoubleArray * result);
   bool DefineOutputTable(vtkMRMLTableNode * outputTableNode);
+  // The trimmed spline of the index. Do not modify it. Returns nullptr if the tube does not have a valid spline.
+  vtkPolyData * GetIndexedSpline(vtkMRMLMarkupsShapeNode * shapeNode);
   bool ComputeResults(vtkMRMLMarkupsShapeNode * inputShapeNode,
                       vtkMRMLMarkupsFiducialNode * inputFiducialNode,
                       vtkPolyData * wallClosedPolyData,
                       vtkPolyData * lumenClosedPolyData,
                       vtkVariantArray * results, const std::string& studyName);
 private:
+  class vtkInternal;
+  vtkInternal * Internal;
 
   vtkSlicerStenosisMeasurement3DLogic(const vtkSlicerStenosisMeasurement3DLogic&); // Not implemented
   void operator=(const vtkSlicerStenosisMeasurement3DLogic&); // Not implemented
@@ -186,10 +186,17 @@ void qSlicerStenosisMeasurement3DModuleWidget::addMenu()
   actionDumpVolumes->setObjectName("ActionDumpAggregateVolumesToDatabase");
   actionDumpVolumes->setToolTip(qSlicerStenosisMeasurement3DModuleWidget::tr("Attempt to save a database containing aggregate volumes of the study in your document directory."));
 
+  QAction * actionDumpCompactVolumes = applyButtonMenu->addAction(qSlicerStenosisMeasurement3DModuleWidget::tr("Dump aggregate volumes to compact database"));
+  actionDumpCompactVolumes->setData(2);
+  actionDumpCompactVolumes->setObjectName("ActionDumpAggregateVolumesToCompactDatabase");
+  actionDumpCompactVolumes->setToolTip(qSlicerStenosisMeasurement3DModuleWidget::tr("Attempt to save a database containing cumulative volumes of the study in your document directory. Aggregate volumes are calculated on query."));
+
   QObject::connect(actionClearCache, SIGNAL(triggered()),
                    this, SLOT(clearLumenCache()));
   QObject::connect(actionDumpVolumes, SIGNAL(triggered()),
                    this, SLOT(dumpAggregateVolumes()));
+  QObject::connect(actionDumpCompactVolumes, SIGNAL(triggered()),
+                   this, SLOT(dumpCompactAggregateVolumes()));
 }
 
 //-----------------------------------------------------------------------------
@@ -773,7 +780,7 @@ qSlicerStenosisMeasurement3DModuleWidget::createEnclosedSurface(vtkMRMLMarkupsSh
   }
   if (enclosingType == vtkSlicerStenosisMeasurement3DLogic::Distinct)
   {
-    // They don't intersect or vtkBooleanOperationPolyDataFilter could not handle them.
+    // They don't intersect.
     std::cerr << "Input tube and input lumen could not be intersected." << std::endl;
     return enclosingType;
   }
@@ -807,7 +814,7 @@ bool qSlicerStenosisMeasurement3DModuleWidget::getEnclosedSurface(vtkMRMLMarkups
     }
     if (enclosingType == vtkSlicerStenosisMeasurement3DLogic::Distinct)
     {
-      // They don't intersect or vtkBooleanOperationPolyDataFilter could not handle them.
+      // They don't intersect.
       this->showStatusMessage(qSlicerStenosisMeasurement3DModuleWidget::tr("Error: input tube and input lumen could not be intersected."), 5000);
       return false;
     }
@@ -936,6 +943,18 @@ void qSlicerStenosisMeasurement3DModuleWidget::clearLumenCache()
 
 //-----------------------------------------------------------------------------
 void qSlicerStenosisMeasurement3DModuleWidget::dumpAggregateVolumes()
+{
+  this->dumpAggregateVolumesToDatabase(false);
+}
+
+//-----------------------------------------------------------------------------
+void qSlicerStenosisMeasurement3DModuleWidget::dumpCompactAggregateVolumes()
+{
+  this->dumpAggregateVolumesToDatabase(true);
+}
+
+//-----------------------------------------------------------------------------
+void qSlicerStenosisMeasurement3DModuleWidget::dumpAggregateVolumesToDatabase(bool compact)
 {
   Q_D(qSlicerStenosisMeasurement3DModuleWidget);
   if (!d->parameterNode)
@@ -962,7 +981,7 @@ void qSlicerStenosisMeasurement3DModuleWidget::dumpAggregateVolumes()
   d->setLumenCache(enclosedSurface);
 
   this->showStatusMessage(qSlicerStenosisMeasurement3DModuleWidget::tr("Processing, this can be long running, please wait..."));
-  if (!this->logic->DumpAggregateVolumes(wallShapeNode, enclosedSurface, dbPath.toStdString()))
+  if (!this->logic->DumpAggregateVolumes(wallShapeNode, enclosedSurface, dbPath.toStdString(), compact))
   {
     this->showStatusMessage(qSlicerStenosisMeasurement3DModuleWidget::tr("Error dumping aggregate volumes to database."), 10000);
     return;
@@ -66,6 +66,7 @@ protected slots:
   void onPreProcessWallChanged(bool checked);
   void clearLumenCache();
   void dumpAggregateVolumes();
+  void dumpCompactAggregateVolumes();
   void updateSegmentBySmoothClosing();
 
 protected:
@@ -104,6 +105,7 @@ protected:
   void setDefaultParameters(vtkMRMLNode * node);
   void updateGuiFromParameterNode();
   void addMenu();
+  void dumpAggregateVolumesToDatabase(bool compact);
   void updateRegionInfo();
 
 private: